@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+import click
+import os
+import pytest
+import zazu.build
+import zazu.compiler_cache_helper
+
+
+def test_split_jobs_shares_the_budget():
+    assert zazu.build.split_jobs(8, 3) == [3, 3, 2]
+    assert zazu.build.split_jobs(2, 4) == [1, 1, 1, 1]
+
+
+def test_resolve_arches():
+    component = zazu.build.ComponentConfiguration({'name': 'c',
+                                                   'goals': [{'name': 'package',
+                                                              'builds': [{'arch': 'x86_64-linux-gcc'},
+                                                                         {'arch': 'local'}]}]})
+    assert zazu.build.resolve_arches(component, 'package', 'all') == ['local', 'x86_64-linux-gcc']
+    assert zazu.build.resolve_arches(component, 'package', 'local, arm32-linux-gnueabihf') == [
+        'local', 'arm32-linux-gnueabihf']
+
+
+def test_goal_order_and_dependencies():
+    component = zazu.build.ComponentConfiguration({'name': 'c',
+                                                   'goals': [{'name': 'package', 'depends': ['test', 'docs'],
+                                                              'builds': [{'arch': 'local'}, {'arch': 'arm'}]},
+                                                             {'name': 'test', 'depends': ['lib'],
+                                                              'builds': [{'arch': 'local'}]},
+                                                             {'name': 'docs', 'builds': [{'arch': 'docs'}]},
+                                                             {'name': 'lib', 'builds': [{'arch': 'local'}]}]})
+    order = component.goal_order('package')
+    assert order.index('lib') < order.index('test') < order.index('package')
+    assert order.index('docs') < order.index('package')
+    nodes = [('c', 'package', 'local'), ('c', 'package', 'arm'), ('c', 'test', 'local'), ('c', 'docs', 'docs'),
+             ('c', 'lib', 'local')]
+    dependencies = zazu.build.node_dependencies({'c': component}, nodes)
+    assert dependencies[('c', 'package', 'local')] == [('c', 'test', 'local'), ('c', 'docs', 'docs')]
+    assert dependencies[('c', 'package', 'arm')] == [('c', 'test', 'local'), ('c', 'docs', 'docs')]
+    assert dependencies[('c', 'test', 'local')] == [('c', 'lib', 'local')]
+
+
+def test_goal_cycle():
+    component = zazu.build.ComponentConfiguration({'name': 'c',
+                                                   'goals': [{'name': 'a', 'depends': ['b'], 'builds': []},
+                                                             {'name': 'b', 'depends': ['a'], 'builds': []}]})
+    with pytest.raises(click.ClickException):
+        component.goal_order('a')
+
+
+def make_components():
+    return zazu.build.load_components({'components': [
+        {'name': 'app', 'path': 'apps/app', 'depends': ['lib'], 'isolatedSources': True,
+         'goals': [{'name': 'package', 'builds': []}]},
+        {'name': 'lib', 'path': 'libs/lib/', 'goals': [{'name': 'package', 'builds': []}]},
+        {'name': 'tools', 'path': 'tools', 'goals': [{'name': 'package', 'builds': []}]}]})
+
+
+def test_affected_components():
+    components = make_components()
+    assert zazu.build.affected_components(components, ['libs/lib/src/a.c']) == {'lib', 'app'}
+    assert zazu.build.affected_components(components, ['apps/app/main.c', 'apps/application/x']) == {'app'}
+    assert zazu.build.affected_components(components, ['README.md', 'tools/build/local-release/tool']) == set()
+    assert zazu.build.affected_components(components, ['zazu.yaml']) == {'app', 'lib', 'tools'}
+    by_name = {c.name(): c for c in components}
+    assert zazu.build.source_paths(by_name, 'app') == ['apps/app', 'libs/lib']
+    assert zazu.build.source_paths(by_name, 'lib') is None
+    assert zazu.build.component_artifacts('apps/app', ['build/*/app => out', '-: build/*/app.map']) == [
+        'apps/app/build/*/app => out', '-:apps/app/build/*/app.map']
+    assert zazu.build.find_component(components, '/repo', '/repo/libs/lib/src').name() == 'lib'
+    assert zazu.build.find_component(components, '/repo', '/repo').name() == 'app'
+
+
+def test_component_dependencies():
+    by_name = {c.name(): c for c in make_components()}
+    nodes = [('app', 'package', 'local'), ('app', 'package', 'arm'), ('lib', 'package', 'local'),
+             ('tools', 'package', 'local')]
+    dependencies = zazu.build.node_dependencies(by_name, nodes)
+    assert dependencies[('app', 'package', 'local')] == [('lib', 'package', 'local')]
+    assert dependencies[('app', 'package', 'arm')] == [('lib', 'package', 'local')]
+    assert dependencies[('tools', 'package', 'local')] == []
+    assert zazu.build.node_label(('app', 'package', 'arm'), nodes) == 'app:arm'
+    with pytest.raises(click.ClickException):
+        zazu.build.load_components({'components': [{'name': 'a', 'depends': ['b'], 'goals': []}]})
+
+
+def test_script_steps():
+    steps = zazu.build.script_steps(['echo first',
+                                     {'name': 'docs', 'run': 'make docs', 'inputs': ['src'], 'outputs': ['docs']},
+                                     {'name': 'wheel', 'run': ['make', 'make wheel']},
+                                     {'name': 'tarball', 'depends': ['docs', 'wheel'], 'run': 'make tarball'},
+                                     'echo last'])
+    assert [s.name for s in steps] == ['step1', 'docs', 'wheel', 'tarball', 'step5']
+    assert steps[1].depends == ['step1']
+    assert steps[2].commands == ['make', 'make wheel']
+    assert steps[3].depends == ['docs', 'wheel', 'step1']
+    assert steps[4].depends == ['step1', 'docs', 'wheel', 'tarball']
+    step = zazu.build.script_steps([{'name': 'a', 'run': 'true'},
+                                    {'name': 'b', 'run': 'true', 'depends': 'a', 'inputs': 'src', 'outputs': 'out'}])[1]
+    assert (step.depends, step.inputs, step.outputs) == (['a'], ['src'], ['out'])
+    with pytest.raises(click.ClickException):
+        zazu.build.script_steps([{'name': 'a', 'run': 'true', 'depends': ['b']}])
+    with pytest.raises(click.ClickException):
+        zazu.build.script_steps([{'name': 'a', 'run': 'true'}, {'name': 'a', 'run': 'true'}])
+
+
+def test_script_build(tmpdir):
+    calls = []
+    lines = []
+
+    def call(command, prefix=None, echo=None, cancelled=None, **kwargs):
+        calls.append((command, prefix))
+        if echo is not None:
+            echo(prefix + command.split(' ', 1)[1])
+        return int(command == 'false')
+    # Commands that can't overlap run in order through call with their output as is
+    spec = zazu.build.BuildSpec('package', script=['echo one', 'echo two'])
+    zazu.build.script_build(str(tmpdir), spec, {}, True, lines.append, call, jobs=4)
+    assert calls == [('echo one', None), ('echo two', None)]
+    assert lines == ['echo one', 'echo two']
+    # Steps that can overlap run concurrently with their output prefixed
+    del calls[:], lines[:]
+    spec = zazu.build.BuildSpec('package', script=[{'name': 'a', 'run': 'echo a'}, {'name': 'b', 'run': 'echo b'},
+                                                   {'name': 'c', 'depends': ['a', 'b'], 'run': 'echo c'}])
+    zazu.build.script_build(str(tmpdir), spec, {}, False, lines.append, call, jobs=4)
+    assert sorted(calls[:2]) == [('echo a', '[a] '), ('echo b', '[b] ')]
+    assert calls[2:] == [('echo c', '[c] ')]
+    assert sorted(lines) == ['[a] a', '[b] b', '[c] c']
+    # Without an injected call the commands run through zazu.util.call_prefixed
+    del lines[:]
+    zazu.build.script_build(str(tmpdir), spec, {}, False, lines.append, jobs=4)
+    assert sorted(lines) == ['[a] a', '[b] b', '[c] c']
+    del calls[:]
+    spec = zazu.build.BuildSpec('package', script=['true', 'false', 'echo never'])
+    with pytest.raises(click.ClickException):
+        zazu.build.script_build(str(tmpdir), spec, {}, False, lines.append, call, jobs=4)
+    assert calls == [('true', None), ('false', None)]
+
+
+def test_step_up_to_date(tmpdir):
+    repo_root = str(tmpdir)
+    step = zazu.build.ScriptStep('docs', ['make docs'], [], ['src'], ['docs.txt'])
+    source = tmpdir.mkdir('src').join('a.c')
+    output = tmpdir.join('docs.txt')
+    source.write('')
+    output.write('')
+    source.setmtime(100)
+    output.setmtime(200)
+    assert zazu.build.step_up_to_date(repo_root, step)
+    assert not zazu.build.step_up_to_date(repo_root, step._replace(inputs=[]))
+    source.setmtime(300)
+    assert not zazu.build.step_up_to_date(repo_root, step)
+    output.remove()
+    assert not zazu.build.step_up_to_date(repo_root, step)
+
+
+def test_cmake_build_runs_with_env(tmpdir):
+    calls = []
+
+    def call(args, **kwargs):
+        calls.append(kwargs.get('env'))
+        return 0
+    env = dict(os.environ)
+    env['CCACHE_DIR'] = str(tmpdir.join('ccache'))
+    zazu.build.cmake_build(str(tmpdir), 'local', 'release', 'all', False, {'ZAZU_BUILD_VERSION': '1.0.0'}, 1,
+                           call=call, env=env)
+    assert calls and all(e is env for e in calls)
+
+
+def test_compiler_cache_is_only_used_by_cmake_builds(tmpdir):
+    compiler_cache = zazu.compiler_cache_helper.CompilerCache('ccache', '/usr/bin/ccache')
+    spec = zazu.build.BuildSpec('package', script=['true'])
+    zazu.build.build_spec(str(tmpdir), 'local', spec, {}, False, 1, echo=lambda text: None,
+                          compiler_cache=compiler_cache)
+    assert not compiler_cache.used
+    spec = zazu.build.BuildSpec('all', vars={'ZAZU_BUILD_VERSION': '1.0.0'})
+    zazu.build.build_spec(str(tmpdir), 'local', spec, spec.build_vars(), False, 1, echo=lambda text: None,
+                          call=lambda args, **kwargs: 0, compiler_cache=compiler_cache)
+    assert compiler_cache.used
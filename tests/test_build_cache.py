@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+import git
+import io
+import tarfile
+import threading
+import zazu.build
+import zazu.build_cache
+
+
+def make_repo(tmpdir):
+    repo = git.Repo.init(str(tmpdir))
+    repo.git.config('user.email', 'test@example.com')
+    repo.git.config('user.name', 'test')
+    return repo
+
+
+def test_fingerprint_follows_sources_but_not_build_number(tmpdir):
+    repo = make_repo(tmpdir)
+    tmpdir.join('main.c').write('int main(void){return 0;}\n')
+    repo.git.add('main.c')
+    repo.git.commit('-m', 'initial')
+    spec = zazu.build.BuildSpec('all', artifacts=['build/*/demo'], versioned_artifacts=False)
+
+    def fingerprint(build_number, spec=spec):
+        return zazu.build_cache.goal_fingerprint(str(tmpdir), 'local', spec, {'ZAZU_BUILD_NUMBER': build_number},
+                                                 tools=[])
+    original = fingerprint('1')
+    assert fingerprint('2') == original
+    versioned_spec = zazu.build.BuildSpec('all', artifacts=['build/*/demo'])
+    assert fingerprint('1', versioned_spec) != fingerprint('2', versioned_spec)
+    tmpdir.join('build', 'local-minSizeRel', 'demo').write('binary', ensure=True)
+    assert fingerprint('3') == original
+    tmpdir.join('main.c').write('int main(void){return 1;}\n')
+    assert fingerprint('4') != original
+
+
+def test_fingerprint_covers_the_native_build_tool(tmpdir, monkeypatch):
+    make_repo(tmpdir)
+    assert zazu.build_cache.fingerprint_tools('local', 'ninja')[:2] == ['cmake', 'ninja']
+    assert zazu.build_cache.fingerprint_tools('local')[:2] == ['cmake', 'make']
+    assert zazu.build_cache.fingerprint_tools('x86_64-win-msvc_2015')[:2] == ['cmake', 'msbuild']
+    versions = {'ninja': '1.8.2'}
+    monkeypatch.setattr(zazu.build_cache, 'tool_version', lambda tool: versions.get(tool, ''))
+    spec = zazu.build.BuildSpec('all', artifacts=['build/*/demo'], generator='ninja')
+    original = zazu.build_cache.goal_fingerprint(str(tmpdir), 'local', spec, {})
+    versions['ninja'] = '1.10.0'
+    assert zazu.build_cache.goal_fingerprint(str(tmpdir), 'local', spec, {}) != original
+
+
+def test_component_fingerprint_follows_its_sources(tmpdir):
+    repo = make_repo(tmpdir)
+    tmpdir.join('lib', 'lib.c').write('int lib(void){return 0;}\n', ensure=True)
+    tmpdir.join('app', 'main.c').write('int main(void){return 0;}\n', ensure=True)
+    repo.git.add('.')
+    repo.git.commit('-m', 'initial')
+    spec = zazu.build.BuildSpec('all', artifacts=['build/*/demo'])
+
+    def fingerprint(source_paths=['app', 'lib']):
+        return zazu.build_cache.goal_fingerprint(str(tmpdir), 'local', spec, {}, tools=[], path='app',
+                                                 source_paths=source_paths)
+    original = fingerprint()
+    whole_repo = fingerprint(None)
+    tmpdir.join('README.md').write('readme')
+    tmpdir.join('app', 'build', 'local-minSizeRel', 'demo').write('binary', ensure=True)
+    assert fingerprint() == original
+    # Components that don't isolate their sources are built from the whole repo
+    assert fingerprint(None) != whole_repo
+    tmpdir.join('lib', 'lib.c').write('int lib(void){return 1;}\n')
+    changed = fingerprint()
+    assert changed != original
+    repo.git.add('.')
+    repo.git.commit('-m', 'change lib')
+    assert fingerprint() not in (original, changed)
+
+
+def test_new_tag_misses_the_cache(tmpdir):
+    repo = make_repo(tmpdir.join('repo'))
+    repo_root = tmpdir.join('repo')
+    repo_root.join('main.c').write('int main(void){return 0;}\n')
+    repo.git.add('main.c')
+    repo.git.commit('-m', 'initial')
+    cache = zazu.build_cache.BuildCache(str(tmpdir.join('cache')))
+    spec = zazu.build.BuildSpec('package', artifacts=['version.txt'],
+                                script=['echo $ZAZU_BUILD_VERSION > version.txt'])
+
+    def build():
+        zazu.build.build_spec(str(repo_root), 'local', spec, {}, False, cache=cache, build_num=1)
+        return repo_root.join('version.txt').read()
+    assert build().startswith('0.0.0')
+    repo.git.tag('-a', 'v1.0.0', '-m', 'release')
+    assert build().startswith('1.0.0')
+
+
+def test_store_and_restore_artifacts(tmpdir):
+    repo_root = tmpdir.join('repo')
+    repo_root.join('build', 'demo').write('binary', ensure=True)
+    cache = zazu.build_cache.BuildCache(str(tmpdir.join('cache')))
+    assert not cache.restore('ab' * 20, str(repo_root))
+    paths = zazu.build_cache.artifact_paths(str(repo_root), ['build/demo => dist'])
+    assert paths == ['build/demo']
+    assert zazu.build_cache.artifact_paths(str(repo_root), ['build/missing']) is None
+    cache.store('ab' * 20, str(repo_root), paths)
+    repo_root.join('build', 'demo').remove()
+    assert cache.restore('ab' * 20, str(repo_root))
+    assert repo_root.join('build', 'demo').read() == 'binary'
+
+
+def test_artifact_rules(tmpdir):
+    for path in ['dist/a.whl', 'dist/sub/b.whl', 'dist/sub/b.txt', 'docs/html/index.html', 'docs/html/_static/x.css']:
+        tmpdir.join(path).write('x', ensure=True)
+    repo_root = str(tmpdir)
+    assert zazu.build_cache.artifact_paths(repo_root, ['dist/**/*.whl']) == ['dist/a.whl', 'dist/sub/b.whl']
+    assert zazu.build_cache.artifact_paths(repo_root, ['dist/*.whl => wheels']) == ['dist/a.whl']
+    assert zazu.build_cache.artifact_paths(repo_root, ['+:docs/html => docs', '-:docs/html/_static/**']) == [
+        'docs/html/index.html']
+    assert zazu.build_cache.artifact_paths(repo_root, ['dist/**/*.whl', 'dist/**/*.tar.gz']) is None
+
+
+def test_prune_ignores_entries_removed_meanwhile(tmpdir, monkeypatch):
+    cache = zazu.build_cache.BuildCache(str(tmpdir.join('cache')), max_bytes=0)
+    tmpdir.join('repo', 'a').write('x', ensure=True)
+    cache.store('ab' * 20, str(tmpdir.join('repo')), ['a'])
+    walk = zazu.build_cache.os.walk
+    monkeypatch.setattr(zazu.build_cache.os, 'walk',
+                        lambda *args: [(root, dirs, files + ['gone.tar']) for root, dirs, files in walk(*args)])
+    cache.store('cd' * 20, str(tmpdir.join('repo')), ['a'])
+    assert not cache.contains('ab' * 20)
+
+
+def test_unsafe_entries_are_not_extracted(tmpdir):
+    cache = zazu.build_cache.BuildCache(str(tmpdir.join('cache')))
+    repo_root = tmpdir.join('repo').ensure(dir=True)
+    for name, kind in [('../evil', tarfile.REGTYPE), ('build/link', tarfile.SYMTYPE), ('/tmp/evil', tarfile.REGTYPE)]:
+        entry = tmpdir.join('cache', 'ab', '{}.tar'.format('ab' * 20))
+        entry.dirpath().ensure(dir=True)
+        with tarfile.open(str(entry), 'w') as archive:
+            member = tarfile.TarInfo(name)
+            member.type = kind
+            member.linkname = '/etc/passwd'
+            member.size = 0 if kind == tarfile.SYMTYPE else 4
+            archive.addfile(member, io.BytesIO(b'evil'))
+        assert not cache.restore('ab' * 20, str(repo_root))
+        assert not entry.check()
+    assert not tmpdir.join('evil').check()
+    assert not repo_root.join('build', 'link').check(link=True)
+
+
+class CacheHandler(BaseHTTPRequestHandler):
+    """A stand in for a remote build cache server that keeps what is PUT to it in memory"""
+    entries = {}
+
+    def do_GET(self):
+        if self.path not in self.entries:
+            self.send_response(404)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(self.entries[self.path])))
+        self.end_headers()
+        self.wfile.write(self.entries[self.path])
+
+    def do_PUT(self):
+        self.entries[self.path] = self.rfile.read(int(self.headers['Content-Length']))
+        self.send_response(201)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def test_remote_cache_shares_entries(tmpdir):
+    server = HTTPServer(('127.0.0.1', 0), CacheHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        url = 'http://127.0.0.1:{}/cache'.format(server.server_address[1])
+        fingerprint = 'cd' * 32
+        repo_root = tmpdir.join('repo')
+        repo_root.join('build', 'demo').write('binary', ensure=True)
+        agent_cache = zazu.build_cache.BuildCache(str(tmpdir.join('agent')),
+                                                  remote=zazu.build_cache.make_remote_cache({'url': url}))
+        agent_cache.store(fingerprint, str(repo_root), ['build/demo'])
+        agent_cache.wait()
+        assert '/cache/cd/{}.json'.format(fingerprint) in CacheHandler.entries
+
+        repo_root.join('build', 'demo').remove()
+        remote = zazu.build_cache.make_remote_cache({'url': url, 'readOnly': True})
+        developer_cache = zazu.build_cache.BuildCache(str(tmpdir.join('developer')), remote=remote)
+        assert developer_cache.restore(fingerprint, str(repo_root))
+        assert repo_root.join('build', 'demo').read() == 'binary'
+
+        # Corrupt entries are ignored and read only caches don't upload
+        CacheHandler.entries['/cache/cd/{}.tar'.format(fingerprint)] = b'garbage'
+        other = zazu.build_cache.BuildCache(str(tmpdir.join('other')), remote=remote)
+        assert not other.restore(fingerprint, str(repo_root))
+        developer_cache.store('ef' * 32, str(repo_root), ['build/demo'])
+        developer_cache.wait()
+        assert not any('ef' * 32 in path for path in CacheHandler.entries)
+
+        # Entries are uploaded even if pruning drops them from the local cache first
+        pruned_cache = zazu.build_cache.BuildCache(str(tmpdir.join('pruned')), max_bytes=0,
+                                                   remote=zazu.build_cache.make_remote_cache({'url': url}))
+        pruned_cache.store('01' * 32, str(repo_root), ['build/demo'])
+        pruned_cache.wait()
+        assert not pruned_cache.contains('01' * 32)
+        assert '/cache/01/{}.json'.format('01' * 32) in CacheHandler.entries
+        assert tmpdir.join('pruned').listdir() == [tmpdir.join('pruned', '01')]
+        assert tmpdir.join('pruned', '01').listdir() == []
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+import zazu.build_history
+
+
+def test_estimate_from_recent_builds(tmpdir):
+    history = zazu.build_history.BuildHistory('/repo', str(tmpdir.join('history.db')))
+    assert history.estimate('package', 'local', 'release') is None
+    history.record('package', 'local', 'release', 1.0, restored=True)
+    assert history.estimate('package', 'local', 'release') == 1.0
+    for duration in [30.0, 10.0, 20.0]:
+        history.record('package', 'local', 'release', duration)
+    assert history.estimate('package', 'local', 'release') == 20.0
+    assert history.estimate('package', 'local', 'debug') is None
+    other_repo = zazu.build_history.BuildHistory('/other', str(tmpdir.join('history.db')))
+    assert other_repo.estimate('package', 'local', 'release') is None
+
+
+def test_old_builds_are_dropped(tmpdir, monkeypatch):
+    monkeypatch.setattr(zazu.build_history, 'history_length', 2)
+    history = zazu.build_history.BuildHistory('/repo', str(tmpdir.join('history.db')))
+    for duration in [100.0, 1.0, 2.0]:
+        history.record('package', 'local', 'release', duration)
+    assert history.estimate('package', 'local', 'release') == 2.0
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+import os
+import subprocess
+import sys
+
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that are expensive to import and are not needed to style code, the pre-commit hook pays for these on every commit
+heavy_modules = ['jira', 'github', 'pyteamcity', 'teamcity', 'inquirer', 'semantic_version', 'pkg_resources',
+                 'keyring', 'zazu.build', 'zazu.dev.commands', 'zazu.repo.commands', 'zazu.tool.commands']
+
+
+def imported_modules(code):
+    """Runs code in a fresh interpreter and returns the set of modules it imported"""
+    script = '{}\nimport sys\nprint("\\n".join(sys.modules.keys()))'.format(code)
+    output = subprocess.check_output([sys.executable, '-c', script], cwd=repo_root)
+    return set(output.decode('utf-8').split())
+
+
+def test_style_does_not_import_unrelated_commands():
+    modules = imported_modules('import zazu.cli\nzazu.cli.cli.get_command(None, "style")')
+    assert 'zazu.style' in modules
+    assert not [m for m in heavy_modules if m in modules]
+
+
+def test_lazy_commands_are_listed_and_resolved():
+    import zazu.cli
+    assert zazu.cli.cli.list_commands(None) == sorted(zazu.cli.lazy_commands.keys())
+    for name in zazu.cli.lazy_commands:
+        assert zazu.cli.cli.get_command(None, name).name == name
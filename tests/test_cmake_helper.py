@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+import zazu.cmake_helper
+
+
+def test_generator_override():
+    assert zazu.cmake_helper.architecture_to_generator('local') == 'Unix Makefiles'
+    assert zazu.cmake_helper.architecture_to_generator('local', 'ninja') == 'Ninja'
+    assert zazu.cmake_helper.architecture_to_generator('x86_64-win-msvc_2015', 'Ninja') == 'Ninja'
+
+
+def test_native_build_args_limit_jobs_and_load():
+    load = zazu.cmake_helper.load_limit()
+    assert zazu.cmake_helper.native_build_args('Ninja', 3, True) == ['-j3', '-l{}'.format(load), '-v']
+    assert zazu.cmake_helper.native_build_args('Unix Makefiles', 2, False) == ['-j2', '-l{}'.format(load)]
+    assert zazu.cmake_helper.native_build_args('NMake Makefiles', 2, False) == []
+
+
+def test_generator_change_clears_cache(tmpdir):
+    tmpdir.join('CMakeCache.txt').write('CMAKE_GENERATOR:INTERNAL=Unix Makefiles\n')
+    tmpdir.join('CMakeFiles', 'x').write('', ensure=True)
+    assert zazu.cmake_helper.cached_generator(str(tmpdir)) == 'Unix Makefiles'
+    calls = []
+
+    def call(args, cwd):
+        calls.append(args)
+        return 0
+    assert zazu.cmake_helper.configure('/src', str(tmpdir), 'local', 'release', {'ZAZU_BUILD_VERSION': '1.0.0'},
+                                       call=call, generator='ninja') == 0
+    assert calls[0][2:4] == ['-G', 'Ninja']
+    assert not tmpdir.join('CMakeCache.txt').check()
+    assert not tmpdir.join('CMakeFiles').check()
+
+
+def test_compiler_launcher(tmpdir):
+    calls = []
+
+    def call(args, cwd):
+        calls.append(args)
+        return 0
+    variables = {'ZAZU_BUILD_VERSION': '1.0.0'}
+    zazu.cmake_helper.configure('/src', str(tmpdir), 'local', 'release', variables, call=call,
+                                compiler_launcher='/usr/bin/ccache')
+    assert '-DCMAKE_C_COMPILER_LAUNCHER=/usr/bin/ccache' in calls[0]
+    assert '-DCMAKE_CXX_COMPILER_LAUNCHER=/usr/bin/ccache' in calls[0]
+    zazu.cmake_helper.configure('/src', str(tmpdir), 'local', 'release', variables, call=call)
+    assert '-UCMAKE_C_COMPILER_LAUNCHER' in calls[1]
+    assert '-UCMAKE_CXX_COMPILER_LAUNCHER' in calls[1]
+
+
+def test_version_change_does_not_reconfigure(tmpdir):
+    calls = []
+
+    def call(args, cwd):
+        calls.append(args)
+        tmpdir.join('CMakeCache.txt').write('')
+        return 0
+    first = {'ZAZU_BUILD_VERSION': '1.0.0-1', 'ZAZU_BUILD_NUMBER': '1', 'A': '1', 'B': '2'}
+    second = {'B': '2', 'ZAZU_BUILD_NUMBER': '2', 'A': '1', 'ZAZU_BUILD_VERSION': '1.0.0-2'}
+    for variables in [first, second]:
+        zazu.cmake_helper.configure('/src', str(tmpdir), 'local', 'release', variables, call=call)
+    assert len(calls) == 1
+    assert '#define ZAZU_BUILD_VERSION "1.0.0-2"' in tmpdir.join('zazu_version.h').read()
+    assert 'set(CPACK_PACKAGE_VERSION "1.0.0-2")' in tmpdir.join('zazu_version.cmake').read()
+    zazu.cmake_helper.configure('/src', str(tmpdir), 'local', 'release', dict(second, A='3'), call=call)
+    assert len(calls) == 2
+
+
+def test_project_cpack_config_file_is_included(tmpdir, capsys):
+    calls = []
+
+    def call(args, cwd):
+        calls.append(args)
+        tmpdir.join('CMakeCache.txt').write('')
+        tmpdir.join('CPackConfig.cmake').write('set(CPACK_PROJECT_CONFIG_FILE "/src/cmake/own.cmake")\n')
+        return 0
+    variables = {'ZAZU_BUILD_VERSION': '1.0.0', 'CPACK_PROJECT_CONFIG_FILE': 'cmake/own.cmake'}
+    zazu.cmake_helper.configure('/src', str(tmpdir), 'local', 'release', variables, call=call)
+    assert '-DCPACK_PROJECT_CONFIG_FILE={}'.format(tmpdir.join('zazu_version.cmake')) in calls[0]
+    script = tmpdir.join('zazu_version.cmake').read().splitlines()
+    assert script[1] == 'include("/src/cmake/own.cmake")'
+    # The project set its own file in CMakeLists.txt, which cpack loads instead of the version script
+    assert 'CPACK_PROJECT_CONFIG_FILE' in capsys.readouterr()[0]
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+import click
+import json
+import os
+import pytest
+import zazu.compiler_cache_helper
+
+
+def test_parse_ccache_stats():
+    # ccache 3 and 4 name the hit counters differently
+    assert zazu.compiler_cache_helper.parse_ccache_stats('stats_updated_timestamp\t0\ncache_hit_direct\t5\n'
+                                                         'cache_hit_preprocessed\t2\ncache_miss\t3\n') == \
+        {'hits': 7, 'misses': 3}
+    assert zazu.compiler_cache_helper.parse_ccache_stats('direct_cache_hit\t1\npreprocessed_cache_hit\t1\n') == \
+        {'hits': 2, 'misses': 0}
+    with pytest.raises(ValueError):
+        zazu.compiler_cache_helper.parse_ccache_stats('unknown option')
+
+
+def test_parse_sccache_stats():
+    output = json.dumps({'stats': {'cache_hits': {'counts': {'C/C++': 4, 'Rust': 1}},
+                                   'cache_misses': {'counts': {'C/C++': 2}}}})
+    assert zazu.compiler_cache_helper.parse_sccache_stats(output) == {'hits': 5, 'misses': 2}
+
+
+def test_stats_delta_and_format():
+    delta = zazu.compiler_cache_helper.stats_delta({'hits': 2, 'misses': 5}, {'hits': 5, 'misses': 6})
+    assert delta == {'hits': 3, 'misses': 1}
+    assert zazu.compiler_cache_helper.stats_delta(None, delta) is None
+    assert zazu.compiler_cache_helper.format_stats('ccache', delta) == \
+        'Compiler cache (ccache): 3 hits, 1 misses (75% hit rate)'
+
+
+def test_find_compiler_cache(tmpdir, monkeypatch):
+    ccache = tmpdir.join('bin', 'ccache')
+    ccache.write('#!/bin/sh\nprintf "cache_hit_direct\\t4\\ncache_miss\\t$CCACHE_MAXSIZE\\n"\n', ensure=True)
+    ccache.chmod(0o755)
+    monkeypatch.setenv('PATH', str(tmpdir.join('bin')))
+    cache = zazu.compiler_cache_helper.find_compiler_cache({'dir': 'cache', 'maxSize': 9}, str(tmpdir))
+    assert cache.tool == 'ccache'
+    assert cache.path == str(ccache)
+    assert cache.env() == {'CCACHE_DIR': os.path.join(str(tmpdir), 'cache'), 'CCACHE_MAXSIZE': '9'}
+    assert cache.stats() == {'hits': 4, 'misses': 9}
+    assert zazu.compiler_cache_helper.find_compiler_cache({'tool': 'none'}, str(tmpdir)) is None
+    assert zazu.compiler_cache_helper.find_compiler_cache({'tool': 'sccache'}, str(tmpdir)) is None
+    with pytest.raises(click.ClickException):
+        zazu.compiler_cache_helper.find_compiler_cache({'tool': 'distcc'}, str(tmpdir))
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+import git
+import zazu.git_helper
+
+
+def make_repo(tmpdir):
+    repo = git.Repo.init(str(tmpdir))
+    repo.git.config('user.email', 'test@example.com')
+    repo.git.config('user.name', 'test')
+    return repo
+
+
+def test_get_staged_blobs_reads_staged_content(tmpdir):
+    repo = make_repo(tmpdir)
+    tmpdir.join('a.py').write('x = 1\n')
+    tmpdir.join('b.py').write('y = 1\n')
+    repo.git.add('a.py', 'b.py')
+    repo.git.commit('-m', 'initial')
+    tmpdir.join('a.py').write('x=1\n')
+    tmpdir.join('new dir', 'c.py').write('z = 1\n', ensure=True)
+    repo.git.add('a.py', 'new dir/c.py')
+    repo.git.mv('b.py', 'd.py')
+    tmpdir.join('a.py').write('x = 2\n')
+    blobs = zazu.git_helper.get_staged_blobs(repo)
+    assert sorted(blobs) == ['a.py', 'd.py', 'new dir/c.py']
+    assert zazu.git_helper.read_blob(repo, blobs['a.py']) == b'x=1\n'
+    assert zazu.git_helper.read_blob(repo, blobs['d.py']) == b'y = 1\n'
+
+
+def test_parse_line_ranges():
+    diff = '\n'.join(['diff --git a/a.py b/a.py',
+                      '--- a/a.py',
+                      '+++ b/a.py',
+                      '@@ -2 +2 @@',
+                      '-b=2',
+                      '+b=20',
+                      '@@ -10,0 +11,3 @@',
+                      '@@ -20,2 +23,0 @@',
+                      'diff --git a/new.cpp b/new.cpp',
+                      '--- /dev/null',
+                      '+++ b/new.cpp',
+                      '@@ -0,0 +1,4 @@'])
+    assert zazu.git_helper.parse_line_ranges(diff) == {'a.py': [(2, 2), (11, 13)], 'new.cpp': [(1, 4)]}
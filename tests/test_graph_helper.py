@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+import pytest
+import threading
+import zazu.graph_helper
+
+
+def test_critical_path_and_simulate():
+    nodes = ['compile', 'test', 'docs', 'package']
+    dependencies = {'test': ['compile'], 'package': ['test', 'docs']}
+    durations = {'compile': 30.0, 'test': 20.0, 'docs': 40.0, 'package': 5.0}
+    priorities = zazu.graph_helper.critical_path(nodes, dependencies, durations)
+    assert priorities == {'compile': 55.0, 'test': 25.0, 'docs': 45.0, 'package': 5.0}
+    starts, total = zazu.graph_helper.simulate(nodes, dependencies, durations, 1, priorities.get)
+    assert starts == {'compile': 0.0, 'docs': 30.0, 'test': 70.0, 'package': 90.0}
+    assert total == 95.0
+    starts, total = zazu.graph_helper.simulate(nodes, dependencies, durations, 2, priorities.get)
+    assert starts == {'compile': 0.0, 'docs': 0.0, 'test': 30.0, 'package': 50.0}
+    assert total == 55.0
+
+
+def test_max_concurrency():
+    assert zazu.graph_helper.max_concurrency(['a', 'b', 'c'], {'b': ['a'], 'c': ['b']}) == 1
+    assert zazu.graph_helper.max_concurrency(['a', 'b', 'c', 'd'], {'b': ['a'], 'c': ['a'], 'd': ['b', 'c']}) == 2
+    assert zazu.graph_helper.max_concurrency(['a', 'b', 'c'], {}) == 3
+
+
+def test_cycle():
+    with pytest.raises(zazu.graph_helper.CycleError) as e:
+        zazu.graph_helper.topological_order(['a'], {'a': ['b'], 'b': ['c'], 'c': ['a']})
+    assert e.value.cycle == ['a', 'b', 'c', 'a']
+
+
+def test_run_graph_runs_each_node_once_after_its_dependencies():
+    ran = []
+    lock = threading.Lock()
+
+    def run(node, cancelled):
+        with lock:
+            ran.append(node)
+    dependencies = {'b': ['a'], 'c': ['a'], 'd': ['b', 'c']}
+    failures, skipped = zazu.graph_helper.run_graph(['a', 'b', 'c', 'd'], dependencies, run, 2)
+    assert (failures, skipped) == ({}, [])
+    assert sorted(ran) == ['a', 'b', 'c', 'd']
+    assert ran[0] == 'a' and ran[-1] == 'd'
+
+
+def test_run_graph_fails_fast():
+    started = threading.Event()
+
+    def run(node, cancelled):
+        if node == 'fail':
+            started.wait(5)
+            raise ValueError(node)
+        if node == 'slow':
+            started.set()
+            # Stops as soon as the sibling fails
+            assert cancelled.wait(5)
+    dependencies = {'after': ['fail', 'slow']}
+    failures, skipped = zazu.graph_helper.run_graph(['fail', 'slow', 'after'], dependencies, run, 2)
+    assert sorted(failures) == ['fail']
+    assert skipped == ['after']
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+import zazu.resource_helper
+
+
+def test_cgroup_v2_limits(tmpdir):
+    tmpdir.join('proc', 'self', 'cgroup').write('0::/ci/job\n', ensure=True)
+    tmpdir.join('proc', 'self', 'status').write('Name:\tpython\nCpus_allowed_list:\t0-5,8\n')
+    tmpdir.join('proc', 'meminfo').write('MemTotal: 67108864 kB\nMemAvailable: 33554432 kB\n')
+    job = tmpdir.join('sys', 'fs', 'cgroup', 'ci', 'job')
+    job.join('cpu.max').write('250000 100000\n', ensure=True)
+    job.join('memory.max').write('{}\n'.format(6 * 1024 ** 3))
+    job.join('memory.current').write('{}\n'.format(2 * 1024 ** 3))
+    job.join('memory.stat').write('anon 1\ninactive_file {}\n'.format(1024 ** 3))
+    # The parent's quota applies too
+    tmpdir.join('sys', 'fs', 'cgroup', 'ci', 'cpu.max').write('max 100000\n')
+    root = str(tmpdir)
+    assert zazu.resource_helper.affinity_cpu_count(root) == 7
+    assert zazu.resource_helper.cgroup_cpu_limit(root) == 3
+    assert zazu.resource_helper.available_memory(root) == 5 * 1024 ** 3
+    assert zazu.resource_helper.job_count(2 * 1024 ** 3, root) == 2
+
+
+def test_cgroup_v1_limits_in_namespace(tmpdir):
+    # With a cgroup namespace the process's cgroup is the root of each mount
+    tmpdir.join('proc', 'self', 'cgroup').write('4:memory:/docker/abc\n3:cpu,cpuacct:/docker/abc\n', ensure=True)
+    cpu = tmpdir.join('sys', 'fs', 'cgroup', 'cpu,cpuacct')
+    cpu.join('cpu.cfs_quota_us').write('-1\n', ensure=True)
+    cpu.join('cpu.cfs_period_us').write('100000\n')
+    memory = tmpdir.join('sys', 'fs', 'cgroup', 'memory')
+    memory.join('memory.limit_in_bytes').write('9223372036854771712\n', ensure=True)
+    memory.join('memory.usage_in_bytes').write('1024\n')
+    root = str(tmpdir)
+    assert zazu.resource_helper.cgroup_cpu_limit(root) is None
+    assert zazu.resource_helper.cgroup_available_memory(root) is None
+    cpu.join('cpu.cfs_quota_us').write('150000\n')
+    memory.join('memory.limit_in_bytes').write('4096\n')
+    assert zazu.resource_helper.cgroup_cpu_limit(root) == 2
+    assert zazu.resource_helper.cgroup_available_memory(root) == 3072
+
+
+def test_parse_size():
+    assert zazu.resource_helper.parse_size('2G') == 2 * 1024 ** 3
+    assert zazu.resource_helper.parse_size('512mb') == 512 * 1024 ** 2
+    assert zazu.resource_helper.parse_size(4096) == 4096
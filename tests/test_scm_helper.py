@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+import git
+import subprocess
+import zazu.scm_helper
+
+
+def make_repo(tmpdir):
+    repo = git.Repo.init(str(tmpdir))
+    repo.git.config('user.email', 'test@example.com')
+    repo.git.config('user.name', 'test')
+    tmpdir.join('a.txt').write('a\n')
+    repo.git.add('a.txt')
+    repo.git.commit('-m', 'initial')
+    return repo
+
+
+def test_read_metadata_matches_git(tmpdir):
+    repo = make_repo(tmpdir)
+    root = str(tmpdir)
+    branch = repo.git.rev_parse('--abbrev-ref', 'HEAD')
+    sha = repo.git.rev_parse('--short', 'HEAD')
+    assert zazu.scm_helper.read_metadata(root) == (branch, sha, None, 0)
+    repo.git.tag('-a', 'v1.2', '-m', 'release')
+    repo.git.commit('--allow-empty', '-m', 'next')
+    # Like git describe, the sha has a g prefix when there is a tag
+    sha = 'g' + repo.git.rev_parse('--short', 'HEAD')
+    assert zazu.scm_helper.read_metadata(root) == (branch, sha, 'v1.2', 1)
+    tmpdir.join('a.txt').write('b\n')
+    assert zazu.scm_helper.read_metadata(root).sha == sha + '-dirty'
+    repo.git.checkout('-q', '--detach')
+    assert zazu.scm_helper.read_metadata(root).branch == 'HEAD'
+
+
+def test_describe_is_cached_until_tags_change(tmpdir, monkeypatch):
+    repo = make_repo(tmpdir)
+    root = str(tmpdir)
+    repo.git.tag('-a', 'v1.0', '-m', 'release')
+    repo.git.commit('--allow-empty', '-m', 'next')
+    repo.git.pack_refs('--all')
+    assert zazu.scm_helper.describe(root)[1:] == ('v1.0', 1)
+    calls = []
+    check_output = subprocess.check_output
+
+    def counting_check_output(args, **kwargs):
+        calls.append(args)
+        return check_output(args, **kwargs)
+    monkeypatch.setattr(subprocess, 'check_output', counting_check_output)
+    assert zazu.scm_helper.describe(root)[1:] == ('v1.0', 1)
+    assert calls == []
+    repo.git.tag('-a', 'v1.1', '-m', 'release')
+    assert zazu.scm_helper.describe(root)[1:] == ('v1.1', 0)
+    assert len(calls) == 1
+
+
+def test_worktree_refs(tmpdir):
+    repo = make_repo(tmpdir.join('main'))
+    repo.git.pack_refs('--all')
+    repo.git.worktree('add', '-b', 'feature/x', str(tmpdir.join('wt')))
+    git_dir = zazu.scm_helper.find_git_dir(str(tmpdir.join('wt')))
+    assert zazu.scm_helper.read_head(git_dir) == ('feature/x', repo.git.rev_parse('HEAD'))
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+import distutils.spawn
+import pytest
+import zazu.style
+import zazu.util
+
+
+def test_autopep8_in_process_check_does_not_modify(tmpdir):
+    source = tmpdir.join('a.py')
+    source.write('x=1\n')
+    assert zazu.style.autopep8_file_in_process(str(source), {}, True) == [str(source)]
+    assert source.read() == 'x=1\n'
+
+
+def test_autopep8_in_process_fix(tmpdir):
+    bad = tmpdir.join('a.py')
+    bad.write('x=1\n')
+    good = tmpdir.join('b.py')
+    good.write('y = 2\n')
+    files = [str(bad), str(good)]
+    assert zazu.style.autopep8(files, {'engine': 'inprocess'}, False) == [str(bad)]
+    assert bad.read() == 'x = 1\n'
+    assert zazu.style.autopep8(files, {'engine': 'inprocess'}, True) == []
+
+
+def test_chunk_args_balances_weight():
+    files = ['a', 'b', 'c', 'd']
+    assert zazu.util.chunk_args(files, [1, 1, 1, 1], 2) == [['a', 'b'], ['c', 'd']]
+    assert zazu.util.chunk_args(files, [3, 1, 1, 1], 2) == [['a'], ['b', 'c', 'd']]
+    assert zazu.util.chunk_args(files, [1, 1, 1, 1], 8) == [['a'], ['b'], ['c'], ['d']]
+    assert zazu.util.chunk_args([], [], 4) == []
+
+
+def test_chunk_args_respects_argument_length():
+    files = ['x' * 10] * 10
+    chunks = zazu.util.chunk_args(files, [1] * 10, 1, max_bytes=60)
+    assert sum(chunks, []) == files
+    assert all(sum(len(f) + 1 + 8 for f in c) <= 60 for c in chunks)
+
+
+def test_file_classifier_matches_all_pattern_sets_at_once():
+    classifier = zazu.util.FileClassifier({'astyle': ['*.cpp', '*.h'], 'autopep8': ['*.py'], 'all': ['*']},
+                                          ['dependency/*', '*_pb2.py'])
+    assert classifier.classify('src/a.cpp') == ['all', 'astyle']
+    assert classifier.classify('a.py') == ['all', 'autopep8']
+    assert classifier.classify('msg_pb2.py') == []
+    assert classifier.classify('dependency/b.h') == []
+
+
+def test_scantree_prunes_excluded_directories_relative_to_base(tmpdir):
+    for path in ['a.py', 'src/b.py', 'src/c.cpp', 'build/d.py', 'src/build/e.py', '.hidden/f.py', '.g.py']:
+        tmpdir.join(path).ensure()
+    classifier = zazu.util.FileClassifier({'py': ['*.py'], 'cpp': ['*.cpp']}, ['build/'])
+    found = dict(zazu.util.scantree_classified(str(tmpdir), classifier, ['build/'], exclude_hidden=True))
+    assert found == {'a.py': ['py'], 'src/b.py': ['py'], 'src/c.cpp': ['cpp'], 'src/build/e.py': ['py']}
+    assert sorted(zazu.util.scantree(str(tmpdir), ['*.py'], ['build', 'src'])) == ['.g.py', '.hidden/f.py', 'a.py']
+
+
+def test_walk_skips_symlinks_to_directories(tmpdir):
+    tmpdir.join('src', 'a.py').ensure()
+    tmpdir.join('src', 'link').mksymlinkto(tmpdir.join('src'))
+    tmpdir.join('src', 'b.py').mksymlinkto(tmpdir.join('src', 'a.py'))
+    assert sorted(zazu.util.walk_files(str(tmpdir), [])) == ['src/a.py', 'src/b.py']
+
+
+def test_filter_excluded_matches_walk_exclusions():
+    paths = ['a.py', 'build/b.py', 'src/build/c.py', '.hidden/d.py', 'src/.e.py', 'dependency/x/f.py']
+    assert list(zazu.util.filter_excluded(paths, ['build/', 'dependency'], exclude_hidden=True)) == ['a.py',
+                                                                                                     'src/build/c.py']
+
+
+def test_check_sources_reports_content_that_would_change():
+    import concurrent.futures
+    sources = {'a.cpp': b'int  x;\n', 'b.cpp': b'int y;\n'}
+
+    def fix(source, config):
+        return source.replace(b'  ', b' ')
+    assert zazu.style.style_sources(fix, concurrent.futures.ThreadPoolExecutor, sources, {}, True) == ['a.cpp']
+
+
+def test_autopep8_source_in_process():
+    assert zazu.style.autopep8_source_in_process(b'x=1\n', {}) == b'x = 1\n'
+
+
+def test_restrict_to_line_ranges_keeps_untouched_lines():
+    original = b'int f(){return 0;}\nint g(){return 1;}\n'
+    fixed = b'int f()\n{\n    return 0;\n}\nint g()\n{\n    return 1;\n}\n'
+    assert zazu.style.restrict_to_line_ranges(original, fixed, [(2, 2)]) == (b'int f(){return 0;}\n'
+                                                                             b'int g()\n{\n    return 1;\n}\n')
+    assert zazu.style.restrict_to_line_ranges(original, fixed, []) == original
+
+
+def test_autopep8_source_in_process_line_ranges():
+    assert zazu.style.autopep8_source_in_process(b'a=1\nb=2\nc=3\n', {}, [(2, 2)]) == b'a=1\nb = 2\nc=3\n'
+
+
+def test_restrict_to_line_ranges_joined_lines():
+    original = b'int f(\n    int x);\nint g(\n    int y);\n'
+    fixed = b'int f(int x);\nint g(int y);\n'
+    assert zazu.style.restrict_to_line_ranges(original, fixed, [(4, 4)]) == b'int f(\n    int x);\nint g(int y);\n'
+
+
+def test_cached_results_reports_skipped_files(tmpdir):
+    import zazu.style_cache
+    clean = tmpdir.join('clean.py')
+    clean.write('x = 1\n')
+    dirty = tmpdir.join('dirty.py')
+    dirty.write('x=1\n')
+    cache = zazu.style_cache.StyleCache(str(tmpdir.join('style_cache.json')))
+    cache.mark_clean('fake', str(clean))
+
+    def results(files, config, check):
+        for f in files:
+            yield zazu.style.StyleResult(f, 'fake', True, 1.0, False)
+    ret = list(zazu.style.cached_results(results, 'fake', [str(clean), str(dirty)], {}, True, cache, lambda: 'fake'))
+    assert ret == [zazu.style.StyleResult(str(clean), 'fake', False, 0.0, True),
+                   zazu.style.StyleResult(str(dirty), 'fake', True, 1.0, False)]
+
+
+def test_json_reporter_emits_a_line_per_file_and_a_summary():
+    import json
+    lines = []
+    reporter = zazu.style.JsonReporter(lines.append, True)
+    reporter.result(zazu.style.StyleResult('a.py', 'autopep8', True, 0.25, False))
+    reporter.summary(1, 1, 0.5, {'autopep8': {'files': 1, 'violations': 1, 'cached': 0, 'duration': 0.25}})
+    assert json.loads(lines[0]) == {'file': 'a.py', 'formatter': 'autopep8', 'violation': True, 'duration': 0.25,
+                                    'cached': False}
+    assert json.loads(lines[1])['summary']['formatters']['autopep8']['duration'] == 0.25
+
+
+def test_write_file_atomically_keeps_permissions(tmpdir):
+    import stat
+    path = tmpdir.join('script.py')
+    path.write('x=1\n')
+    path.chmod(0o755)
+    zazu.util.write_file_atomically(str(path), b'x = 1\n')
+    assert path.read() == 'x = 1\n'
+    assert stat.S_IMODE(path.stat().mode) == 0o755
+    assert tmpdir.listdir() == [path]
+
+
+@pytest.mark.skipif(distutils.spawn.find_executable('astyle') is None, reason='astyle is not installed')
+def test_astyle_fixes_files_in_one_pass(tmpdir):
+    bad = tmpdir.join('src', 'a.cpp')
+    bad.write('int main(){return 0;}\n', ensure=True)
+    good = tmpdir.join('b.cpp')
+    good.write('int x;\n')
+    good.setmtime(1000)
+    with tmpdir.as_cwd():
+        assert zazu.style.astyle(['src/a.cpp', 'b.cpp'], {}, True) == ['src/a.cpp']
+        assert bad.read() == 'int main(){return 0;}\n'
+        assert zazu.style.astyle(['src/a.cpp', 'b.cpp'], {}, False) == ['src/a.cpp']
+    assert bad.read() != 'int main(){return 0;}\n'
+    assert good.mtime() == 1000
+    assert sorted(p.basename for p in tmpdir.listdir()) == ['b.cpp', 'src']
+
+
+def test_replace_file_replaces_existing_files(tmpdir):
+    src = tmpdir.join('a.tmp')
+    dst = tmpdir.join('a.json')
+    src.write('new')
+    dst.write('old')
+    zazu.util.replace_file(str(src), str(dst))
+    assert dst.read() == 'new'
+    assert tmpdir.listdir() == [dst]
+
+
+def test_fix_file_never_touches_unchanged_files(tmpdir):
+    path = tmpdir.join('a.cpp')
+    path.write('int x;\n')
+    path.setmtime(1000000000)
+
+    def fix(source, config):
+        return source.replace(b'  ', b' ')
+    assert not zazu.style.fix_file(str(path), fix, {}, False)
+    assert path.mtime() == 1000000000
+    path.write('int  x;\n')
+    assert zazu.style.fix_file(str(path), fix, {}, False)
+    assert path.read() == 'int x;\n'
+
+
+def test_changed_lines_ignores_diff_prefix_config(tmpdir, monkeypatch):
+    import git
+    import zazu.config
+    monkeypatch.chdir(str(tmpdir))
+    repo = git.Repo.init(str(tmpdir))
+    repo.git.config('user.email', 'test@example.com')
+    repo.git.config('user.name', 'test')
+    tmpdir.join('zazu.yaml').write('style:\n  autopep8:\n    options: ["--max-line-length=100"]\n')
+    tmpdir.join('a.py').write('x = 1\n')
+    repo.git.add('a.py')
+    repo.git.commit('-m', 'initial')
+    tmpdir.join('a.py').write('x = 1\ny=2\n')
+    repo.git.add('a.py')
+    for option in ['diff.noprefix', 'diff.mnemonicPrefix']:
+        repo.git.config(option, 'true')
+        assert zazu.style.run_style(zazu.config.Config(str(tmpdir)), True, False, True, False, None,
+                                    echo=lambda text: None) == 1
+        repo.git.config('--unset', option)
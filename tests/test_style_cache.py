@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+import zazu.style_cache
+
+
+def test_clean_files_are_remembered_across_instances(tmpdir):
+    cache_path = str(tmpdir.join('cache', 'style_cache.json'))
+    source = tmpdir.join('a.py')
+    source.write('x = 1\n')
+    formatter = zazu.style_cache.formatter_id('autopep8', '1.0', ['--max-line-length=150'])
+    cache = zazu.style_cache.StyleCache(cache_path)
+    assert cache.filter_unknown(formatter, [str(source)]) == [str(source)]
+    cache.mark_clean(formatter, str(source))
+    cache.save()
+
+    cache = zazu.style_cache.StyleCache(cache_path)
+    assert cache.filter_unknown(formatter, [str(source)]) == []
+    other_formatter = zazu.style_cache.formatter_id('autopep8', '1.0', ['--max-line-length=80'])
+    assert cache.filter_unknown(other_formatter, [str(source)]) == [str(source)]
+
+
+def test_modified_files_are_not_clean(tmpdir):
+    source = tmpdir.join('a.py')
+    source.write('x = 1\n')
+    cache = zazu.style_cache.StyleCache(str(tmpdir.join('style_cache.json')))
+    cache.mark_clean('autopep8', str(source))
+    source.write('x=10\n')
+    source.setmtime(source.mtime() + 10)
+    assert not cache.is_clean('autopep8', str(source))
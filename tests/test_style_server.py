@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+import git
+import threading
+import zazu.config
+import zazu.style_client
+import zazu.style_server
+
+
+class Output(object):
+    def __init__(self):
+        self.text = ''
+
+    def write(self, text):
+        self.text += text
+
+
+def test_server_checks_staged_content(tmpdir, monkeypatch):
+    monkeypatch.chdir(str(tmpdir))
+    repo = git.Repo.init(str(tmpdir))
+    tmpdir.join('zazu.yaml').write('style:\n  autopep8:\n    options: ["--max-line-length=100"]\n')
+    tmpdir.join('a.py').write('x=1\n')
+    repo.git.add('a.py')
+    server = zazu.style_server.StyleServer(zazu.config.Config(str(tmpdir)))
+    server.bind()
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        out = Output()
+        assert zazu.style_client.request(server.socket_path, ['--check', '--dirty'], out=out) == 1
+        assert out.text.splitlines() == ['Violation in: a.py', '1 files with violations in 1 files']
+        assert zazu.style_client.request(server.socket_path, ['--bogus'], out=Output(), err=Output()) == 2
+        out = Output()
+        assert zazu.style_client.request(server.socket_path, ['--help'], out=out) == 0
+        assert out.text.startswith('Usage: style [OPTIONS]')
+        # The server is still running after click exited
+        assert zazu.style_client.request(server.socket_path, ['--check', '--dirty'], out=Output()) == 1
+    finally:
+        server.shutdown()
+        thread.join()
+    assert not tmpdir.join('.git', 'zazu', 'style.sock').exists()
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+import json
+import threading
+import zazu.trace_helper
+
+
+def test_phases_are_traced(tmpdir):
+    tracer = zazu.trace_helper.start()
+    with zazu.trace_helper.phase('configure', arch='local'):
+        pass
+
+    def compile():
+        with zazu.trace_helper.phase('compile', arch='other'):
+            pass
+    thread = threading.Thread(target=compile, name='other')
+    thread.start()
+    thread.join()
+    try:
+        with tracer.phase('compile', arch='local'):
+            raise ValueError()
+    except ValueError:
+        pass
+    assert sorted(tracer.totals()) == ['compile', 'configure']
+    path = str(tmpdir.join('trace.json'))
+    tracer.write(path)
+    with open(path) as f:
+        events = json.load(f)['traceEvents']
+    assert sorted(e['args']['name'] for e in events if e['ph'] == 'M') == ['MainThread', 'other']
+    phases = [(e['name'], e['args']['arch']) for e in events if e['ph'] == 'X']
+    assert sorted(phases) == [('compile', 'local'), ('compile', 'other'), ('configure', 'local')]
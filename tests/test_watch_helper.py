@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+import ctypes
+import errno
+import os
+import pytest
+import zazu.watch_helper
+
+
+def check_watcher_reports_written_files(tmpdir, watcher):
+    try:
+        tmpdir.join('a.py').write('x = 1\n')
+        tmpdir.join('build', 'b.py').write('x = 1\n', ensure=True)
+        tmpdir.join('src', 'c.py').write('x = 1\n', ensure=True)
+        assert zazu.watch_helper.debounced_changes(watcher, 0.2) == set(['a.py', 'src/c.py'])
+    finally:
+        watcher.close()
+
+
+def test_polling_watcher(tmpdir):
+    tmpdir.join('build').ensure(dir=True)
+    watcher = zazu.watch_helper.PollingWatcher(str(tmpdir), ['build'], interval=0.05)
+    check_watcher_reports_written_files(tmpdir, watcher)
+
+
+@pytest.mark.skipif(zazu.watch_helper.load_inotify() is None, reason='inotify is not supported')
+def test_inotify_watcher(tmpdir):
+    tmpdir.join('build').ensure(dir=True)
+    watcher = zazu.watch_helper.InotifyWatcher(str(tmpdir), ['build'])
+    check_watcher_reports_written_files(tmpdir, watcher)
+
+
+class FakeInotify(object):
+    """Stands in for the inotify functions of the C library, running out of watches after max_watches"""
+
+    def __init__(self, max_watches):
+        self.max_watches = max_watches
+        self.watches = []
+
+    def inotify_init(self):
+        return os.open(os.devnull, os.O_RDONLY)
+
+    def inotify_add_watch(self, fd, path, mask):
+        if len(self.watches) >= self.max_watches:
+            ctypes.set_errno(errno.ENOSPC)
+            return -1
+        self.watches.append(path)
+        return len(self.watches)
+
+
+def test_inotify_watch_limit(tmpdir, capsys):
+    tmpdir.join('a').ensure(dir=True)
+    with pytest.raises(OSError):
+        zazu.watch_helper.InotifyWatcher(str(tmpdir), [], libc=FakeInotify(1))
+    libc = FakeInotify(2)
+    watcher = zazu.watch_helper.InotifyWatcher(str(tmpdir), [], libc=libc)
+    try:
+        tmpdir.join('b').ensure(dir=True)
+        tmpdir.join('c').ensure(dir=True)
+        watcher._watch('b')
+        watcher._watch('c')
+        assert capsys.readouterr()[1].count('fs.inotify.max_user_watches') == 1
+    finally:
+        watcher.close()
@@ -1,7 +1,7 @@
-import pkg_resources
+import os
 
 name = 'zazu'
-version_file_path = pkg_resources.resource_filename('zazu', 'version.txt')
+version_file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'version.txt')
 try:
     with open(version_file_path, 'r') as version_file:
         __version__ = version_file.readline().rstrip()
@@ -1,14 +1,34 @@
 # -*- coding: utf-8 -*-
 """build command for zazu"""
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 import click
+import collections
+import functools
+import git
+import glob
+import posixpath
 import shutil
 import subprocess
 import semantic_version
+import threading
+import time
 import os
 import teamcity_helper
 import zazu.tool.tool_helper
+import zazu.build_cache
+import zazu.build_history
 import zazu.cmake_helper
+import zazu.compiler_cache_helper
 import zazu.config
+import zazu.git_helper
+import zazu.graph_helper
+import zazu.resource_helper
+import zazu.scm_helper
+import zazu.trace_helper
+import zazu.util
 
 
 class ComponentConfiguration(object):
@@ -17,6 +37,9 @@ class ComponentConfiguration(object):
     def __init__(self, component):
         self._name = component['name']
         self._description = component.get('description', '')
+        self._path = component.get('path', '').strip('/')
+        self._depends = component.get('depends', [])
+        self._isolated_sources = component.get('isolatedSources', False)
         self._goals = {}
         for g in component['goals']:
             self._goals[g['name']] = BuildGoal(g)
@@ -40,6 +63,32 @@ class ComponentConfiguration(object):
     def goals(self):
         return self._goals
 
+    def path(self):
+        """Gets the folder of the component relative to the repo, empty if it is the whole repo"""
+        return self._path
+
+    def depends(self):
+        return self._depends
+
+    def isolated_sources(self):
+        """Whether the component is built only from its own folder and those of the components it depends on, rather
+        than from the whole repo"""
+        return self._isolated_sources
+
+    def goal_order(self, goal):
+        """Lists the goals that goal depends on, directly or not, followed by goal itself. Each goal comes after the
+        goals it depends on"""
+        dependencies = {name: g.depends() for name, g in self._goals.items()}
+        for name, depends in sorted(dependencies.items()):
+            for d in depends:
+                if d not in self._goals:
+                    raise click.ClickException('goal "{}" depends on "{}" which is not in the zazu.yaml file'.format(
+                        name, d))
+        try:
+            return zazu.graph_helper.topological_order([goal], dependencies)
+        except zazu.graph_helper.CycleError as e:
+            raise click.ClickException('goals depend on each other in a cycle: {}'.format(e))
+
 
 class BuildGoal(object):
     """Stores a configuration for a single build goal with one or more architectures"""
@@ -50,15 +99,20 @@ class BuildGoal(object):
         self._build_type = goal.get('buildType', None)
         self._build_vars = goal.get('buildVars', {})
         self._build_goal = goal.get('buildGoal', self._name)
+        self._generator = goal.get('generator', None)
         self._requires = goal.get('requires', {})
         self._artifacts = goal.get('artifacts', [])
+        self._versioned_artifacts = goal.get('versionedArtifacts', True)
+        self._depends = goal.get('depends', [])
         self._builds = {}
         self._default_spec = BuildSpec(goal=self._build_goal,
                                        type=self._build_type,
                                        vars=self._build_vars,
                                        requires=self._requires,
                                        description=self._description,
-                                       artifacts=self._artifacts)
+                                       artifacts=self._artifacts,
+                                       generator=self._generator,
+                                       versioned_artifacts=self._versioned_artifacts)
         for b in goal['builds']:
             vars = b.get('buildVars', self._build_vars)
             type = b.get('buildType', self._build_type)
@@ -69,6 +123,8 @@ class BuildGoal(object):
             arch = b['arch']
             script = b.get('script', None)
             artifacts = b.get('artifacts', self._artifacts)
+            generator = b.get('generator', self._generator)
+            versioned_artifacts = b.get('versionedArtifacts', self._versioned_artifacts)
             self._builds[arch] = BuildSpec(goal=build_goal,
                                            type=type,
                                            vars=vars,
@@ -76,7 +132,9 @@ class BuildGoal(object):
                                            description=description,
                                            arch=arch,
                                            script=script,
-                                           artifacts=artifacts)
+                                           artifacts=artifacts,
+                                           generator=generator,
+                                           versioned_artifacts=versioned_artifacts)
 
     def description(self):
         return self._description
@@ -90,13 +148,22 @@ class BuildGoal(object):
     def builds(self):
         return self._builds
 
+    def depends(self):
+        return self._depends
+
     def get_build(self, arch):
         return self._builds.get(arch, self._default_spec)
 
 
+# A build of one arch of a goal of a component, with the args it is built with and the folders of the sources it is
+# built from (None for the whole repo)
+Build = collections.namedtuple('Build', ['component', 'goal', 'arch', 'spec', 'args', 'sources'])
+
+
 class BuildSpec(object):
 
-    def __init__(self, goal, type='minSizeRel', vars={}, requires={}, description='', arch='', script=None, artifacts=[]):
+    def __init__(self, goal, type='minSizeRel', vars={}, requires={}, description='', arch='', script=None, artifacts=[],
+                 generator=None, versioned_artifacts=True):
         self._build_goal = goal
         self._build_type = type
         self._build_vars = vars
@@ -105,6 +172,8 @@ class BuildSpec(object):
         self._build_arch = arch
         self._build_script = script
         self._build_artifacts = artifacts
+        self._build_generator = generator
+        self._versioned_artifacts = versioned_artifacts
 
     def build_type(self):
         return self._build_type
@@ -130,25 +199,53 @@ class BuildSpec(object):
     def build_script(self):
         return self._build_script
 
+    def build_generator(self):
+        return self._build_generator
+
+    def versioned_artifacts(self):
+        """Whether the artifacts embed the build version and number, so builds of other versions can't be reused"""
+        return self._versioned_artifacts
 
-def cmake_build(repo_root, arch, type, goal, verbose, vars):
-    """Build using cmake"""
+
+_build_dir_locks = collections.defaultdict(threading.Lock)
+_build_dir_locks_lock = threading.Lock()
+
+
+def build_dir_lock(build_dir):
+    """Gets the lock that serializes the builds in a build directory"""
+    with _build_dir_locks_lock:
+        return _build_dir_locks[build_dir]
+
+
+def cmake_build(repo_root, arch, type, goal, verbose, vars, jobs=None, echo=click.echo, call=subprocess.call,
+                generator=None, compiler_launcher=None, env=None):
+    """Build using cmake, call runs the cmake and build tool subprocesses (with the env environment if it is given).
+    generator overrides the cmake generator that is normally picked for the arch and compilers are run through
+    compiler_launcher if it is given"""
     if arch not in zazu.cmake_helper.known_arches():
         raise click.BadParameter("Arch not recognized, choose from:\n    - {}".format('\n    - '.join(zazu.cmake_helper.known_arches())))
 
     build_dir = os.path.join(repo_root, 'build', '{}-{}'.format(arch, type))
+    if env is not None:
+        call = functools.partial(call, env=env)
     ret = 0
     try:
         os.makedirs(build_dir)
     except OSError:
         pass
     if 'distclean' == goal:
-        shutil.rmtree(build_dir)
-    else:
-        ret = zazu.cmake_helper.configure(repo_root, build_dir, arch, type, vars, click.echo if verbose else lambda x: x)
+        with build_dir_lock(build_dir):
+            shutil.rmtree(build_dir)
+        return ret
+    # Goals that don't depend on each other may be built for the same arch and type at the same time
+    with build_dir_lock(build_dir):
+        with zazu.trace_helper.phase('configure', arch=arch):
+            ret = zazu.cmake_helper.configure(repo_root, build_dir, arch, type, vars, echo if verbose else lambda x: x,
+                                              call, generator, compiler_launcher)
         if ret:
             raise click.ClickException("Error configuring with cmake")
-        ret = zazu.cmake_helper.build(build_dir, type, goal, verbose)
+        with zazu.trace_helper.phase('compile', arch=arch, goal=goal):
+            ret = zazu.cmake_helper.build(build_dir, type, goal, verbose, jobs, call)
         if ret:
             raise click.ClickException("Error building with cmake")
     return ret
@@ -182,21 +279,9 @@ def make_semver(repo_root, build_number):
 
 
 def parse_describe(repo_root):
-    """Parses the results of git describe into branch name, sha, last tag, and number of commits since the tag"""
-    stdout = subprocess.check_output(['git', 'describe', '--dirty=.dirty', '--always', '--long'], cwd=repo_root)
-    components = stdout.strip().split('-')
-    sha = None
-    commits_past = 0
-    last_tag = None
-    try:
-        sha = components.pop()
-        sha = sha.replace('.dirty', '-dirty')
-        commits_past = int(components.pop())
-        last_tag = '-'.join(components)
-    except IndexError:
-        pass
-    branch_name = subprocess.check_output(['git', 'rev-parse', '--abbrev-ref', 'HEAD'], cwd=repo_root).rstrip()
-    return branch_name, sha, last_tag, commits_past
+    """Gets the branch name, sha, last tag, and number of commits since the tag like git describe reports them"""
+    metadata = zazu.scm_helper.read_metadata(repo_root)
+    return metadata.branch, metadata.sha, metadata.last_tag, metadata.commits_past_tag
 
 
 def sanitize_branch_name(branch_name):
@@ -248,16 +333,114 @@ def install_requirements(requirements, verbose):
             zazu.tool.tool_helper.install_spec(req)
 
 
-def script_build(repo_root, spec, build_args, verbose):
-    """Build using a provided shell script"""
-    env = os.environ
+# A step of a build script, it runs once the steps it depends on are done
+ScriptStep = collections.namedtuple('ScriptStep', ['name', 'commands', 'depends', 'inputs', 'outputs'])
+
+
+def script_steps(script):
+    """Parses the entries of a build script into ScriptSteps. An entry is either a command, which runs after all of the
+    entries before it, or a step with a name, the command(s) it runs, the steps it depends on and optionally the
+    inputs and outputs (glob patterns relative to the repo) used to skip it when it is up to date. Steps also run
+    after the commands before them"""
+    steps = []
+    # The last plain command, steps after it wait for it
+    barrier = []
+
+    def as_list(value):
+        return [str(v) for v in (value if isinstance(value, list) else [value])]
+    for i, entry in enumerate(script):
+        if isinstance(entry, dict):
+            try:
+                commands = entry['run']
+            except KeyError:
+                raise click.ClickException('script step {} has nothing to run'.format(entry.get('name', i + 1)))
+            steps.append(ScriptStep(str(entry.get('name', 'step{}'.format(i + 1))),
+                                    as_list(commands), as_list(entry.get('depends', [])) + barrier,
+                                    as_list(entry.get('inputs', [])), as_list(entry.get('outputs', []))))
+        else:
+            steps.append(ScriptStep('step{}'.format(i + 1), [str(entry)], [s.name for s in steps], [], []))
+            barrier = [steps[-1].name]
+    names = [s.name for s in steps]
+    for s in steps:
+        if names.count(s.name) > 1:
+            raise click.ClickException('there is more than one script step named "{}"'.format(s.name))
+        for d in s.depends:
+            if d not in names:
+                raise click.ClickException('script step "{}" depends on unknown step "{}"'.format(s.name, d))
+    return steps
+
+
+def expand_paths(repo_root, patterns):
+    """Gets the files matching glob patterns relative to repo_root, matching folders stand for the files in them"""
+    ret = []
+    for pattern in patterns:
+        for path in glob.glob(os.path.join(repo_root, pattern)):
+            if os.path.isdir(path):
+                ret += [os.path.join(root, f) for root, _, files in os.walk(path) for f in files]
+            else:
+                ret.append(path)
+    return ret
+
+
+def step_up_to_date(repo_root, step):
+    """Checks whether a script step declares inputs and outputs, every output exists and none is older than the
+    newest input"""
+    if not step.inputs or not step.outputs:
+        return False
+    outputs = [expand_paths(repo_root, [p]) for p in step.outputs]
+    inputs = expand_paths(repo_root, step.inputs)
+    if not all(outputs) or not inputs:
+        return False
+    return min(os.path.getmtime(o) for paths in outputs for o in paths) >= max(os.path.getmtime(i) for i in inputs)
+
+
+def script_build(repo_root, spec, build_args, verbose, echo=click.echo, call=subprocess.call, jobs=None,
+                 cancelled=None, env=None):
+    """Build using a provided shell script, steps that don't depend on each other run concurrently (up to jobs at a
+    time) with their output prefixed by their name. Once a step fails no more are started and the running ones are
+    stopped, as they are when the cancelled event is set. Commands run through call like subprocess.call, and steps
+    that run concurrently also pass it the prefix, echo and cancelled arguments of zazu.util.call_prefixed
+    (subprocess.call is swapped for call_prefixed since it can't prefix the output). The steps run with the build args
+    added to env (the environment of zazu by default)"""
+    steps = {s.name: s for s in script_steps(spec.build_script())}
+    dependencies = {name: s.depends for name, s in steps.items()}
+    order = zazu.graph_helper.topological_order(sorted(steps), dependencies)
+    workers = concurrent_builds(zazu.graph_helper.max_concurrency(order, dependencies),
+                                jobs or zazu.resource_helper.job_count())
+    # Copy the environment since other arches may be building concurrently with different args
+    env = dict(os.environ if env is None else env)
     env.update(build_args)
-    for s in spec.build_script():
-        if verbose:
-            click.echo(str(s))
-        ret = subprocess.call(str(s), shell=True, cwd=repo_root, env=env)
-        if ret:
-            raise click.ClickException("{} exited with code {}".format(str(s), ret))
+    # Steps in the order they failed, the ones stopped because of the first failure fail after it
+    failed = []
+    concurrent_call = zazu.util.call_prefixed if call is subprocess.call else call
+
+    def run(name, step_cancelled):
+        step = steps[name]
+        if step_up_to_date(repo_root, step):
+            echo('Skipping {}, its outputs are up to date'.format(name))
+            return
+        # Steps get their own copy of the environment as well, so one can't affect another
+        step_env = dict(env)
+        step_echo = echo
+        step_call = call
+        if workers > 1:
+            prefix = '[{}] '.format(name)
+            step_echo = zazu.util.prefixed_echo(prefix, echo)
+            step_call = functools.partial(concurrent_call, prefix=prefix, echo=echo, cancelled=step_cancelled)
+        for command in step.commands:
+            if verbose:
+                step_echo(command)
+            with zazu.trace_helper.phase('script', arch=spec.build_arch(), step=name, command=command):
+                ret = step_call(command, shell=True, cwd=repo_root, env=step_env)
+            if ret:
+                failed.append(name)
+                raise click.ClickException("{} exited with code {}".format(command, ret))
+
+    # Steps start in script order unless their dependencies hold them back
+    failures, _ = zazu.graph_helper.run_graph(order, dependencies, run, workers, lambda name: -order.index(name),
+                                              cancelled)
+    if failures:
+        raise failures[failed[0] if failed else min(failures, key=order.index)]
 
 
 def parse_key_value_pairs(arg_string):
@@ -279,32 +462,387 @@ def add_version_args(repo_root, build_num, args):
     args['ZAZU_BUILD_VERSION_PEP440'] = pep440_from_semver(semver)
 
 
+def report_compiler_cache_stats(compiler_cache, before):
+    """Reports the compiler cache hits and misses since the before snapshot was taken, to TeamCity as well"""
+    stats = zazu.compiler_cache_helper.stats_delta(before, compiler_cache.stats())
+    if stats is None:
+        return
+    click.echo(zazu.compiler_cache_helper.format_stats(compiler_cache.tool, stats))
+    total = stats['hits'] + stats['misses']
+    teamcity_helper.publish_statistics({'zazu.compilerCache.hits': stats['hits'],
+                                        'zazu.compilerCache.misses': stats['misses'],
+                                        'zazu.compilerCache.hitRate': 100.0 * stats['hits'] / total if total else 0})
+
+
+def report_phases(tracer, trace_path=None):
+    """Saves the phase timings as a trace file if a path is given, and reports the total time of each phase (in
+    milliseconds) to TeamCity"""
+    if trace_path is not None:
+        tracer.write(trace_path)
+    teamcity_helper.publish_statistics({'zazu.phase.{}'.format(k): int(v * 1000) for k, v in tracer.totals().items()})
+
+
+def load_components(project_config):
+    """Reads the components of the zazu.yaml file, checking that the components they depend on exist and that they
+    don't depend on each other in a cycle"""
+    components = [ComponentConfiguration(c) for c in project_config.get('components', [])]
+    if not components:
+        raise click.ClickException('there are no components in the zazu.yaml file')
+    dependencies = {c.name(): c.depends() for c in components}
+    for name, depends in sorted(dependencies.items()):
+        for d in depends:
+            if d not in dependencies:
+                raise click.ClickException('component "{}" depends on "{}" which is not in the zazu.yaml file'.format(
+                    name, d))
+    try:
+        zazu.graph_helper.topological_order(sorted(dependencies), dependencies)
+    except zazu.graph_helper.CycleError as e:
+        raise click.ClickException('components depend on each other in a cycle: {}'.format(e))
+    return components
+
+
+def component_contains(component_path, path):
+    """Checks whether a path relative to the repo is in the folder of a component"""
+    return not component_path or path == component_path or path.startswith(component_path + '/')
+
+
+def find_component(components, repo_root, cwd):
+    """Picks the component that the cwd folder is in, the innermost one if they are nested, or the first component if
+    cwd isn't in any of them"""
+    relative = os.path.relpath(cwd, repo_root).replace(os.sep, '/')
+    containing = [c for c in components if component_contains(c.path(), relative)]
+    return max(containing, key=lambda c: len(c.path())) if containing else components[0]
+
+
+def affected_components(components, changed_files):
+    """Gets the names of the components that contain any of the changed files (relative to the repo), or that depend on
+    such a component, directly or not. A change to the zazu.yaml file affects every component, build output doesn't
+    affect any"""
+    names = [c.name() for c in components]
+    changed_files = [f for f in changed_files
+                     if not any(component_contains(posixpath.join(c.path(), 'build'), f) for c in components)]
+    if any(f in zazu.config.PROJECT_FILE_NAMES for f in changed_files):
+        return set(names)
+    dependents = zazu.graph_helper.dependents_of(names, {c.name(): c.depends() for c in components})
+    pending = [c.name() for c in components if any(component_contains(c.path(), f) for f in changed_files)]
+    ret = set()
+    while pending:
+        name = pending.pop()
+        if name not in ret:
+            ret.add(name)
+            pending += dependents[name]
+    return ret
+
+
+def source_paths(components, name):
+    """Gets the folders of the sources that a component is built from, its own and those of the components it depends
+    on, directly or not, if it isolates its sources. Returns None if that is the whole repo"""
+    if not components[name].isolated_sources():
+        return None
+    dependencies = {n: c.depends() for n, c in components.items()}
+    paths = sorted(set(components[n].path() for n in zazu.graph_helper.topological_order([name], dependencies)))
+    return None if '' in paths else paths
+
+
+def component_artifacts(path, artifacts):
+    """Makes the artifact paths of a component, which are relative to its folder, relative to the repo"""
+    ret = []
+    for a in artifacts:
+        a = a.strip()
+        prefix = ''
+        if a[:2] in ('+:', '-:'):
+            prefix, a = a[:2], a[2:].strip()
+        ret.append(prefix + posixpath.join(path, a))
+    return ret
+
+
+def resolve_arches(component, goal, arch):
+    """Expands the arch option into a list of arches, "all" is every arch of the goal and a comma separated list
+    names several"""
+    if arch == 'all':
+        try:
+            arches = sorted(component.goals()[goal].builds().keys())
+        except KeyError:
+            raise click.ClickException('goal "{}" is not in the zazu.yaml file so it has no arches'.format(goal))
+        if not arches:
+            raise click.ClickException('goal "{}" has no builds'.format(goal))
+        return arches
+    return [a.strip() for a in arch.split(',') if a.strip()]
+
+
+def node_label(node, nodes):
+    """Names a (component, goal, arch) node for output by its arch, preceded by its component and goal unless all of
+    the nodes share them"""
+    return ':'.join([p for i, p in enumerate(node[:2]) if len(set(n[i] for n in nodes)) > 1] + [node[2]])
+
+
+def node_dependencies(components, nodes):
+    """Maps each (component, goal, arch) node to the nodes it depends on. These are the builds of the goals its goal
+    depends on in the same component and the builds of its goal in the components its component depends on. Builds of
+    the same arch are waited for, or every build of such a goal if it isn't built for that arch"""
+    ret = {}
+    for c, g, a in nodes:
+        goal = components[c].goals().get(g)
+        depends = [(c, d) for d in (goal.depends() if goal is not None else [])]
+        depends += [(d, g) for d in components[c].depends()]
+        ret[(c, g, a)] = []
+        for d in depends:
+            if d + (a,) in nodes:
+                ret[(c, g, a)].append(d + (a,))
+            else:
+                ret[(c, g, a)] += sorted(n for n in nodes if n[:2] == d)
+    return ret
+
+
+def build_priorities(nodes, dependencies, estimates):
+    """Prioritizes the builds that head the longest chains of estimated durations, so everything waiting on them can
+    start sooner. Builds that have never been done are assumed to be as long as the longest known one"""
+    known = [e for e in estimates.values() if e is not None]
+    default = max(known) if known else 0
+    durations = {n: default if estimates.get(n) is None else estimates[n] for n in nodes}
+    return zazu.graph_helper.critical_path(nodes, dependencies, durations)
+
+
+def format_duration(seconds):
+    if seconds < 60:
+        return '{:.1f}s'.format(seconds)
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    return '{}m {:02d}s'.format(minutes, seconds)
+
+
+def print_plan(goal, builds, dependencies, estimates, jobs, echo=click.echo):
+    """Shows the order builds would be started in, when, and the estimated wall time"""
+    nodes = sorted(builds)
+    workers = concurrent_builds(len(nodes), jobs)
+    priorities = build_priorities(nodes, dependencies, estimates)
+    starts, total = zazu.graph_helper.simulate(nodes, dependencies, {n: estimates.get(n) or 0 for n in nodes},
+                                               workers, priorities.get)
+    echo('Plan for {} ({} at a time, job budget {}):'.format(goal, workers, jobs))
+    for n in sorted(nodes, key=lambda n: (starts[n], -priorities[n])):
+        estimate = estimates.get(n)
+        echo('    {:<28} {:<10} {:>10} starts at {}'.format(node_label(n, nodes),
+                                                            builds[n].spec.build_type() or '',
+                                                            'unknown' if estimate is None
+                                                            else format_duration(estimate),
+                                                            format_duration(starts[n])))
+    unknown = [n for n in nodes if estimates.get(n) is None]
+    echo('Estimated wall time: {}{}'.format(format_duration(total),
+                                            ' plus {} build(s) never done before'.format(len(unknown))
+                                            if unknown else ''))
+
+
+def split_jobs(jobs, count):
+    """Splits a budget of parallel jobs as evenly as possible between count concurrent builds, each gets at least one"""
+    return [max(jobs // count + (1 if i < jobs % count else 0), 1) for i in range(count)]
+
+
+def build_spec(repo_root, arch, spec, build_args, verbose, jobs=None, echo=click.echo, call=subprocess.call,
+               cache=None, compiler_cache=None, build_num=None, record=None, cancelled=None, path='', sources=None):
+    """Builds a single arch of a goal, using its script if it has one and cmake otherwise, and publishes its
+    artifacts. If a cache is given and the goal has artifacts, they are restored from the cache instead when the same
+    sources have been built the same way (and the same version, if the artifacts embed it) before. Otherwise the
+    version args for build_num are only added when building since reading them from git takes time. Once it succeeds
+    record is called with the arch, build type, the seconds it took and whether it was restored from the cache.
+    Setting the cancelled event stops script steps that run concurrently. The goal is built in the path folder of the
+    repo, from the sources in the sources folders (None for the whole repo)"""
+    start = time.time()
+    root = os.path.normpath(os.path.join(repo_root, path))
+    artifacts = component_artifacts(path, spec.build_artifacts())
+    fingerprint = None
+    cacheable = cache is not None and spec.build_artifacts() and spec.build_goal() != 'distclean'
+    version_added = False
+    if build_num is not None and cacheable and spec.versioned_artifacts():
+        # The version is part of the fingerprint
+        with zazu.trace_helper.phase('version', arch=arch):
+            add_version_args(repo_root, build_num, build_args)
+        version_added = True
+    if cacheable:
+        toolchain_file = zazu.cmake_helper.get_toolchain_file_from_arch(arch) if spec.build_script() is None else None
+        with zazu.trace_helper.phase('fingerprint', arch=arch):
+            fingerprint = zazu.build_cache.goal_fingerprint(repo_root, arch, spec, build_args, toolchain_file,
+                                                            path=path, source_paths=sources)
+        with zazu.trace_helper.phase('cacheRestore', arch=arch):
+            restored = cache.restore(fingerprint, root)
+        if restored:
+            echo('Restored artifacts from the build cache ({})'.format(fingerprint[:12]))
+            with zazu.trace_helper.phase('publish', arch=arch):
+                teamcity_helper.publish_artifacts(artifacts)
+            if record is not None:
+                record(arch, spec.build_type(), time.time() - start, True)
+            return
+    if build_num is not None and not version_added:
+        with zazu.trace_helper.phase('version', arch=arch):
+            add_version_args(repo_root, build_num, build_args)
+    env = None
+    if compiler_cache is not None:
+        # Compilers launched through the cache by the build tools need its settings
+        env = dict(os.environ)
+        env.update(compiler_cache.env())
+    if spec.build_script() is None:
+        if compiler_cache is not None:
+            compiler_cache.used = True
+        cmake_build(root, arch, spec.build_type(), spec.build_goal(), verbose, build_args, jobs, echo, call,
+                    spec.build_generator(), compiler_cache.path if compiler_cache is not None else None, env)
+    else:
+        script_build(root, spec, build_args, verbose, echo, call, jobs, cancelled, env)
+    if fingerprint is not None:
+        paths = zazu.build_cache.artifact_paths(root, spec.build_artifacts())
+        if paths is None:
+            echo('Not caching the build since some of its artifacts are missing')
+        else:
+            with zazu.trace_helper.phase('cacheStore', arch=arch):
+                cache.store(fingerprint, root, paths)
+    with zazu.trace_helper.phase('publish', arch=arch):
+        teamcity_helper.publish_artifacts(artifacts)
+    if record is not None:
+        record(arch, spec.build_type(), time.time() - start, False)
+
+
+def concurrent_builds(build_count, jobs):
+    """Gets how many builds to run at the same time, each build needs at least one job"""
+    return max(min(build_count, jobs), 1)
+
+
+def build_graph(repo_root, builds, dependencies, verbose, jobs, cache=None, compiler_cache=None, build_num=None,
+                record=None, priority=lambda n: 0):
+    """Builds a dictionary of (component, goal, arch) nodes to Builds concurrently, each once the nodes it depends on
+    are built, as many at a time as the jobs allow (splitting the jobs between them) and prefixing each line of their
+    output with their name. Once a build fails no more are started and the running ones are stopped. record is called
+    with the component, goal, arch, build type, duration and whether the build was restored from the cache for each
+    build that succeeds"""
+    workers = concurrent_builds(len(builds), jobs)
+    # Each running build takes one of the shares of the jobs
+    shares = queue.Queue()
+    for share in split_jobs(jobs, workers):
+        shares.put(share)
+    stopped = set()
+
+    def run(node, cancelled):
+        b = builds[node]
+        prefix = '[{}] '.format(node_label(node, builds))
+        echo = zazu.util.prefixed_echo(prefix)
+        share = shares.get()
+        try:
+            build_spec(repo_root, b.arch, b.spec, b.args, verbose, share, echo,
+                       functools.partial(zazu.util.call_prefixed, prefix=prefix, cancelled=cancelled), cache,
+                       compiler_cache, build_num,
+                       functools.partial(record, b.component.name(), b.goal) if record is not None else None,
+                       cancelled, b.component.path(), b.sources)
+        except click.ClickException as e:
+            if cancelled.is_set():
+                stopped.add(node)
+            echo('build {}: {}'.format('cancelled' if node in stopped else 'failed', e.format_message()))
+            raise
+        finally:
+            shares.put(share)
+        echo('build succeeded')
+
+    failures, skipped = zazu.graph_helper.run_graph(sorted(builds), dependencies, run, workers, priority)
+    for e in failures.values():
+        if not isinstance(e, click.ClickException):
+            raise e
+    if failures:
+        groups = [('failed to build', sorted(n for n in failures if n not in stopped)),
+                  ('cancelled', sorted(stopped)),
+                  ('skipped', skipped)]
+        raise click.ClickException(', '.join('{} {}'.format(verb, ', '.join(node_label(n, builds) for n in nodes))
+                                             for verb, nodes in groups if nodes))
+
+
 @click.command()
 @click.pass_context
-@click.option('-a', '--arch', default='local', help='the desired architecture to build for')
+@click.option('-a', '--arch', default='local',
+              help='the desired architecture to build for, "all" or a comma separated list builds several '
+                   'architectures of the goal concurrently')
 @click.option('-t', '--type', type=click.Choice(zazu.cmake_helper.build_types),
               help='defaults to what is specified in the config file, or release if unspecified there')
 @click.option('-n', '--build_num', help='build number', default=os.environ.get('BUILD_NUMBER', 0))
 @click.option('-v', '--verbose', is_flag=True, help='generates verbose output from the build')
+@click.option('--no-cache', is_flag=True, help='always build, rather than restoring artifacts from the build cache')
+@click.option('--trace', type=click.Path(dir_okay=False, writable=True),
+              help='saves how long each phase of the build took to a JSON file that chrome://tracing can show')
+@click.option('--plan', is_flag=True, help='shows the order the builds would run in and their estimated duration, '
+                                           'based on earlier builds, without building')
+@click.option('--affected', is_flag=True, help='builds the goal for every component with changes since the base ref, '
+                                               'and the components that depend on them, rather than the component of '
+                                               'the current folder')
+@click.option('--base', default='origin/develop', help='the ref that --affected compares against, changes since HEAD '
+                                                       'forked from it count')
 @click.argument('goal')
 @click.argument('extra_args_str', nargs=-1)
-def build(ctx, arch, type, build_num, verbose, goal, extra_args_str):
+def build(ctx, arch, type, build_num, verbose, no_cache, trace, plan, affected, base, goal, extra_args_str):
     """Build project targets, the GOAL argument is the configuration name from zazu.yaml file or desired make target,
      use distclean to clean whole build folder"""
     # Run the supplied build script if there is one, otherwise assume cmake
     # Parse file to find requirements then check that they exist, then build
+    tracer = zazu.trace_helper.start()
     project_config = ctx.obj.project_config()
-    component = ComponentConfiguration(project_config['components'][0])
-    spec = component.get_spec(goal, arch, type)
-    requirements = spec.build_requires().get('zazu', [])
-    install_requirements(requirements, verbose)
-    build_args = {"ZAZU_TOOL_DIR": os.path.expanduser('~/.zazu/tools')}
-    extra_args = parse_key_value_pairs(extra_args_str)
-    build_args.update(spec.build_vars())
-    build_args.update(extra_args)
-    add_version_args(ctx.obj.repo_root, build_num, build_args)
-    if spec.build_script() is None:
-        cmake_build(ctx.obj.repo_root, arch, spec.build_type(), spec.build_goal(), verbose, build_args)
+    components = load_components(project_config)
+    by_name = {c.name(): c for c in components}
+    if affected:
+        try:
+            changed_files = zazu.git_helper.get_changed_files(ctx.obj.repo, base)
+        except git.exc.GitCommandError as e:
+            raise click.ClickException('unable to find the changes since {}: {}'.format(base, e.stderr.strip()))
+        names = affected_components(components, changed_files)
+        selected = [c for c in components if c.name() in names and goal in c.goals()]
+        if not selected:
+            click.echo('No components with a {} goal are affected by the changes since {}'.format(goal, base))
+            return
+        click.echo('Building {} for the components affected by the changes since {}: {}'.format(
+            goal, base, ', '.join(c.name() for c in selected)))
     else:
-        script_build(ctx.obj.repo_root, spec, build_args, verbose)
-    teamcity_helper.publish_artifacts(spec.build_artifacts())
+        selected = [find_component(components, ctx.obj.repo_root, os.getcwd())]
+    extra_args = parse_key_value_pairs(extra_args_str)
+    builds = {}
+    for component in selected:
+        sources = source_paths(by_name, component.name())
+        for g in component.goal_order(goal):
+            for a in resolve_arches(component, g, arch):
+                spec = component.get_spec(g, a, type)
+                if spec.build_script() is None and a not in zazu.cmake_helper.known_arches():
+                    raise click.BadParameter("Arch not recognized, choose from:\n    - {}".format(
+                        '\n    - '.join(zazu.cmake_helper.known_arches())))
+                build_args = {"ZAZU_TOOL_DIR": os.path.expanduser('~/.zazu/tools')}
+                build_args.update(spec.build_vars())
+                build_args.update(extra_args)
+                builds[(component.name(), g, a)] = Build(component, g, a, spec, build_args, sources)
+    dependencies = node_dependencies(by_name, builds)
+    # Each component keeps the history of its own folder
+    histories = {c.name(): zazu.build_history.BuildHistory(os.path.normpath(os.path.join(ctx.obj.repo_root, c.path())))
+                 for c in selected}
+    estimates = {n: histories[n[0]].estimate(b.goal, b.arch, b.spec.build_type()) for n, b in builds.items()}
+    jobs = zazu.resource_helper.job_count(zazu.resource_helper.memory_per_job(ctx.obj.resources_config()))
+    if plan:
+        print_plan(goal, builds, dependencies, estimates, jobs)
+        return
+    for n in sorted(builds):
+        b = builds[n]
+        requirements = b.spec.build_requires().get('zazu', [])
+        with tracer.phase('requirements', arch=b.arch):
+            install_requirements(requirements, verbose)
+    cache = None
+    if not no_cache:
+        cache = zazu.build_cache.BuildCache(remote=zazu.build_cache.make_remote_cache(ctx.obj.cache_config()))
+    compiler_cache = zazu.compiler_cache_helper.find_compiler_cache(ctx.obj.compiler_cache_config(), ctx.obj.repo_root)
+    compiler_cache_stats = None
+    # Script builds don't launch compilers through the cache, their stats would only show other builds on the machine
+    if compiler_cache is not None and any(b.spec.build_script() is None for b in builds.values()):
+        compiler_cache_stats = compiler_cache.stats()
+    try:
+        if len(builds) == 1:
+            b = list(builds.values())[0]
+            build_spec(ctx.obj.repo_root, b.arch, b.spec, b.args, verbose, jobs, cache=cache,
+                       compiler_cache=compiler_cache, build_num=build_num,
+                       record=functools.partial(histories[b.component.name()].record, b.goal),
+                       path=b.component.path(), sources=b.sources)
+        else:
+            priorities = build_priorities(list(builds), dependencies, estimates)
+            build_graph(ctx.obj.repo_root, builds, dependencies, verbose, jobs, cache, compiler_cache, build_num,
+                        lambda component, *args: histories[component].record(*args), priorities.get)
+    finally:
+        if cache is not None:
+            cache.wait()
+        if compiler_cache is not None and compiler_cache.used:
+            report_compiler_cache_stats(compiler_cache, compiler_cache_stats)
+        report_phases(tracer, trace)
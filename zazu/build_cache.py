@@ -0,0 +1,403 @@
+# -*- coding: utf-8 -*-
+"""local content addressed cache of build artifacts"""
+
+__author__ = "Nicholas Wiles"
+__copyright__ = "Copyright 2016, Lily Robotics"
+
+import click
+import concurrent.futures
+import errno
+import hashlib
+import json
+import os
+import posixpath
+import re
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import threading
+import zazu
+import zazu.cmake_helper
+import zazu.util
+
+default_cache_dir = os.path.expanduser('~/.zazu/cache')
+
+# Build args that change with every build (or branch), they are left out of the fingerprint of goals whose artifacts
+# don't embed them so CI reruns and branch switches reuse earlier builds of the same sources
+volatile_build_args = zazu.cmake_helper.version_variables
+
+
+# The empty tree, for repos without commits
+EMPTY_TREE_SHA = '4b825dc642cb6eb9a060e54bf8d69288fbee4904'
+
+
+def hash_file(path):
+    """Returns the hex digest of a file's content"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 16), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _git(repo_root, *args):
+    return subprocess.check_output(['git'] + list(args), cwd=repo_root).decode('utf-8')
+
+
+def artifact_rules(artifacts):
+    """Parses artifact paths in the TeamCity "[+:|-:]path => target" form into (include, pattern) pairs, "-:" rules
+    exclude files that earlier rules include"""
+    ret = []
+    for a in artifacts:
+        pattern = a.split('=>')[0].strip()
+        include = not pattern.startswith('-:')
+        if pattern[:2] in ('+:', '-:'):
+            pattern = pattern[2:].strip()
+        ret.append((include, pattern.replace('\\', '/').rstrip('/')))
+    return ret
+
+
+def artifact_patterns(artifacts):
+    """Gets the glob patterns of the files that artifact paths include"""
+    return [pattern for include, pattern in artifact_rules(artifacts) if include]
+
+
+def compile_artifact_pattern(pattern):
+    """Compiles an artifact glob pattern into a regular expression matching paths relative to the repo. "*" and "?"
+    don't match "/", "**" matches any number of folders"""
+    regex = ''
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith('**/', i):
+            regex += '(?:.*/)?'
+            i += 3
+        elif pattern.startswith('**', i):
+            regex += '.*'
+            i += 2
+        elif pattern[i] == '*':
+            regex += '[^/]*'
+            i += 1
+        elif pattern[i] == '?':
+            regex += '[^/]'
+            i += 1
+        else:
+            regex += re.escape(pattern[i])
+            i += 1
+    # Like TeamCity, a folder stands for all of the files below it
+    return re.compile('{}(?:/.*)?$'.format(regex))
+
+
+def _match_files(repo_root, pattern):
+    """Gets the files (relative to repo_root) that an artifact pattern matches"""
+    regex = compile_artifact_pattern(pattern)
+    # Only the folder before the first wildcard needs to be searched
+    fixed = []
+    for part in pattern.split('/'):
+        if any(c in part for c in '*?'):
+            break
+        fixed.append(part)
+    top = os.path.join(repo_root, *fixed)
+    if os.path.isfile(top):
+        return ['/'.join(fixed)]
+    ret = []
+    for root, _, files in os.walk(top):
+        for f in files:
+            path = os.path.relpath(os.path.join(root, f), repo_root).replace(os.sep, '/')
+            if regex.match(path):
+                ret.append(path)
+    return ret
+
+
+def source_state(repo_root, exclude_dirs=('build',), exclude_patterns=(), paths=None):
+    """Describes the sources of a repo as the tree of HEAD plus the digests of all files that differ from it (modified,
+    staged, deleted or untracked but not ignored). Files in exclude_dirs (zazu's build output) or matching
+    exclude_patterns (e.g. artifacts left by an earlier build) are ignored. If paths are given only the sources in
+    those folders are described"""
+    try:
+        tree = _git(repo_root, 'rev-parse', '--verify', '-q', 'HEAD^{tree}').strip()
+    except subprocess.CalledProcessError:
+        tree = EMPTY_TREE_SHA
+    pathspec = list(paths or [])
+    changed = _git(repo_root, 'diff', '--name-only', '--no-renames', '-z', tree, '--', *pathspec).split('\0')
+    changed += _git(repo_root, 'ls-files', '--others', '--exclude-standard', '-z', '--', *pathspec).split('\0')
+    if paths is not None:
+        # The entries of the folders in the tree, their shas change with anything in them
+        tree = _git(repo_root, 'ls-tree', tree, '--', *pathspec)
+    excludes = [compile_artifact_pattern(p) for p in exclude_patterns]
+    dirty = {}
+    for path in set(changed):
+        if not path or any(path.startswith(d + '/') for d in exclude_dirs):
+            continue
+        if any(r.match(path) for r in excludes):
+            continue
+        full_path = os.path.join(repo_root, path)
+        dirty[path] = hash_file(full_path) if os.path.isfile(full_path) else None
+    return {'tree': tree, 'dirty': dirty}
+
+
+def tool_version(tool):
+    """Gets the first line that a tool prints for --version, or an empty string if it can't be run"""
+    try:
+        with open(os.devnull, 'w') as devnull:
+            output = subprocess.check_output([tool, '--version'], stderr=devnull)
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+    lines = output.decode('utf-8', 'replace').splitlines()
+    return lines[0].strip() if lines else ''
+
+
+def fingerprint_tools(arch, generator=None):
+    """Gets the tools whose version goes into the fingerprint of a build, cmake, the native build tool of the generator
+    the build uses and the compilers, which can be overridden by the usual environment variables"""
+    generator = zazu.cmake_helper.architecture_to_generator(arch, generator)
+    return ['cmake', zazu.cmake_helper.native_build_tool(generator), os.environ.get('CC', 'cc'),
+            os.environ.get('CXX', 'c++')]
+
+
+def goal_fingerprint(repo_root, arch, spec, build_args, toolchain_file=None, tools=None, path='', source_paths=None):
+    """Makes a fingerprint that identifies the artifacts of a build, from the repo sources, the resolved build spec and
+    args (including the version args if the artifacts embed them), the versions of the build tools and the content of
+    the toolchain file. path is the folder the goal is built
+    in and source_paths the folders of the sources it is built from, None for the whole repo"""
+    if tools is None:
+        tools = fingerprint_tools(arch, spec.build_generator())
+    components = {
+        'zazu': zazu.__version__,
+        'sources': source_state(repo_root, exclude_dirs=(posixpath.join(path, 'build'),),
+                                exclude_patterns=[posixpath.join(path, p)
+                                                  for p in artifact_patterns(spec.build_artifacts())],
+                                paths=source_paths),
+        'arch': arch,
+        'goal': spec.build_goal(),
+        'type': spec.build_type(),
+        'script': spec.build_script(),
+        'generator': spec.build_generator(),
+        'args': {k: v for k, v in build_args.items() if spec.versioned_artifacts() or k not in volatile_build_args},
+        'tools': {t: tool_version(t) for t in tools},
+        'toolchain': hash_file(toolchain_file) if toolchain_file is not None else None
+    }
+    return hashlib.sha256(json.dumps(components, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def artifact_paths(repo_root, artifacts):
+    """Expands artifact paths (relative to repo_root, in the TeamCity "[+:|-:]path => target" form) into the files they
+    name, returns None if any included pattern doesn't match anything since the artifacts are then incomplete"""
+    ret = set()
+    for include, pattern in artifact_rules(artifacts):
+        matches = _match_files(repo_root, pattern)
+        if include:
+            if not matches:
+                return None
+            ret.update(matches)
+        else:
+            ret.difference_update(matches)
+    return sorted(ret)
+
+
+def sha256_file(path):
+    """Returns the hex sha256 digest of a file's content"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 16), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class RemoteCache(object):
+    """Shares build cache entries through an HTTP server using plain GET and PUT requests on content addressed paths.
+    Each entry is accompanied by a manifest with its digest, uploaded last, so partial or corrupt entries are never
+    used. Uploads happen in the background, call wait before exiting. No more than max_transfers downloads and uploads
+    run at once"""
+
+    def __init__(self, url, read_only=False, max_transfers=4, timeout=60):
+        self._url = url.rstrip('/')
+        self.read_only = read_only
+        self._timeout = timeout
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_transfers)
+        self._transfers = threading.BoundedSemaphore(max_transfers)
+        self._uploads = []
+
+    def entry_url(self, fingerprint, extension):
+        return '{}/{}/{}.{}'.format(self._url, fingerprint[:2], fingerprint, extension)
+
+    def fetch(self, fingerprint, path):
+        """Downloads the entry of a fingerprint to path, returns False if the server doesn't have it, can't be reached
+        or sends content that doesn't match the manifest, or the entry can't be saved"""
+        import requests
+        tmp_path = None
+        try:
+            with self._transfers:
+                response = requests.get(self.entry_url(fingerprint, 'json'), timeout=self._timeout)
+                if response.status_code == 404:
+                    return False
+                response.raise_for_status()
+                manifest = response.json()
+                response = requests.get(self.entry_url(fingerprint, 'tar'), timeout=self._timeout, stream=True)
+                response.raise_for_status()
+                digest = hashlib.sha256()
+                fd, tmp_path = tempfile.mkstemp(prefix='.{}.'.format(fingerprint), dir=os.path.dirname(path))
+                with os.fdopen(fd, 'wb') as f:
+                    for block in response.iter_content(1 << 16):
+                        f.write(block)
+                        digest.update(block)
+            if digest.hexdigest() != manifest['sha256']:
+                click.echo('Warning: ignoring corrupt remote build cache entry {}'.format(fingerprint), err=True)
+                return False
+            zazu.util.replace_file(tmp_path, path)
+            tmp_path = None
+            return True
+        except (requests.RequestException, IOError, OSError, ValueError, KeyError) as e:
+            click.echo('Warning: unable to fetch from the remote build cache: {}'.format(e), err=True)
+            return False
+        finally:
+            if tmp_path is not None:
+                os.remove(tmp_path)
+
+    def _upload(self, fingerprint, path):
+        import requests
+        try:
+            with self._transfers:
+                manifest = {'sha256': sha256_file(path), 'size': os.path.getsize(path)}
+                with open(path, 'rb') as f:
+                    requests.put(self.entry_url(fingerprint, 'tar'), data=f, timeout=self._timeout).raise_for_status()
+                requests.put(self.entry_url(fingerprint, 'json'), data=json.dumps(manifest),
+                             headers={'Content-Type': 'application/json'}, timeout=self._timeout).raise_for_status()
+        except (requests.RequestException, IOError, OSError) as e:
+            click.echo('Warning: unable to upload to the remote build cache: {}'.format(e), err=True)
+        finally:
+            os.remove(path)
+
+    def upload(self, fingerprint, path):
+        """Starts uploading the entry of a fingerprint from path, which is removed once it is uploaded. The path must
+        not be one that the local cache prunes"""
+        self._uploads.append(self._executor.submit(self._upload, fingerprint, path))
+
+    def wait(self):
+        """Waits for the uploads in progress"""
+        for upload in self._uploads:
+            upload.result()
+        self._uploads = []
+
+
+def make_remote_cache(cache_config):
+    """Makes the remote cache described by the "cache" section of zazu.yaml, None if there is none"""
+    url = cache_config.get('url', None)
+    if not url:
+        return None
+    return RemoteCache(url, cache_config.get('readOnly', False), cache_config.get('maxTransfers', 4))
+
+
+def safe_to_extract(archive, root):
+    """Checks that every member of an archive is a regular file or folder that extracts inside root, archives from a
+    remote cache may have been tampered with"""
+    root = os.path.realpath(root)
+    for member in archive.getmembers():
+        if not (member.isfile() or member.isdir()) or os.path.isabs(member.name):
+            return False
+        path = os.path.realpath(os.path.join(root, member.name))
+        if path != root and not path.startswith(os.path.join(root, '')):
+            return False
+    return True
+
+
+class BuildCache(object):
+    """Stores the artifacts of builds by fingerprint, the least recently used entries are dropped once the cache grows
+    beyond max_bytes. Entries missing locally are fetched from the remote cache if there is one, and new entries are
+    uploaded to it"""
+
+    def __init__(self, path=default_cache_dir, max_bytes=10 * 1024 ** 3, remote=None):
+        self._path = path
+        self._max_bytes = max_bytes
+        self._remote = remote
+
+    def entry_path(self, fingerprint):
+        return os.path.join(self._path, fingerprint[:2], '{}.tar'.format(fingerprint))
+
+    def contains(self, fingerprint):
+        return os.path.isfile(self.entry_path(fingerprint))
+
+    def restore(self, fingerprint, repo_root):
+        """Extracts the artifacts of a fingerprint into repo_root, returns False if they aren't cached"""
+        entry = self.entry_path(fingerprint)
+        if self._remote is not None and not os.path.isfile(entry):
+            try:
+                os.makedirs(os.path.dirname(entry))
+            except OSError:
+                pass
+            self._remote.fetch(fingerprint, entry)
+        try:
+            archive = tarfile.open(entry, 'r')
+        except (IOError, OSError, tarfile.TarError):
+            return False
+        with archive:
+            safe = safe_to_extract(archive, repo_root)
+            if safe:
+                archive.extractall(repo_root)
+        if not safe:
+            # Entries only ever hold the regular files below the repo that store added
+            click.echo('Warning: ignoring build cache entry {} since it would write outside the repo'.format(
+                fingerprint), err=True)
+            os.remove(entry)
+            return False
+        # Mark the entry as recently used
+        os.utime(entry, None)
+        return True
+
+    def store(self, fingerprint, repo_root, paths):
+        """Archives the files at paths (relative to repo_root) as the artifacts of a fingerprint"""
+        entry = self.entry_path(fingerprint)
+        try:
+            os.makedirs(os.path.dirname(entry))
+        except OSError:
+            pass
+        fd, tmp_path = tempfile.mkstemp(prefix='.{}.'.format(fingerprint), dir=os.path.dirname(entry))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                with tarfile.open(fileobj=f, mode='w', dereference=True) as archive:
+                    for p in paths:
+                        archive.add(os.path.join(repo_root, p), arcname=p)
+            if self._remote is not None and not self._remote.read_only:
+                # Upload from a link to the entry since pruning may remove the entry before the upload starts
+                upload_path = '{}.upload'.format(tmp_path)
+                try:
+                    os.link(tmp_path, upload_path)
+                except (AttributeError, OSError):
+                    shutil.copyfile(tmp_path, upload_path)
+                self._remote.upload(fingerprint, upload_path)
+            zazu.util.replace_file(tmp_path, entry)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        self.prune()
+
+    def wait(self):
+        """Waits for uploads to the remote cache to finish"""
+        if self._remote is not None:
+            self._remote.wait()
+
+    def prune(self):
+        """Drops the least recently used entries until the cache fits in max_bytes"""
+        entries = []
+        for root, _, files in os.walk(self._path):
+            for f in files:
+                if f.endswith('.tar'):
+                    path = os.path.join(root, f)
+                    try:
+                        st = os.stat(path)
+                    except OSError as e:
+                        # Builds running at the same time prune too
+                        if e.errno != errno.ENOENT:
+                            raise
+                        continue
+                    entries.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self._max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+            total -= size
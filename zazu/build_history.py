@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""local history of how long builds took, used to estimate and schedule future builds"""
+
+__author__ = "Nicholas Wiles"
+__copyright__ = "Copyright 2016, Lily Robotics"
+
+import click
+import contextlib
+import os
+import sqlite3
+import time
+
+default_history_path = os.path.expanduser('~/.zazu/build_history.db')
+
+# Estimates are based on this many of the most recent builds, older ones are dropped
+history_length = 10
+
+_schema = '''CREATE TABLE IF NOT EXISTS builds (
+    repo TEXT NOT NULL,
+    goal TEXT NOT NULL,
+    arch TEXT NOT NULL,
+    type TEXT NOT NULL,
+    duration REAL NOT NULL,
+    restored INTEGER NOT NULL,
+    finished REAL NOT NULL
+)'''
+
+
+class BuildHistory(object):
+    """Records the durations of the builds of a repo by goal, arch and type. Each call opens its own connection so it
+    may be used from several threads, and by concurrent zazu processes"""
+
+    def __init__(self, repo_root, path=default_history_path):
+        self._repo_root = repo_root
+        self._path = path
+
+    @contextlib.contextmanager
+    def _connect(self):
+        try:
+            os.makedirs(os.path.dirname(self._path))
+        except OSError:
+            pass
+        connection = sqlite3.connect(self._path, timeout=30)
+        try:
+            with connection:
+                connection.execute(_schema)
+                yield connection
+        finally:
+            connection.close()
+
+    def record(self, goal, arch, type, duration, restored=False):
+        """Records that a build took duration seconds, restored is set if it came from the build cache"""
+        key = (self._repo_root, goal, arch, type or '')
+        try:
+            with self._connect() as connection:
+                connection.execute('INSERT INTO builds VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                   key + (duration, int(restored), time.time()))
+                connection.execute('DELETE FROM builds WHERE repo = ? AND goal = ? AND arch = ? AND type = ? AND rowid '
+                                   'NOT IN (SELECT rowid FROM builds WHERE repo = ? AND goal = ? AND arch = ? AND '
+                                   'type = ? ORDER BY finished DESC LIMIT ?)', key + key + (history_length,))
+        except sqlite3.Error as e:
+            # The history only improves estimates, it shouldn't fail builds
+            click.echo('Warning: unable to record the build duration: {}'.format(e), err=True)
+
+    def estimate(self, goal, arch, type):
+        """Estimates the seconds a build will take from the median of its recent durations, None if it has never been
+        done. Restores from the build cache say little about how long building takes, so they are only used if there
+        are no recent builds"""
+        try:
+            with self._connect() as connection:
+                rows = connection.execute('SELECT duration, restored FROM builds WHERE repo = ? AND goal = ? AND '
+                                          'arch = ? AND type = ?', (self._repo_root, goal, arch, type or '')).fetchall()
+        except sqlite3.Error:
+            return None
+        durations = sorted(d for d, restored in rows if not restored) or sorted(d for d, _ in rows)
+        if not durations:
+            return None
+        return durations[len(durations) // 2]
@@ -4,26 +4,45 @@ __author__ = "Nicholas Wiles"
 __copyright__ = "Copyright 2016, Lily Robotics"
 
 import click
+import importlib
 import os
-import git_helper
-import zazu.build
+import zazu
 import zazu.config
-import zazu.dev.commands
-import zazu.repo.commands
-import zazu.style
-import zazu.tool.commands
-import zazu.upgrade
+import zazu.git_helper
 
 
-@click.group()
+class LazyGroup(click.Group):
+    """A click group that defers importing a subcommand's module until that subcommand is used,
+    so that running one command (e.g. "zazu style" from a git hook) doesn't pay for every other command's imports"""
+
+    def __init__(self, name=None, lazy_commands=None, **attrs):
+        click.Group.__init__(self, name, **attrs)
+        self.lazy_commands = lazy_commands or {}
+
+    def list_commands(self, ctx):
+        return sorted(set(click.Group.list_commands(self, ctx)).union(self.lazy_commands))
+
+    def get_command(self, ctx, cmd_name):
+        if cmd_name not in self.commands and cmd_name in self.lazy_commands:
+            module_name, command_name = self.lazy_commands[cmd_name].rsplit('.', 1)
+            module = importlib.import_module(module_name)
+            self.add_command(getattr(module, command_name), cmd_name)
+        return click.Group.get_command(self, ctx, cmd_name)
+
+
+# Maps subcommand names to the fully qualified name of their click command
+lazy_commands = {
+    'upgrade': 'zazu.upgrade.upgrade',
+    'style': 'zazu.style.style',
+    'build': 'zazu.build.build',
+    'dev': 'zazu.dev.commands.dev',
+    'repo': 'zazu.repo.commands.repo',
+    'tool': 'zazu.tool.commands.tool',
+}
+
+
+@click.group(cls=LazyGroup, lazy_commands=lazy_commands)
 @click.version_option(version=zazu.__version__)
 @click.pass_context
 def cli(ctx):
-    ctx.obj = zazu.config.Config(git_helper.get_repo_root(os.getcwd()))
-
-cli.add_command(zazu.upgrade.upgrade)
-cli.add_command(zazu.style.style)
-cli.add_command(zazu.build.build)
-cli.add_command(zazu.dev.commands.dev)
-cli.add_command(zazu.repo.commands.repo)
-cli.add_command(zazu.tool.commands.tool)
+    ctx.obj = zazu.config.Config(zazu.git_helper.get_repo_root(os.getcwd()))
@@ -1,13 +1,35 @@
 # -*- coding: utf-8 -*-
 """Defines helper functions for cmake interaction"""
+import hashlib
+import json
 import subprocess
 import multiprocessing
 import os
 import pkg_resources
+import re
+import shutil
+import zazu.resource_helper
+import zazu.util
 
 
-def architecture_to_generator(arch):
-    """Gets the required generator for a given architecture"""
+# Build variables that change with every commit, they are kept out of the configure fingerprint
+version_variables = ['ZAZU_BUILD_NUMBER', 'ZAZU_BUILD_VERSION', 'ZAZU_BUILD_VERSION_PEP440', 'CPACK_PACKAGE_VERSION']
+
+# Files in the build directory that have the current values of the version variables
+version_header = 'zazu_version.h'
+version_script = 'zazu_version.cmake'
+
+# Short generator names that may be used in the zazu.yaml file
+generator_aliases = {
+    'ninja': 'Ninja',
+    'make': 'Unix Makefiles'
+}
+
+
+def architecture_to_generator(arch, generator=None):
+    """Gets the required generator for a given architecture, unless a generator is requested"""
+    if generator is not None:
+        return generator_aliases.get(generator.lower(), generator)
     known_arches = {
         'x86_64-win-msvc_2015': 'Visual Studio 14 2015 Win64',
         'x86_32-win-msvc_2015': 'Visual Studio 14 2015',
@@ -38,43 +60,160 @@ def known_arches():
             'x86_32-win-msvc_2015']
 
 
-def configure(repo_root, build_dir, arch, build_type, build_variables, echo=lambda x: x):
-    """Configures a cmake based project to be built and caches args used to bypass configuration in future"""
-    os.chdir(build_dir)
-    configure_args = ['cmake',
-                      repo_root,
-                      '-G', architecture_to_generator(arch),
-                      '-DCMAKE_BUILD_TYPE=' + build_type.capitalize(),
-                      '-DCPACK_SYSTEM_NAME=' + arch,
-                      '-DCPACK_PACKAGE_VERSION=' + build_variables['ZAZU_BUILD_VERSION'],
-                      '-DZAZU_TOOL_PATH=' + os.path.expanduser('~/.zazu/tools')
-                      ]
-    for k, v in build_variables.items():
-        configure_args.append('-D{}={}'.format(k, v))
+def cached_generator(build_dir):
+    """Gets the generator that a build directory was configured with, None if it hasn't been configured"""
+    try:
+        with open(os.path.join(build_dir, 'CMakeCache.txt')) as f:
+            for line in f:
+                if line.startswith('CMAKE_GENERATOR:'):
+                    return line.split('=', 1)[1].strip()
+    except IOError:
+        pass
+    return None
+
+
+def clear_cmake_cache(build_dir):
+    """Removes the configuration of a build directory, cmake refuses to switch generators without this"""
+    for f in ['CMakeCache.txt', 'configure_fingerprint.txt']:
+        try:
+            os.remove(os.path.join(build_dir, f))
+        except OSError:
+            pass
+    shutil.rmtree(os.path.join(build_dir, 'CMakeFiles'), ignore_errors=True)
+
+
+def configure_fingerprint(repo_root, generator, variables, unset_variables, toolchain_file):
+    """Makes a fingerprint of everything that requires cmake to reconfigure, independent of the order of the variables.
+    The version variables are left out since they change with every commit, and the toolchain file is included by
+    content since its path doesn't change when it is edited"""
+    toolchain_digest = None
+    if toolchain_file is not None:
+        with open(toolchain_file, 'rb') as f:
+            toolchain_digest = hashlib.sha1(f.read()).hexdigest()
+    components = {
+        'source': repo_root,
+        'generator': generator,
+        'variables': {k: str(v) for k, v in variables.items() if k not in version_variables},
+        'unset': sorted(unset_variables),
+        'toolchain': toolchain_digest
+    }
+    return hashlib.sha1(json.dumps(components, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _write_if_changed(path, content):
+    """Writes content to path unless it is already there, so builds that depend on path aren't redone needlessly"""
+    try:
+        with open(path, 'rb') as f:
+            if f.read() == content:
+                return
+    except IOError:
+        pass
+    zazu.util.write_file_atomically(path, content)
+
+
+def _quote(value):
+    """Quotes a string for both C and cmake"""
+    return '"{}"'.format(value.replace('\\', '\\\\').replace('"', '\\"'))
+
+
+def cpack_project_config_file(build_dir):
+    """Gets the CPACK_PROJECT_CONFIG_FILE that cmake wrote to the cpack config in build_dir, or None"""
+    try:
+        with open(os.path.join(build_dir, 'CPackConfig.cmake')) as f:
+            for line in f:
+                m = re.match(r'\s*set\(CPACK_PROJECT_CONFIG_FILE "(.*)"\)', line)
+                if m is not None:
+                    return m.group(1)
+    except IOError:
+        pass
+    return None
+
+
+def write_version_files(build_dir, variables, project_config_file=None):
+    """Writes the version variables into a header (for sources) and a cmake script (for cpack) in build_dir. These are
+    refreshed on every build, unlike the cmake cache which is only updated when cmake reconfigures. The script includes
+    project_config_file first if the project has its own cpack config file"""
+    version = {k: str(variables[k]) for k in version_variables if k in variables}
+    header = ['// Generated by zazu, do not edit', '#pragma once']
+    header += ['#define {} {}'.format(k, _quote(v)) for k, v in sorted(version.items()) if k.startswith('ZAZU_')]
+    script = ['# Generated by zazu, do not edit']
+    if project_config_file is not None:
+        script.append('include({})'.format(_quote(project_config_file.replace('\\', '/'))))
+    if 'CPACK_PACKAGE_VERSION' in version:
+        # cpack names packages when cmake configures, swap in the current version
+        script += ['string(REPLACE "${{CPACK_PACKAGE_VERSION}}" {0} {1} "${{{1}}}")'.format(
+            _quote(version['CPACK_PACKAGE_VERSION']), v) for v in ['CPACK_PACKAGE_FILE_NAME',
+                                                                   'CPACK_SOURCE_PACKAGE_FILE_NAME']]
+    script += ['set({} {})'.format(k, _quote(v)) for k, v in sorted(version.items())]
+    _write_if_changed(os.path.join(build_dir, version_header), ('\n'.join(header) + '\n').encode('utf-8'))
+    _write_if_changed(os.path.join(build_dir, version_script), ('\n'.join(script) + '\n').encode('utf-8'))
+
+
+def configure(repo_root, build_dir, arch, build_type, build_variables, echo=lambda x: x, call=subprocess.call,
+              generator=None, compiler_launcher=None):
+    """Configures a cmake based project to be built and caches a fingerprint of the configuration used to bypass
+    configuration in future, call runs cmake (in build_dir) and returns its exit code. generator overrides the generator
+    normally used for the arch and compilers are run through compiler_launcher (e.g. ccache) if it is given. Version
+    variables alone don't cause a reconfigure, sources and cpack get them from the files written by
+    write_version_files"""
+    generator = architecture_to_generator(arch, generator)
+    previous_generator = cached_generator(build_dir)
+    if previous_generator not in [None, generator]:
+        echo('Generator changed from {} to {}, reconfiguring from scratch'.format(previous_generator, generator))
+        clear_cmake_cache(build_dir)
+    variables = {
+        'CMAKE_BUILD_TYPE': build_type.capitalize(),
+        'CPACK_SYSTEM_NAME': arch,
+        'CPACK_PACKAGE_VERSION': build_variables['ZAZU_BUILD_VERSION'],
+        'ZAZU_VERSION_INCLUDE_DIR': build_dir,
+        'ZAZU_TOOL_PATH': os.path.expanduser('~/.zazu/tools')
+    }
+    variables.update(build_variables)
+    # cpack loads the version script, which includes any config file the project set via its build variables
+    project_config_file = build_variables.get('CPACK_PROJECT_CONFIG_FILE')
+    if project_config_file is not None:
+        project_config_file = os.path.join(repo_root, project_config_file)
+    variables['CPACK_PROJECT_CONFIG_FILE'] = os.path.join(build_dir, version_script)
     toolchain_file = get_toolchain_file_from_arch(arch)
     if toolchain_file is not None:
-        configure_args.append('-DCMAKE_TOOLCHAIN_FILE=' + toolchain_file)
+        variables['CMAKE_TOOLCHAIN_FILE'] = toolchain_file
+    unset_variables = []
+    for launcher_variable in ['CMAKE_C_COMPILER_LAUNCHER', 'CMAKE_CXX_COMPILER_LAUNCHER']:
+        if compiler_launcher is not None:
+            variables[launcher_variable] = compiler_launcher
+        elif launcher_variable not in build_variables:
+            # Don't keep launching through a compiler cache that has since been disabled or uninstalled
+            unset_variables.append(launcher_variable)
+    configure_args = ['cmake', repo_root, '-G', generator]
+    configure_args += ['-D{}={}'.format(k, v) for k, v in sorted(variables.items())]
+    configure_args += ['-U' + v for v in unset_variables]
 
-    configure_arg_str = ' '.join(configure_args)
     echo('CMake Configuration: {}'.format('\n    '.join(configure_args)))
-    cache_file = os.path.join(build_dir, 'cmake_command.txt')
-    previous_args = ''
+    write_version_files(build_dir, variables, project_config_file)
+    fingerprint = configure_fingerprint(repo_root, generator, variables, unset_variables, toolchain_file)
+    fingerprint_file = os.path.join(build_dir, 'configure_fingerprint.txt')
+    previous_fingerprint = ''
     try:
-        with file(cache_file) as f:
-            previous_args = f.read()
+        with open(fingerprint_file) as f:
+            previous_fingerprint = f.read()
     except IOError:
         pass
     r = 0
-    if previous_args != configure_arg_str:
+    if previous_fingerprint != fingerprint or not os.path.isfile(os.path.join(build_dir, 'CMakeCache.txt')):
         try:
-            r = subprocess.call(configure_args)
+            r = call(configure_args, cwd=build_dir)
         except OSError:
             r = -1
             warn_uninstalled(configure_args[0])
+        config_file = cpack_project_config_file(build_dir)
+        if not r and config_file is not None and \
+                os.path.normpath(config_file) != os.path.normpath(variables['CPACK_PROJECT_CONFIG_FILE']):
+            print('CMakeLists.txt sets CPACK_PROJECT_CONFIG_FILE so packages keep the version from the last configure, '
+                  'set it in the buildVars of zazu.yaml instead so that zazu can include it')
         if not r:
-            # Cache the call args
-            with open(cache_file, 'w') as f:
-                f.write(configure_arg_str)
+            # Cache the fingerprint of the configuration
+            with open(fingerprint_file, 'w') as f:
+                f.write(fingerprint)
     return r
 
 
@@ -83,21 +222,56 @@ def warn_uninstalled(pkg_name):
     print('{0} not found, install it via "apt-get install {0}" or "brew install {0}"'.format(pkg_name))
 
 
-def build(build_dir, build_type, target, verbose):
-    """Build using CMake"""
-    os.chdir(build_dir)
-    if 'nt' in os.name:
-        build_args = ['cmake', '--build', '.', '--config', build_type.capitalize()]
-        if 'all' not in target:
-            build_args.append('--target')
-            build_args.append(target)
-    else:
-        build_args = ['make', '-j{}'.format(multiprocessing.cpu_count()), target]
+def load_limit():
+    """Gets the load average above which native build tools should hold off starting new jobs, this is shared by all
+    builds on the machine so concurrent builds don't oversubscribe it. The load average counts every process on the
+    host (even from inside a container) so it is compared to the host's CPU count"""
+    return multiprocessing.cpu_count()
+
+
+def native_build_tool(generator):
+    """Gets the native build tool that cmake runs for a generator"""
+    if generator.startswith('Ninja'):
+        return 'ninja'
+    if generator.startswith('NMake'):
+        return 'nmake'
+    if generator.startswith('Visual Studio'):
+        return 'msbuild'
+    return 'make'
+
+
+def native_build_args(generator, jobs, verbose):
+    """Gets the arguments that make the native build tool of a generator run jobs in parallel"""
+    if generator.startswith('Ninja'):
+        args = ['-j{}'.format(jobs), '-l{}'.format(load_limit())]
+        if verbose:
+            args.append('-v')
+    elif generator.endswith('Makefiles') and not generator.startswith('NMake'):
+        args = ['-j{}'.format(jobs), '-l{}'.format(load_limit())]
         if verbose:
-            build_args.append('VERBOSE=1')
+            args.append('VERBOSE=1')
+    elif generator.startswith('Visual Studio'):
+        args = ['/maxcpucount:{}'.format(jobs)]
+    else:
+        args = []
+    return args
+
+
+def build(build_dir, build_type, target, verbose, jobs=None, call=subprocess.call):
+    """Build using "cmake --build" with up to jobs parallel jobs (by default as many as the usable CPUs and available
+    memory allow), call runs cmake (in build_dir) and returns its exit code"""
+    if jobs is None:
+        jobs = zazu.resource_helper.job_count()
+    build_args = ['cmake', '--build', '.', '--config', build_type.capitalize()]
+    if target != 'all':
+        build_args += ['--target', target]
+    native_args = native_build_args(cached_generator(build_dir) or '', jobs, verbose)
+    if native_args:
+        build_args += ['--'] + native_args
     try:
-        ret = subprocess.call(build_args)
+        ret = call(build_args, cwd=build_dir)
     except OSError:
+        ret = -1
         warn_uninstalled(build_args[0])
     return ret
 
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""Defines helper functions for compiler caches (ccache or sccache) that cmake builds are launched through"""
+
+__author__ = "Nicholas Wiles"
+__copyright__ = "Copyright 2016, Lily Robotics"
+
+import click
+import distutils.spawn
+import json
+import os
+import subprocess
+
+# Compiler caches in order of preference when the zazu.yaml file doesn't pick one
+known_tools = ['ccache', 'sccache']
+
+# Environment variables that set the cache location and size of each tool
+_dir_variables = {'ccache': 'CCACHE_DIR', 'sccache': 'SCCACHE_DIR'}
+_size_variables = {'ccache': 'CCACHE_MAXSIZE', 'sccache': 'SCCACHE_CACHE_SIZE'}
+
+# Keys of "ccache --print-stats", which were renamed in ccache 4
+_ccache_hit_keys = ['direct_cache_hit', 'preprocessed_cache_hit', 'cache_hit_direct', 'cache_hit_preprocessed']
+_ccache_miss_keys = ['cache_miss']
+
+
+class CompilerCache(object):
+    """A compiler cache tool and the settings it is run with"""
+
+    def __init__(self, tool, path, cache_dir=None, max_size=None):
+        self.tool = tool
+        self.path = path
+        self._cache_dir = cache_dir
+        self._max_size = max_size
+        # Set once a build has launched its compilers through the cache
+        self.used = False
+
+    def env(self):
+        """Gets the environment variables that configure the cache, compilers launched through it need these"""
+        ret = {}
+        if self._cache_dir is not None:
+            ret[_dir_variables[self.tool]] = self._cache_dir
+        if self._max_size is not None:
+            ret[_size_variables[self.tool]] = str(self._max_size)
+        return ret
+
+    def stats(self):
+        """Gets the cumulative {'hits': n, 'misses': n} counts of the cache, None if they can't be read"""
+        env = dict(os.environ)
+        env.update(self.env())
+        try:
+            with open(os.devnull, 'w') as devnull:
+                if self.tool == 'ccache':
+                    output = subprocess.check_output([self.path, '--print-stats'], env=env, stderr=devnull)
+                    return parse_ccache_stats(output.decode('utf-8'))
+                output = subprocess.check_output([self.path, '--show-stats', '--stats-format=json'], env=env,
+                                                 stderr=devnull)
+                return parse_sccache_stats(output.decode('utf-8'))
+        except (OSError, subprocess.CalledProcessError, ValueError):
+            return None
+
+
+def parse_ccache_stats(output):
+    """Parses the tab separated output of "ccache --print-stats" into hit and miss counts"""
+    values = {}
+    for line in output.splitlines():
+        key, _, value = line.partition('\t')
+        try:
+            values[key] = int(value)
+        except ValueError:
+            pass
+    if not any(k in values for k in _ccache_hit_keys + _ccache_miss_keys):
+        raise ValueError('no cache statistics found')
+    return {'hits': sum(values.get(k, 0) for k in _ccache_hit_keys),
+            'misses': sum(values.get(k, 0) for k in _ccache_miss_keys)}
+
+
+def parse_sccache_stats(output):
+    """Parses the output of "sccache --show-stats --stats-format=json" into hit and miss counts"""
+    stats = json.loads(output)['stats']
+    return {'hits': sum(stats['cache_hits']['counts'].values()),
+            'misses': sum(stats['cache_misses']['counts'].values())}
+
+
+def stats_delta(before, after):
+    """Gets the hits and misses between two stats snapshots, None if either is missing"""
+    if before is None or after is None:
+        return None
+    return {k: after[k] - before[k] for k in after}
+
+
+def format_stats(tool, stats):
+    """Formats hit and miss counts for humans"""
+    total = stats['hits'] + stats['misses']
+    rate = 100.0 * stats['hits'] / total if total else 0.0
+    return 'Compiler cache ({}): {} hits, {} misses ({:.0f}% hit rate)'.format(
+        tool, stats['hits'], stats['misses'], rate)
+
+
+def find_compiler_cache(config, repo_root):
+    """Finds the compiler cache described by the "compilerCache" section of zazu.yaml. The tool defaults to the first
+    known one that is installed, "none" disables it. Returns None if there is no compiler cache to use"""
+    tool = config.get('tool', None)
+    if tool == 'none':
+        return None
+    if tool is not None and tool not in known_tools:
+        raise click.ClickException('unknown compiler cache "{}", choose from {}'.format(tool, known_tools + ['none']))
+    for t in [tool] if tool is not None else known_tools:
+        path = distutils.spawn.find_executable(t)
+        if path is not None:
+            cache_dir = config.get('dir', None)
+            if cache_dir is not None:
+                cache_dir = os.path.join(repo_root, os.path.expanduser(cache_dir))
+            return CompilerCache(t, path, cache_dir, config.get('maxSize', None))
+    if tool is not None:
+        click.echo('Warning: {} not found, building without a compiler cache'.format(tool), err=True)
+    return None
@@ -3,9 +3,8 @@
 import os
 import click
 import git
-import jira
 import yaml
-import zazu.credential_helper
+import zazu.util
 
 
 class IssueTracker(object):
@@ -48,6 +47,8 @@ class JiraIssueTracker(IssueTracker):
 
     def jira_handle(self):
         if self._jira_handle is None:
+            import jira
+            import zazu.credential_helper
             username, password = zazu.credential_helper.get_user_pass_credentials('Jira')
             self._jira_handle = jira.JIRA(self._base_url,
                                           basic_auth=(username, password),
@@ -58,6 +59,7 @@ class JiraIssueTracker(IssueTracker):
         return '{}/browse/{}'.format(self._base_url, issue_id)
 
     def issue(self, issue_id):
+        import jira
         try:
             ret = self.jira_handle().issue(issue_id)
         except jira.exceptions.JIRAError as e:
@@ -65,6 +67,7 @@ class JiraIssueTracker(IssueTracker):
         return ret
 
     def create_issue(self, project, issue_type, summary, description, component):
+        import jira
         try:
             issue_dict = {
                 'project': {'key': project},
@@ -79,6 +82,7 @@ class JiraIssueTracker(IssueTracker):
             raise IssueTrackerError(str(e))
 
     def assign_issue(self, issue, assignee):
+        import jira
         try:
             self.jira_handle().assign_issue(issue, assignee)
         except jira.exceptions.JIRAError as e:
@@ -188,6 +192,15 @@ class Config(object):
     def style_config(self):
         return self.project_config().get('style', {})
 
+    def cache_config(self):
+        return self.project_config().get('cache', {})
+
+    def resources_config(self):
+        return self.project_config().get('resources', {})
+
+    def compiler_cache_config(self):
+        return self.project_config().get('compilerCache', {})
+
     def zazu_version_required(self):
         return self.project_config().get('zazu', '')
 
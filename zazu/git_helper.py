@@ -5,8 +5,8 @@ __author__ = "Nicholas Wiles"
 __copyright__ = "Copyright 2016, Lily Robotics"
 
 import os
+import binascii
 import filecmp
-import pkg_resources
 import shutil
 import git
 
@@ -28,6 +28,8 @@ def get_hooks_path(repo_base):
 
 def get_default_git_hooks():
     """gets list of get hooks to install"""
+    # pkg_resources is slow to import, so only pay for it when hooks are actually being managed
+    import pkg_resources
     return {
         "pre-commit": pkg_resources.resource_filename('zazu', 'githooks/pre-commit'),
         "post-checkout": pkg_resources.resource_filename('zazu', 'githooks/post-checkout'),
@@ -41,6 +43,97 @@ def get_touched_files(repo):
     return repo.git.diff('--cached', '--name-only', '--diff-filter=ACMR').split('\n')
 
 
+def get_changed_files(repo, base):
+    """Gets the files that changed since HEAD forked from base, whether committed or not (untracked files included)"""
+    merge_base = repo.git.merge_base(base, 'HEAD')
+    changed = repo.git.diff('--name-only', '--no-renames', '-z', merge_base, '--').split('\0')
+    changed += repo.git.ls_files('--others', '--exclude-standard', '-z').split('\0')
+    return sorted(set(f for f in changed if f))
+
+
+def get_staged_blobs(repo):
+    """Gets a dictionary mapping files that are scheduled to be committed (Added, created, modified, or renamed) to the
+    hex sha of their staged content, only regular files are included"""
+    output = repo.git.diff('--cached', '--raw', '-z', '--no-abbrev', '--diff-filter=ACMR')
+    fields = output.split('\0')
+    ret = {}
+    i = 0
+    while i + 1 < len(fields):
+        # Each entry is ":<old mode> <new mode> <old sha> <new sha> <status>" followed by one path, or two for renames
+        # and copies
+        meta = fields[i].split()
+        path_count = 2 if meta[4][0] in 'RC' else 1
+        path = fields[i + path_count]
+        if meta[1] in ('100644', '100755'):
+            ret[path] = meta[3]
+        i += path_count + 1
+    return ret
+
+
+# The hash of the empty tree, which every git repo knows about
+EMPTY_TREE_SHA = '4b825dc642cb6eb9a060e54bf8d69288fbee4904'
+
+
+def parse_line_ranges(diff):
+    """Parses a unified diff into a dictionary mapping each file to the 1 based, inclusive (start, end) ranges of lines
+    in its new version that were added or changed"""
+    ret = {}
+    path = None
+    for line in diff.splitlines():
+        if line.startswith('+++ '):
+            path = line[4:]
+            if path.startswith('"') and path.endswith('"'):
+                path = path[1:-1]
+            path = path[2:] if path.startswith('b/') else None
+            if path is not None:
+                ret.setdefault(path, [])
+        elif line.startswith('@@ ') and path is not None:
+            # @@ -<old start>[,<old count>] +<new start>[,<new count>] @@
+            new = line.split(' ')[2][1:].split(',')
+            start = int(new[0])
+            count = int(new[1]) if len(new) > 1 else 1
+            if count:
+                ret[path].append((start, start + count - 1))
+    return ret
+
+
+def get_changed_line_ranges(repo, paths, staged=True):
+    """Gets a dictionary mapping each path to the line ranges that differ from HEAD, either in its staged content or in
+    its working tree copy"""
+    if not paths:
+        return {}
+    if staged:
+        base = ['--cached']
+    else:
+        try:
+            repo.git.rev_parse('--verify', '--quiet', 'HEAD')
+            base = ['HEAD']
+        except git.exc.GitCommandError:
+            base = [EMPTY_TREE_SHA]
+    # Force the a/ and b/ prefixes that parse_line_ranges expects, whatever diff.noprefix and diff.mnemonicPrefix say
+    args = base + ['-U0', '--no-color', '--no-ext-diff', '--src-prefix=a/', '--dst-prefix=b/', '--diff-filter=ACMR',
+                   '--'] + list(paths)
+    return parse_line_ranges(repo.git.diff(*args))
+
+
+def read_blob(repo, hexsha):
+    """Reads the contents of a blob from the object database"""
+    return repo.odb.stream(binascii.unhexlify(hexsha)).read()
+
+
+def get_indexed_and_untracked_files(repo):
+    """Gets list of files that are in the index plus untracked files that aren't ignored, relative to the repo root"""
+    output = repo.git.ls_files('--cached', '--others', '--exclude-standard', '-z')
+    # Unmerged paths are listed once per stage
+    seen = set()
+    ret = []
+    for f in output.split('\0'):
+        if f and f not in seen:
+            seen.add(f)
+            ret.append(f)
+    return ret
+
+
 def check_git_hooks(repo_base):
     """Checks that the default git hooks are in place"""
     have_hooks = True
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""runs tasks that depend on each other, as many at a time as their dependencies allow"""
+
+__author__ = "Nicholas Wiles"
+__copyright__ = "Copyright 2016, Lily Robotics"
+
+import concurrent.futures
+import threading
+
+
+class CycleError(ValueError):
+    """Raised when tasks depend on each other in a cycle"""
+
+    def __init__(self, cycle):
+        ValueError.__init__(self, ' -> '.join(str(n) for n in cycle))
+        self.cycle = cycle
+
+
+def topological_order(nodes, dependencies):
+    """Orders nodes so that each comes after its dependencies, dependencies maps a node to the nodes it depends on.
+    Raises CycleError if there is a cycle"""
+    order = []
+    state = {}
+
+    def visit(node, path):
+        if state.get(node) == 'done':
+            return
+        if state.get(node) == 'visiting':
+            raise CycleError(path[path.index(node):] + [node])
+        state[node] = 'visiting'
+        for d in dependencies.get(node, []):
+            visit(d, path + [node])
+        state[node] = 'done'
+        order.append(node)
+    for n in nodes:
+        visit(n, [])
+    return order
+
+
+def dependents_of(nodes, dependencies):
+    """Inverts dependencies, mapping each node to the nodes that depend on it"""
+    ret = {n: [] for n in nodes}
+    for n in nodes:
+        for d in dependencies.get(n, []):
+            ret[d].append(n)
+    return ret
+
+
+def max_concurrency(nodes, dependencies):
+    """Gets an upper bound of how many nodes can run at the same time, nodes can only overlap those that neither
+    depend on them nor are depended on by them (even indirectly). It is 1 if the nodes form a single chain"""
+    ancestors = {}
+    for n in topological_order(nodes, dependencies):
+        ancestors[n] = set(dependencies.get(n, []))
+        for d in dependencies.get(n, []):
+            ancestors[n] |= ancestors[d]
+    return max([1 + sum(1 for m in nodes if m != n and m not in ancestors[n] and n not in ancestors[m])
+                for n in nodes] or [1])
+
+
+def critical_path(nodes, dependencies, durations):
+    """Gets the length of the longest chain of durations from each node to the end of the graph, tasks on long chains
+    should start first since everything after them waits for them"""
+    dependents = dependents_of(nodes, dependencies)
+    ret = {}
+    for n in reversed(topological_order(nodes, dependencies)):
+        ret[n] = durations[n] + max([ret[d] for d in dependents[n]] or [0])
+    return ret
+
+
+def simulate(nodes, dependencies, durations, workers, priority):
+    """Predicts when each node starts if they are run like run_graph does, returns the start times and the total time"""
+    dependents = dependents_of(nodes, dependencies)
+    remaining = {n: set(dependencies.get(n, [])) for n in nodes}
+    starts = {}
+    running = []
+    now = 0.0
+    while remaining or running:
+        ready = sorted([n for n in remaining if not remaining[n]], key=priority, reverse=True)
+        for n in ready[:workers - len(running)]:
+            del remaining[n]
+            starts[n] = now
+            running.append((now + durations[n], n))
+        if not running:
+            break
+        running.sort()
+        now, n = running.pop(0)
+        for d in dependents[n]:
+            remaining[d].discard(n)
+    return starts, now
+
+
+def run_graph(nodes, dependencies, run, max_workers, priority=lambda n: 0, stop=None):
+    """Calls run(node, cancelled) for each node once all of its dependencies have succeeded, up to max_workers at a
+    time, starting the ready node with the highest priority first. Each node is run once even if several nodes depend
+    on it. Once a node raises no more nodes are started and the cancelled event is set, so running nodes can stop
+    early. Setting the stop event cancels the graph from outside in the same way. Returns a dictionary mapping the
+    nodes that raised to their exception, and the nodes that never ran"""
+    dependents = dependents_of(nodes, dependencies)
+    remaining = {n: set(dependencies.get(n, [])) for n in nodes}
+    cancelled = threading.Event()
+    failures = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        running = {}
+        try:
+            while True:
+                if stop is not None and stop.is_set():
+                    cancelled.set()
+                if not cancelled.is_set():
+                    ready = sorted([n for n in remaining if not remaining[n]], key=priority, reverse=True)
+                    for n in ready[:max_workers - len(running)]:
+                        del remaining[n]
+                        running[executor.submit(run, n, cancelled)] = n
+                if not running:
+                    break
+                done, _ = concurrent.futures.wait(running, timeout=None if stop is None else 0.1,
+                                                  return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    n = running.pop(future)
+                    try:
+                        future.result()
+                    except Exception as e:
+                        failures[n] = e
+                        cancelled.set()
+                    else:
+                        for d in dependents[n]:
+                            remaining[d].discard(n)
+        except KeyboardInterrupt:
+            # Stop the running nodes rather than waiting for them to finish
+            cancelled.set()
+            raise
+    return failures, sorted(remaining)
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""probes the CPU and memory that zazu may use, honoring CPU affinity and the cgroup limits of containers"""
+
+__author__ = "Nicholas Wiles"
+__copyright__ = "Copyright 2016, Lily Robotics"
+
+import click
+import math
+import multiprocessing
+import os
+import re
+import subprocess
+
+# Parallel jobs are limited so that each may use this much memory, C++ compiles and links can take a lot
+default_memory_per_job = 1024 ** 3
+
+# cgroup v1 mounts each controller separately, some distributions mount cpu together with cpuacct
+_v1_controller_dirs = {
+    'cpu': ['cpu', 'cpu,cpuacct', 'cpuacct,cpu'],
+    'memory': ['memory']
+}
+
+# cgroup v1 reports no memory limit as a huge number
+_unlimited_memory = 1 << 60
+
+_size_units = {'': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3, 't': 1024 ** 4}
+
+
+def parse_size(size):
+    """Parses a size in bytes with an optional K, M, G or T suffix (e.g. 512M or 2G)"""
+    match = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([kmgt]?)i?b?\s*$', str(size).lower())
+    if match is None:
+        raise ValueError('invalid size "{}"'.format(size))
+    return int(float(match.group(1)) * _size_units[match.group(2)])
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except (IOError, OSError):
+        return None
+
+
+def _cgroup_paths(root):
+    """Maps the cgroup v1 controllers of the process (and '' for cgroup v2) to its cgroup path"""
+    ret = {}
+    for line in (_read(os.path.join(root, 'proc/self/cgroup')) or '').splitlines():
+        parts = line.split(':', 2)
+        if len(parts) == 3:
+            for controller in parts[1].split(','):
+                ret[controller] = parts[2]
+    return ret
+
+
+def cgroup_values(controller, name, root='/'):
+    """Yields the content of a cgroup file for the process's cgroup and each of its ancestors, since the limits of all
+    of them apply. controller is '' for cgroup v2. When the container has its own cgroup namespace (or the host's
+    hierarchy isn't mounted) the process's cgroup is the root of the mount, so that is tried too"""
+    path = _cgroup_paths(root).get(controller)
+    if path is None:
+        return
+    if controller:
+        mounts = [os.path.join('sys/fs/cgroup', d) for d in _v1_controller_dirs.get(controller, [controller])]
+    else:
+        mounts = ['sys/fs/cgroup', 'sys/fs/cgroup/unified']
+    components = [c for c in path.split('/') if c]
+    for mount in mounts:
+        mount_path = os.path.join(root, mount)
+        if not os.path.isdir(mount_path):
+            continue
+        for i in range(len(components), -1, -1):
+            value = _read(os.path.join(mount_path, *(components[:i] + [name])))
+            if value is not None:
+                yield value
+
+
+def cgroup_cpu_limit(root='/'):
+    """Gets the number of CPUs the cgroup CPU quota allows (rounded up), None if there is no quota"""
+    limits = []
+    for value in cgroup_values('', 'cpu.max', root):
+        quota, _, period = value.partition(' ')
+        if quota != 'max' and period:
+            limits.append(float(quota) / float(period))
+    quotas = list(cgroup_values('cpu', 'cpu.cfs_quota_us', root))
+    periods = list(cgroup_values('cpu', 'cpu.cfs_period_us', root))
+    for quota, period in zip(quotas, periods):
+        if int(quota) > 0:
+            limits.append(float(quota) / float(period))
+    if not limits:
+        return None
+    return max(int(math.ceil(min(limits))), 1)
+
+
+def _inactive_file(stat, key):
+    """Gets the page cache that can be reclaimed from the content of a memory.stat file"""
+    for line in (stat or '').splitlines():
+        k, _, v = line.partition(' ')
+        if k == key:
+            return int(v)
+    return 0
+
+
+def cgroup_available_memory(root='/'):
+    """Gets the bytes of memory that the cgroup memory limit leaves for new processes, None if there is no limit.
+    Reclaimable page cache isn't counted as used"""
+    available = []
+    for limit_file, usage_file, inactive_key, controller in [('memory.max', 'memory.current', 'inactive_file', ''),
+                                                             ('memory.limit_in_bytes', 'memory.usage_in_bytes',
+                                                              'total_inactive_file', 'memory')]:
+        limits = list(cgroup_values(controller, limit_file, root))
+        usages = list(cgroup_values(controller, usage_file, root))
+        stats = list(cgroup_values(controller, 'memory.stat', root)) or [None]
+        for limit, usage in zip(limits, usages):
+            if limit == 'max' or int(limit) >= _unlimited_memory:
+                continue
+            used = max(int(usage) - _inactive_file(stats[0], inactive_key), 0)
+            available.append(max(int(limit) - used, 0))
+    return min(available) if available else None
+
+
+def system_available_memory(root='/'):
+    """Gets the bytes of memory the system has available for new processes without swapping, None if unknown"""
+    meminfo = _read(os.path.join(root, 'proc/meminfo'))
+    if meminfo is not None:
+        for line in meminfo.splitlines():
+            if line.startswith('MemAvailable:'):
+                return int(line.split()[1]) * 1024
+    if root != '/':
+        return None
+    try:
+        # macOS, free and inactive pages can be used without swapping
+        output = subprocess.check_output(['vm_stat']).decode('utf-8')
+        page_size = int(re.search(r'page size of (\d+) bytes', output).group(1))
+        pages = sum(int(re.search(r'{}:\s+(\d+)'.format(name), output).group(1))
+                    for name in ['Pages free', 'Pages inactive'])
+        return pages * page_size
+    except (OSError, subprocess.CalledProcessError, AttributeError, ValueError):
+        return None
+
+
+def affinity_cpu_count(root='/'):
+    """Gets the number of CPUs the process may be scheduled on, None if unknown"""
+    if root == '/' and hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    for line in (_read(os.path.join(root, 'proc/self/status')) or '').splitlines():
+        if line.startswith('Cpus_allowed_list:'):
+            count = 0
+            for r in line.split(':', 1)[1].strip().split(','):
+                first, _, last = r.partition('-')
+                count += int(last or first) - int(first) + 1
+            return count
+    return None
+
+
+def cpu_count(root='/'):
+    """Gets the number of CPUs zazu may keep busy, the least of the machine's CPUs, the CPU affinity of the process and
+    the cgroup CPU quota"""
+    counts = [affinity_cpu_count(root), cgroup_cpu_limit(root)]
+    if root == '/':
+        counts.append(multiprocessing.cpu_count())
+    counts = [c for c in counts if c is not None]
+    return max(min(counts), 1) if counts else 1
+
+
+def available_memory(root='/'):
+    """Gets the bytes of memory available to new processes, the least of what the system and the cgroup memory limit
+    allow, None if unknown"""
+    available = [m for m in [system_available_memory(root), cgroup_available_memory(root)] if m is not None]
+    return min(available) if available else None
+
+
+def job_count(memory_per_job=default_memory_per_job, root='/'):
+    """Gets the number of parallel jobs that can run, one per usable CPU as long as there is memory_per_job bytes of
+    available memory for each"""
+    jobs = cpu_count(root)
+    memory = available_memory(root)
+    if memory is not None:
+        jobs = min(jobs, max(memory // memory_per_job, 1))
+    return jobs
+
+
+def memory_per_job(resources_config):
+    """Gets the memory each job is expected to use from the "resources" section of zazu.yaml"""
+    try:
+        return parse_size(resources_config.get('memoryPerJob', default_memory_per_job))
+    except ValueError as e:
+        raise click.ClickException('invalid memoryPerJob in zazu.yaml: {}'.format(e))
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""reads the SCM metadata that build versions are made of, straight from the .git folder where possible. The results of
+git describe are cached since finding the nearest tag is slow in repos with many tags"""
+
+__author__ = "Nicholas Wiles"
+__copyright__ = "Copyright 2016, Lily Robotics"
+
+import collections
+import json
+import os
+import subprocess
+import zazu.util
+
+ScmMetadata = collections.namedtuple('ScmMetadata', ['branch', 'sha', 'last_tag', 'commits_past_tag'])
+
+# Bump when the content of the cache changes
+_cache_version = 1
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except (IOError, OSError):
+        return None
+
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+        return [st.st_mtime, st.st_size]
+    except OSError:
+        return None
+
+
+def find_git_dir(repo_root):
+    """Gets the git folder of a repo, following the .git file that worktrees and submodules have"""
+    path = os.path.join(repo_root, '.git')
+    content = _read(path) if os.path.isfile(path) else None
+    if content is not None and content.startswith('gitdir:'):
+        path = os.path.join(repo_root, content[len('gitdir:'):].strip())
+    return os.path.normpath(path)
+
+
+def find_common_dir(git_dir):
+    """Gets the folder that has the refs and objects, which worktrees share with the main repo"""
+    common_dir = _read(os.path.join(git_dir, 'commondir'))
+    return os.path.normpath(os.path.join(git_dir, common_dir)) if common_dir else git_dir
+
+
+def read_packed_refs(common_dir):
+    """Reads the refs that git has packed into a dictionary mapping their name to their sha"""
+    ret = {}
+    for line in (_read(os.path.join(common_dir, 'packed-refs')) or '').splitlines():
+        if line and line[0] not in '#^':
+            sha, _, name = line.partition(' ')
+            ret[name] = sha
+    return ret
+
+
+def resolve_ref(git_dir, name):
+    """Gets the sha a ref points at, following symbolic refs, None if it doesn't exist (e.g. an unborn branch)"""
+    common_dir = find_common_dir(git_dir)
+    packed_refs = None
+    for _ in range(10):
+        # HEAD and other pseudo refs belong to the worktree, the others are shared
+        value = _read(os.path.join(git_dir if '/' not in name else common_dir, name))
+        if value is None:
+            if packed_refs is None:
+                packed_refs = read_packed_refs(common_dir)
+            return packed_refs.get(name)
+        if not value.startswith('ref:'):
+            return value
+        name = value[len('ref:'):].strip()
+    return None
+
+
+def read_head(git_dir):
+    """Gets the branch that is checked out ('HEAD' if it is detached, as git rev-parse --abbrev-ref reports) and the sha
+    of the commit it is at"""
+    head = _read(os.path.join(git_dir, 'HEAD')) or ''
+    branch = 'HEAD'
+    if head.startswith('ref:'):
+        ref = head[len('ref:'):].strip()
+        if ref.startswith('refs/heads/'):
+            branch = ref[len('refs/heads/'):]
+    return branch, resolve_ref(git_dir, 'HEAD')
+
+
+def tag_state(common_dir):
+    """Describes the tags of a repo cheaply, this changes whenever tags are added, moved or removed. Loose tags are
+    created and removed by renaming, which updates the modification time of the folder they are in"""
+    state = {'packed-refs': _stat(os.path.join(common_dir, 'packed-refs')),
+             'shallow': _stat(os.path.join(common_dir, 'shallow'))}
+    tags_dir = os.path.join(common_dir, 'refs', 'tags')
+    for root, _, _ in os.walk(tags_dir):
+        state[os.path.relpath(root, tags_dir)] = _stat(root)
+    return state
+
+
+def parse_describe(output):
+    """Parses the output of git describe --long --always into the abbreviated sha, the last tag and the number of
+    commits since it"""
+    components = output.strip().split('-')
+    sha = components.pop()
+    commits_past_tag = 0
+    last_tag = None
+    if components:
+        commits_past_tag = int(components.pop())
+        last_tag = '-'.join(components)
+    return sha, last_tag, commits_past_tag
+
+
+def describe(repo_root, git_dir=None):
+    """Gets the abbreviated sha, last tag and number of commits since it of HEAD like git describe does, reusing the
+    result of the last call as long as HEAD and the tags haven't changed"""
+    git_dir = git_dir or find_git_dir(repo_root)
+    _, head_sha = read_head(git_dir)
+    if head_sha is None:
+        return None, None, 0
+    key = {'version': _cache_version, 'head': head_sha, 'tags': tag_state(find_common_dir(git_dir))}
+    cache_path = os.path.join(git_dir, 'zazu', 'describe.json')
+    try:
+        with open(cache_path) as f:
+            cached = json.load(f)
+        if cached['key'] == key:
+            return tuple(cached['describe'])
+    except (IOError, OSError, ValueError, KeyError):
+        pass
+    output = subprocess.check_output(['git', 'describe', '--always', '--long'], cwd=repo_root).decode('utf-8')
+    ret = parse_describe(output)
+    try:
+        try:
+            os.makedirs(os.path.dirname(cache_path))
+        except OSError:
+            pass
+        zazu.util.write_file_atomically(cache_path, json.dumps({'key': key, 'describe': ret}).encode('utf-8'))
+    except (IOError, OSError):
+        # The cache is only an optimization, e.g. the repo may be read only
+        pass
+    return ret
+
+
+def is_dirty(repo_root):
+    """Checks whether tracked files differ from HEAD, staged or not. This isn't cached since editing a file doesn't
+    touch anything git tracks"""
+    output = subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=repo_root)
+    return bool(output.strip())
+
+
+def read_metadata(repo_root):
+    """Gets the branch, abbreviated sha (with a -dirty suffix if there are uncommitted changes), last tag and commits
+    since the last tag of a repo"""
+    git_dir = find_git_dir(repo_root)
+    branch, _ = read_head(git_dir)
+    sha, last_tag, commits_past_tag = describe(repo_root, git_dir)
+    if sha is not None and is_dirty(repo_root):
+        sha += '-dirty'
+    return ScmMetadata(branch, sha, last_tag, commits_past_tag)
@@ -4,59 +4,419 @@
 __author__ = "Nicholas Wiles"
 __copyright__ = "Copyright 2016, Lily Robotics"
 
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 import click
+import collections
 import concurrent.futures
-import multiprocessing
+import copy
+import difflib
+import io
+import json
 import os
+import shutil
 import subprocess
+import sys
+import tempfile
+import time
 import zazu.git_helper
+import zazu.resource_helper
+import zazu.style_cache
+import zazu.util
+
+
+# The outcome of styling a single file, duration is in seconds and cached is set if the file was skipped because the
+# style cache knew it to be clean
+StyleResult = collections.namedtuple('StyleResult', ['path', 'formatter', 'violation', 'duration', 'cached'])
+
+
+def timed_call(fn, *args):
+    """Calls fn with args and returns a (return value, seconds taken) tuple, this is module level so process pools can
+    pickle it"""
+    start = time.time()
+    ret = fn(*args)
+    return ret, time.time() - start
+
+
+def fix_file(path, fix_source, config, check):
+    """Runs the content of a file through fix_source, if it changes and check isn't set the file is replaced
+    atomically, files that don't change are never written. Returns True if the content changes"""
+    with open(path, 'rb') as f:
+        original = f.read()
+    fixed = fix_source(original, config)
+    if fixed == original:
+        return False
+    if not check:
+        zazu.util.write_file_atomically(path, fixed)
+    return True
 
 
 def autopep8_file(file, config, check):
     """checks a single file to see if it is within style guidelines and optionally fixes it"""
-    ret = []
-    args = ['autopep8']
-    args += config.get('options', [])
+    return [file] if fix_file(file, autopep8_source, config, check) else []
 
-    check_args = args + ['--diff', file]
-    fix_args = args + ['--in-place', file]
 
-    output = subprocess.check_output(check_args)
-    if len(output):
+# Parsed autopep8 options, memoized per worker process since parsing them reads the autopep8 config files
+_autopep8_options = {}
+
+
+def autopep8_parsed_options(config):
+    """Parses the autopep8 options of a config the same way the autopep8 command line would"""
+    import autopep8
+    options = tuple(config.get('options', []))
+    if options not in _autopep8_options:
+        _autopep8_options[options] = autopep8.parse_args(list(options) + [''], apply_config=True)
+    return _autopep8_options[options]
+
+
+def autopep8_file_in_process(file, config, check):
+    """checks a single file to see if it is within style guidelines and optionally fixes it, using autopep8 as a library
+    so the fix is only computed once and no interpreter needs to be started"""
+    import autopep8
+    ret = []
+    encoding = autopep8.detect_encoding(file)
+    with open(file, 'rb') as f:
+        original = f.read().decode(encoding)
+    fixed = autopep8.fix_code(original, options=autopep8_parsed_options(config))
+    if fixed != original:
         if not check:
-            subprocess.check_output(fix_args)
+            zazu.util.write_file_atomically(file, fixed.encode(encoding))
         ret.append(file)
     return ret
 
 
-def autopep8(files, config, check):
-    """Concurrently dispatches multiple workers to perform autopep8"""
-    ret = []
-    with concurrent.futures.ThreadPoolExecutor(max_workers=multiprocessing.cpu_count()) as executor:
-        futures = {executor.submit(autopep8_file, f, config, check): f for f in files}
+def pipe_through(args, source):
+    """Pipes source through the stdin of a command and returns its stdout"""
+    try:
+        p = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    except OSError:
+        raise click.ClickException('{0} not found, please install it and ensure it is on your path'.format(args[0]))
+    output, _ = p.communicate(source)
+    if p.returncode:
+        raise click.ClickException('{} exited with code {}'.format(args[0], p.returncode))
+    return output
+
+
+def autopep8_source(source, config, line_ranges=None):
+    """Returns the python source (bytes) as fixed by an autopep8 subprocess, optionally only fixing the lines within
+    line_ranges (a list of 1 based, inclusive (start, end) tuples)"""
+    args = ['autopep8'] + config.get('options', [])
+    if line_ranges is None:
+        return pipe_through(args + ['-'], source)
+    # Fix from the bottom up so that line numbers of the ranges above stay valid
+    for start, end in sorted(line_ranges, reverse=True):
+        source = pipe_through(args + ['--line-range', str(start), str(end), '-'], source)
+    return source
+
+
+def autopep8_source_in_process(source, config, line_ranges=None):
+    """Returns the python source (bytes) as fixed by autopep8 used as a library, optionally only fixing the lines within
+    line_ranges (a list of 1 based, inclusive (start, end) tuples)"""
+    import autopep8
+    from lib2to3.pgen2 import tokenize
+    encoding = tokenize.detect_encoding(io.BytesIO(source).readline)[0]
+    options = autopep8_parsed_options(config)
+    fixed = source.decode(encoding)
+    if line_ranges is None:
+        fixed = autopep8.fix_code(fixed, options=options)
+    else:
+        # Fix from the bottom up so that line numbers of the ranges above stay valid
+        for start, end in sorted(line_ranges, reverse=True):
+            range_options = copy.copy(options)
+            range_options.line_range = [start, end]
+            fixed = autopep8.fix_code(fixed, options=range_options)
+    return fixed.encode(encoding)
+
+
+autopep8_engines = {
+    'subprocess': (autopep8_file, autopep8_source, concurrent.futures.ThreadPoolExecutor),
+    'inprocess': (autopep8_file_in_process, autopep8_source_in_process, concurrent.futures.ProcessPoolExecutor)
+}
+
+
+def autopep8_engine(config):
+    """Gets the (file worker, source worker, executor type) of the autopep8 engine selected by config"""
+    engine = config.get('engine', 'inprocess')
+    try:
+        return autopep8_engines[engine]
+    except KeyError:
+        raise click.ClickException('unknown autopep8 engine "{}", choose from {}'.format(
+            engine, sorted(autopep8_engines.keys())))
+
+
+def autopep8_results(files, config, check):
+    """Concurrently dispatches multiple workers to perform autopep8 and yields a StyleResult for each file as soon as it
+    is done. The "engine" config option selects whether each file is handled by an autopep8 subprocess (from a thread
+    pool) or by autopep8 as a library (in a process pool)"""
+    worker, _, executor_type = autopep8_engine(config)
+    with executor_type(max_workers=zazu.resource_helper.cpu_count()) as executor:
+        futures = {executor.submit(timed_call, worker, f, config, check): f for f in files}
         for future in concurrent.futures.as_completed(futures):
-            ret += future.result()
+            formatted, duration = future.result()
+            yield StyleResult(futures[future], 'autopep8', bool(formatted), duration, False)
+
+
+def autopep8(files, config, check):
+    """Runs autopep8 on a set of files and returns the ones that were (or would be) fixed"""
+    return [r.path for r in autopep8_results(files, config, check) if r.violation]
+
+
+def find_astyle():
+    """Gets the path of astyle, it is looked up before running it since astyle started through stdbuf being missing
+    is only reported by stdbuf's exit code"""
+    import distutils.spawn
+    ret = distutils.spawn.find_executable('astyle')
+    if ret is None:
+        raise click.ClickException('astyle not found, please install it with brew or apt-get and ensure it is on your '
+                                   'path')
     return ret
 
 
-def astyle(files, config, check):
-    """Run astyle on a set of files"""
-    ret = []
-    if len(files):
-        args = ['astyle', '-v']
-        args += config.get('options', [])
+def astyle_chunk_results(args, files, config, check, results):
+    """Runs astyle on a chunk of files, putting a StyleResult on the results queue for each file as astyle reports it
+    and None once the chunk is done. When checking astyle does a dry run. Otherwise it formats copies of the files and
+    the files it formatted are replaced with their copies atomically, so files that don't change are never touched"""
+    tmp_dir = None
+    try:
+        originals = {}
         if check:
-            args.append('--dry-run')
-        args += files
+            for f in files:
+                originals[os.path.realpath(f)] = f
+        else:
+            tmp_dir = tempfile.mkdtemp(prefix='zazu-astyle-')
+            copies = []
+            for i, f in enumerate(files):
+                # Each copy keeps its file name, astyle picks the language by extension
+                copy_path = os.path.join(tmp_dir, str(i), os.path.basename(f))
+                os.mkdir(os.path.dirname(copy_path))
+                shutil.copyfile(f, copy_path)
+                originals[os.path.realpath(copy_path)] = f
+                copies.append(copy_path)
+            files = copies
+        line_buffer = zazu.util.line_buffer_command()
         try:
-            output = subprocess.check_output(args)
+            p = subprocess.Popen(line_buffer + args + files, stdout=subprocess.PIPE, universal_newlines=True)
         except OSError:
-            raise click.ClickException('astyle not found, please install it with brew or apt-get and ensure it is on your path')
-        needle = 'Formatted  '
-        for l in output.split('\n'):
-            if l.startswith(needle):
-                ret.append(l[len(needle):])
-    return ret
+            raise click.ClickException('astyle not found, please install it with brew or apt-get and ensure it is on '
+                                       'your path')
+        start = last = time.time()
+        buffered = []
+        for line in iter(p.stdout.readline, ''):
+            for needle, violation in [('Formatted  ', True), ('Unchanged  ', False)]:
+                if line.startswith(needle):
+                    reported = line[len(needle):].rstrip('\n')
+                    path = os.path.relpath(originals[os.path.realpath(reported)])
+                    if violation and not check:
+                        with open(reported, 'rb') as f:
+                            zazu.util.write_file_atomically(path, f.read())
+                    now = time.time()
+                    result = StyleResult(path, 'astyle', violation, now - last, False)
+                    last = now
+                    if line_buffer:
+                        results.put(result)
+                    else:
+                        buffered.append(result)
+        if p.wait():
+            raise click.ClickException('astyle exited with code {}'.format(p.returncode))
+        # Without line buffering astyle's output only arrives when it exits, so share its time out evenly
+        for result in buffered:
+            results.put(result._replace(duration=(last - start) / len(buffered)))
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        results.put(None)
+
+
+def astyle_results(files, config, check):
+    """Runs astyle on a set of files, split into chunks that are balanced by file size and formatted concurrently, and
+    yields a StyleResult for each file as astyle reports it"""
+    if not files:
+        return
+    args = [find_astyle(), '-v']
+    args += config.get('options', [])
+    args.append('--dry-run' if check else '--suffix=none')
+    workers = zazu.resource_helper.cpu_count()
+    max_bytes = zazu.util.arg_max() - sum(len(a) + 1 + 8 for a in args + zazu.util.line_buffer_command())
+    # When fixing, astyle is passed the paths of copies in a temp folder rather than the paths of the files
+    extra_bytes = 0 if check else len(tempfile.gettempdir()) + len('/zazu-astyle-XXXXXXXX/') + len(str(len(files))) + 1
+    chunks = zazu.util.chunk_args(files, [os.path.getsize(f) for f in files], workers, max_bytes, extra_bytes)
+    results = queue.Queue()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(astyle_chunk_results, args, chunk, config, check, results) for chunk in chunks]
+        remaining = len(futures)
+        while remaining:
+            result = results.get()
+            if result is None:
+                remaining -= 1
+            else:
+                yield result
+        for future in futures:
+            future.result()
+
+
+def astyle(files, config, check):
+    """Runs astyle on a set of files and returns the ones that were (or would be) formatted"""
+    return [r.path for r in astyle_results(files, config, check) if r.violation]
+
+
+def align_replacement(original_lines, fixed_lines):
+    """Splits a block of lines that a formatter replaced into the smallest (original start, original end, fixed start,
+    fixed end) pieces that have the same non whitespace content, returns None if the block's non whitespace content
+    differs (i.e. the formatter did more than move whitespace around)"""
+    original_counts = [len(b''.join(l.split())) for l in original_lines]
+    fixed_counts = [len(b''.join(l.split())) for l in fixed_lines]
+    if b''.join(b''.join(original_lines).split()) != b''.join(b''.join(fixed_lines).split()):
+        return None
+    pieces = []
+    i = j = 0
+    while i < len(original_lines) or j < len(fixed_lines):
+        i0, j0 = i, j
+        original_count = fixed_count = 0
+        if i < len(original_lines):
+            original_count += original_counts[i]
+            i += 1
+        if j < len(fixed_lines):
+            fixed_count += fixed_counts[j]
+            j += 1
+        while original_count != fixed_count:
+            if original_count < fixed_count:
+                original_count += original_counts[i]
+                i += 1
+            else:
+                fixed_count += fixed_counts[j]
+                j += 1
+        pieces.append((i0, i, j0, j))
+    return pieces
+
+
+def restrict_to_line_ranges(original, fixed, line_ranges):
+    """Takes only the changes between original and fixed (bytes) that touch the lines of original within line_ranges (a
+    list of 1 based, inclusive (start, end) tuples)"""
+    original_lines = original.splitlines(True)
+    fixed_lines = fixed.splitlines(True)
+
+    def touches_range(i1, i2):
+        # Insertions touch the line they are inserted before
+        first, last = i1 + 1, max(i2, i1 + 1)
+        return any(start <= last and first <= end for start, end in line_ranges)
+
+    ret = []
+    matcher = difflib.SequenceMatcher(None, original_lines, fixed_lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal' or not touches_range(i1, i2):
+            ret += original_lines[i1:i2]
+            continue
+        pieces = align_replacement(original_lines[i1:i2], fixed_lines[j1:j2])
+        if pieces is None:
+            ret += fixed_lines[j1:j2]
+            continue
+        # Reformatting usually only moves whitespace, so take just the pieces of the block that touch the ranges
+        for pi1, pi2, pj1, pj2 in pieces:
+            if touches_range(i1 + pi1, i1 + pi2):
+                ret += fixed_lines[j1 + pj1:j1 + pj2]
+            else:
+                ret += original_lines[i1 + pi1:i1 + pi2]
+    return b''.join(ret)
+
+
+def astyle_source(source, config, line_ranges=None):
+    """Returns the source (bytes) as formatted by astyle, optionally only keeping the formatting of the lines within
+    line_ranges (a list of 1 based, inclusive (start, end) tuples)"""
+    fixed = pipe_through(['astyle'] + config.get('options', []), source)
+    if line_ranges is not None:
+        fixed = restrict_to_line_ranges(source, fixed, line_ranges)
+    return fixed
+
+
+def style_source_results(name, fix_source, executor_type, sources, config, check, line_ranges=None):
+    """Styles in memory file contents (a dictionary of path to contents) concurrently, yields a StyleResult for each
+    path as soon as it is done, it's a violation if fix_source changes the content. If not checking, changed contents
+    are written to their path. If line_ranges (a dictionary of path to line ranges) is given, only those lines are
+    styled"""
+    if not sources:
+        return
+    with executor_type(max_workers=zazu.resource_helper.cpu_count()) as executor:
+        futures = {}
+        for path, content in sources.items():
+            args = [content, config]
+            if line_ranges is not None:
+                args.append(line_ranges.get(path, []))
+            futures[executor.submit(timed_call, fix_source, *args)] = path
+        for future in concurrent.futures.as_completed(futures):
+            path = futures[future]
+            fixed, duration = future.result()
+            violation = fixed != sources[path]
+            if violation and not check:
+                zazu.util.write_file_atomically(path, fixed)
+            yield StyleResult(path, name, violation, duration, False)
+
+
+def style_sources(fix_source, executor_type, sources, config, check, line_ranges=None):
+    """Styles in memory file contents and returns the paths of the ones that fix_source changes"""
+    return sorted(r.path for r in style_source_results(None, fix_source, executor_type, sources, config, check,
+                                                       line_ranges) if r.violation)
+
+
+def astyle_version():
+    """Gets the version string of the installed astyle"""
+    try:
+        return subprocess.check_output(['astyle', '--version']).strip()
+    except OSError:
+        raise click.ClickException('astyle not found, please install it with brew or apt-get and ensure it is on your path')
+
+
+def autopep8_version():
+    """Gets the version string of the installed autopep8"""
+    import autopep8
+    return autopep8.__version__
+
+
+def cached_results(results, name, files, config, check, cache, get_formatter_id):
+    """Runs a results generator on the files that aren't known to be clean, yielding cached results for the others, and
+    records the ones that are clean afterwards"""
+    if cache is None or not files:
+        for r in results(files, config, check):
+            yield r
+        return
+    formatter_id = get_formatter_id()
+    unknown = cache.filter_unknown(formatter_id, files)
+    unknown_set = set(unknown)
+    for f in files:
+        if f not in unknown_set:
+            yield StyleResult(f, name, False, 0.0, True)
+    for r in results(unknown, config, check):
+        if not (check and r.violation):
+            cache.mark_clean(formatter_id, r.path)
+        yield r
+
+
+def cached_source_results(name, fix_source, executor_type, sources, config, check, cache, get_formatter_id,
+                          line_ranges=None):
+    """Styles the in memory file contents that aren't known to be clean, yielding cached results for the others, and
+    records the ones that are clean"""
+    if cache is None or not sources:
+        for r in style_source_results(name, fix_source, executor_type, sources, config, check, line_ranges):
+            yield r
+        return
+    formatter_id = get_formatter_id()
+    digests = {path: zazu.style_cache.hash_content(content) for path, content in sources.items()}
+    unknown = {}
+    for path, content in sorted(sources.items()):
+        if cache.is_digest_clean(formatter_id, digests[path]):
+            yield StyleResult(path, name, False, 0.0, True)
+        else:
+            unknown[path] = content
+    for r in style_source_results(name, fix_source, executor_type, unknown, config, check, line_ranges):
+        # Styling only some lines doesn't tell if the whole file is clean
+        if line_ranges is None and check and not r.violation:
+            cache.mark_digest_clean(formatter_id, digests[r.path])
+        yield r
+
+
+# Config files that autopep8 reads its defaults from
+autopep8_config_files = [os.path.expanduser('~/.config/pep8'), 'setup.cfg', 'tox.ini', '.pep8']
 
 default_astyle_paths = ['*.cpp',
                         '*.hpp',
@@ -68,49 +428,264 @@ default_exclude_paths = ['build',
                          'dependencies']
 
 
-@click.command()
-@click.pass_context
-@click.option('--check', is_flag=True, help='only check the repo for style violations, do not correct them (exit with the number of violations)')
-@click.option('--dirty', is_flag=True, help='only examine files that are staged for CI commit')
-def style(ctx, check, dirty):
-    """Style repo files or check that they are valid style"""
+# Compiled file classifiers, memoized so a long running style server only compiles them once
+_classifiers = {}
+
+
+def get_classifier(include_patterns, exclude_paths):
+    """Gets a (memoized) classifier for the given include pattern sets and exclude patterns"""
+    key = json.dumps([include_patterns, exclude_paths], sort_keys=True)
+    if key not in _classifiers:
+        _classifiers[key] = zazu.util.FileClassifier(include_patterns, exclude_paths)
+    return _classifiers[key]
+
+
+def make_cache(config):
+    """Makes the style cache for the repo of config"""
+    return zazu.style_cache.StyleCache(os.path.join(config.repo.git_dir, 'zazu', 'style_cache.json'))
+
+
+def watch_style(config, check, cache, echo=click.echo, output_format='text', delay=0.1):
+    """Styles (or checks) files of the repo described by config as they are saved, until interrupted"""
+    style_config = config.style_config()
+    if not style_config:
+        echo('no style settings found')
+        return
+    import zazu.watch_helper
+    watcher = zazu.watch_helper.make_watcher(config.repo_root, style_config.get('exclude', default_exclude_paths),
+                                             exclude_hidden=True)
+    click.echo('Watching {} for changes, press Ctrl+C to stop'.format(config.repo_root), err=True)
+    try:
+        while True:
+            # Fixed files are written again but they are clean (and not rewritten) the next time around
+            paths = zazu.watch_helper.debounced_changes(watcher, delay)
+            run_style(config, check, False, False, None, cache, echo, output_format, paths=sorted(paths))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+        if cache is not None:
+            cache.save()
+
+
+class TextReporter(object):
+    """Reports style results as human readable lines"""
+
+    def __init__(self, echo, check):
+        self._echo = echo
+        self._check = check
+
+    def result(self, result):
+        if result.violation:
+            self._echo('{}: {}'.format('Violation in' if self._check else 'Formatted', result.path))
+
+    def summary(self, violations, file_count, duration, formatters):
+        if self._check:
+            self._echo('{} files with violations in {} files'.format(violations, file_count))
+        else:
+            self._echo('{} files fixed in {} files'.format(violations, file_count))
+
+
+class JsonReporter(object):
+    """Reports style results as JSON Lines, an object for each file followed by a summary object with the time spent
+    by each formatter so slow files and formatters can be found"""
+
+    def __init__(self, echo, check):
+        self._echo = echo
+        self._check = check
+
+    def result(self, result):
+        self._echo(json.dumps({'file': result.path,
+                               'formatter': result.formatter,
+                               'violation': result.violation,
+                               'duration': round(result.duration, 6),
+                               'cached': result.cached}, sort_keys=True))
+
+    def summary(self, violations, file_count, duration, formatters):
+        self._echo(json.dumps({'summary': {'check': self._check,
+                                           'files': file_count,
+                                           'violations': violations,
+                                           'duration': round(duration, 6),
+                                           'formatters': formatters}}, sort_keys=True))
+
+
+reporters = {
+    'text': TextReporter,
+    'json': JsonReporter
+}
+
+
+class Progress(object):
+    """Shows a self updating count of styled files on stderr once a run has taken long enough to need it"""
+
+    def __init__(self, total, delay=0.5, interval=0.1):
+        self._total = total
+        self._done = 0
+        self._start = time.time()
+        self._delay = delay
+        self._interval = interval
+        self._shown = None
+
+    def update(self):
+        self._done += 1
+        now = time.time()
+        if now - self._start >= self._delay and (self._shown is None or now - self._shown >= self._interval):
+            click.echo('\rStyled {}/{} files'.format(self._done, self._total), err=True, nl=False)
+            self._shown = now
+
+    def clear(self):
+        """Erases the progress line so other output can be written"""
+        if self._shown is not None:
+            click.echo('\r\x1b[K', err=True, nl=False)
+            self._shown = None
+
+
+def run_style(config, check, dirty, changed_lines, git_index, cache, echo=click.echo, output_format='text',
+              progress=False, paths=None):
+    """Styles the files of the repo described by config (or checks them if check is set) and reports each file as
+    soon as it is done in output_format, returns the number of files with violations. If paths is given only those
+    (relative to the repo root) are candidates and nothing is reported if none of them are styled"""
+    dirty = dirty or changed_lines
     # options are specified with respect to the repo root
-    ctx.obj.check_repo()
-    os.chdir(ctx.obj.repo_root)
-    violations = []
+    os.chdir(config.repo_root)
+    start = time.time()
+    reporter = reporters[output_format](echo, check)
+    violations = 0
     file_count = 0
-    style_config = ctx.obj.style_config()
+    formatters = {}
+    style_config = config.style_config()
     if style_config:
-        if dirty:
-            dirty_files = zazu.git_helper.get_touched_files(ctx.obj.repo)
         exclude_paths = style_config.get('exclude', default_exclude_paths)
-        # astyle
         astyle_config = style_config.get('astyle', None)
-        if astyle_config is not None:
-            includes = astyle_config.get('include', default_astyle_paths)
-            files = zazu.util.scantree(ctx.obj.repo_root, includes, exclude_paths, exclude_hidden=True)
-            if dirty:
-                files = set(files).intersection(dirty_files)
-            file_count += len(files)
-            violations += astyle(files, astyle_config, check)
-
-        # autopep8
         autopep8_config = style_config.get('autopep8', None)
+        include_patterns = {}
+        if astyle_config is not None:
+            include_patterns['astyle'] = astyle_config.get('include', default_astyle_paths)
         if autopep8_config:
-            includes = autopep8_config.get('include', default_py_paths)
-            files = zazu.util.scantree(ctx.obj.repo_root, includes, exclude_paths, exclude_hidden=True)
-            if dirty:
-                files = set(files).intersection(dirty_files)
-            file_count += len(files)
-            violations += autopep8(files, autopep8_config, check)
-        if check:
-            for v in violations:
-                click.echo("Violation in: {}".format(v))
-            click.echo('{} files with violations in {} files'.format(len(violations), file_count))
-            ctx.exit(len(violations))
+            include_patterns['autopep8'] = autopep8_config.get('include', default_py_paths)
+        # Classify all candidates for all formatters in a single pass
+        classifier = get_classifier(include_patterns, exclude_paths)
+        if git_index is None:
+            git_index = style_config.get('gitIndex', False)
+        if paths is not None:
+            candidates = zazu.util.filter_excluded(paths, exclude_paths, exclude_hidden=True)
+            classified = ((path, classifier.classify(path)) for path in candidates if os.path.isfile(path))
+        elif dirty:
+            # Only staged files are candidates, so the cost is proportional to the size of the commit
+            staged_blobs = zazu.git_helper.get_staged_blobs(config.repo)
+            candidates = zazu.util.filter_excluded(sorted(staged_blobs), exclude_paths, exclude_hidden=True)
+            # When fixing, the working tree copies get fixed so they must still exist
+            classified = ((path, classifier.classify(path)) for path in candidates if check or os.path.isfile(path))
+        elif git_index:
+            candidates = zazu.util.filter_excluded(zazu.git_helper.get_indexed_and_untracked_files(config.repo),
+                                                   exclude_paths, exclude_hidden=True)
+            # Files deleted from the working tree are still in the index
+            classified = ((path, classifier.classify(path)) for path in candidates if os.path.isfile(path))
         else:
-            for v in violations:
-                click.echo("Formatted: {}".format(v))
-            click.echo('{} files fixed in {} files'.format(len(violations), file_count))
+            classified = zazu.util.scantree_classified(config.repo_root, classifier, exclude_paths, exclude_hidden=True)
+        files = {name: [] for name in include_patterns}
+        for path, names in classified:
+            for name in names:
+                files[name].append(path)
+
+        def read_sources(paths):
+            if check:
+                # Check the staged content rather than the working tree copy, without writing it anywhere
+                return {path: zazu.git_helper.read_blob(config.repo, staged_blobs[path]) for path in paths}
+            ret = {}
+            for path in paths:
+                with open(path, 'rb') as f:
+                    ret[path] = f.read()
+            return ret
+
+        file_count = sum(len(f) for f in files.values())
+        if paths is not None and not file_count:
+            return 0
+        progress_bar = Progress(file_count) if progress else None
+
+        def results(name, formatter, fix_source, executor_type, formatter_config, get_formatter_id):
+            if changed_lines:
+                # Line numbers refer to the staged content when checking and to the working tree copy when fixing
+                line_ranges = zazu.git_helper.get_changed_line_ranges(config.repo, files[name], staged=check)
+                return cached_source_results(name, fix_source, executor_type, read_sources(files[name]),
+                                             formatter_config, check, cache, get_formatter_id, line_ranges)
+            if dirty and check:
+                return cached_source_results(name, fix_source, executor_type, read_sources(files[name]),
+                                             formatter_config, check, cache, get_formatter_id)
+            return cached_results(formatter, name, files[name], formatter_config, check, cache, get_formatter_id)
+
+        def run(name, *args):
+            formatter_start = time.time()
+            stats = {'files': len(files[name]), 'violations': 0, 'cached': 0}
+            for r in results(name, *args):
+                if progress_bar is not None:
+                    progress_bar.update()
+                    if r.violation or output_format != 'text':
+                        progress_bar.clear()
+                stats['violations'] += r.violation
+                stats['cached'] += r.cached
+                reporter.result(r)
+            stats['duration'] = round(time.time() - formatter_start, 6)
+            formatters[name] = stats
+            return stats['violations']
+
+        try:
+            # astyle
+            if astyle_config is not None:
+                def astyle_id():
+                    return zazu.style_cache.formatter_id('astyle', astyle_version(), astyle_config.get('options', []))
+                violations += run('astyle', astyle_results, astyle_source, concurrent.futures.ThreadPoolExecutor,
+                                  astyle_config, astyle_id)
+
+            # autopep8
+            if autopep8_config:
+                def autopep8_id():
+                    return zazu.style_cache.formatter_id('autopep8', autopep8_version(),
+                                                         autopep8_config.get('options', []), autopep8_config_files)
+                _, autopep8_fix_source, executor_type = autopep8_engine(autopep8_config)
+                violations += run('autopep8', autopep8_results, autopep8_fix_source, executor_type, autopep8_config,
+                                  autopep8_id)
+        finally:
+            if progress_bar is not None:
+                progress_bar.clear()
+        if cache is not None:
+            cache.save()
+        reporter.summary(violations, file_count, time.time() - start, formatters)
     else:
-        click.echo('no style settings found')
+        echo('no style settings found')
+    return violations
+
+
+@click.command()
+@click.pass_context
+@click.option('--check', is_flag=True, help='only check the repo for style violations, do not correct them (exit with the number of violations)')
+@click.option('--dirty', is_flag=True, help='only examine files that are staged for commit, when checking the staged '
+                                            'content is examined rather than the working tree copy')
+@click.option('--no-cache', is_flag=True, help='examine all files, even those known to be clean from previous runs')
+@click.option('--changed-lines', is_flag=True,
+              help='only style the lines changed relative to HEAD in files that are staged for commit (implies --dirty)')
+@click.option('--git-index/--walk', default=None,
+              help='find files to style using the git index (honoring .gitignore) rather than walking the file system, '
+                   'defaults to the "gitIndex" style setting')
+@click.option('--serve', is_flag=True, help='run a resident style server for this repo that keeps formatters and caches '
+                                            'warm, the pre-commit hook uses it when it is running')
+@click.option('--format', 'output_format', type=click.Choice(sorted(reporters.keys())), default='text',
+              help='report each file as text lines or as JSON Lines with per file and per formatter durations')
+@click.option('--watch', is_flag=True, help='keep running and style (or check) files as they are saved')
+def style(ctx, check, dirty, no_cache, changed_lines, git_index, serve, output_format, watch):
+    """Style repo files or check that they are valid style"""
+    ctx.obj.check_repo()
+    if watch:
+        if dirty or changed_lines or serve:
+            raise click.UsageError('--watch cannot be combined with --dirty, --changed-lines or --serve')
+        watch_style(ctx.obj, check, None if no_cache else make_cache(ctx.obj), output_format=output_format)
+        return
+    if serve:
+        import zazu.style_server
+        zazu.style_server.serve(ctx.obj)
+        return
+    cache = None if no_cache else make_cache(ctx.obj)
+    violations = run_style(ctx.obj, check, dirty, changed_lines, git_index, cache, output_format=output_format,
+                           progress=sys.stderr.isatty())
+    if check:
+        ctx.exit(violations)
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""persistent cache of files known to be within style guidelines"""
+
+__author__ = "Nicholas Wiles"
+__copyright__ = "Copyright 2016, Lily Robotics"
+
+import hashlib
+import json
+import os
+import zazu.util
+
+
+def hash_content(content):
+    """Returns the hex digest used to identify a blob of file content"""
+    return hashlib.sha1(content).hexdigest()
+
+
+def formatter_id(name, version, options, config_files=()):
+    """Makes a string that uniquely identifies a formatter configuration, any change to the formatter version, its
+    options or the contents of the config files it reads invalidates all results cached for it"""
+    components = [name, version, json.dumps(options, sort_keys=True)]
+    for f in config_files:
+        try:
+            with open(f, 'rb') as config_file:
+                components.append(hash_content(config_file.read()))
+        except IOError:
+            components.append('')
+    return '\n'.join(components)
+
+
+class StyleCache(object):
+    """Remembers which (formatter, file content) pairs are known to be clean so they can be skipped on later runs.
+    File digests are memoized by path, size and mtime so unmodified files aren't even read"""
+
+    def __init__(self, path, max_entries=200000):
+        self._path = path
+        self._max_entries = max_entries
+        self._clean = set()
+        self._stats = {}
+        self._used = set()
+        self._modified = False
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+            self._clean = set(data.get('clean', []))
+            self._stats = data.get('stats', {})
+        except (IOError, ValueError):
+            pass
+
+    def digest(self, path):
+        """Returns the content digest of a file, only reading it if it changed since it was last seen"""
+        st = os.stat(path)
+        stat_key = [st.st_size, st.st_mtime]
+        entry = self._stats.get(path)
+        if entry is None or entry[:2] != stat_key:
+            with open(path, 'rb') as f:
+                entry = stat_key + [hash_content(f.read())]
+            self._stats[path] = entry
+            self._modified = True
+        return entry[2]
+
+    @staticmethod
+    def key(formatter, digest):
+        return hash_content('{}\n{}'.format(formatter, digest).encode('utf-8'))
+
+    def is_clean(self, formatter, path):
+        """Checks if a file is known to be clean for a given formatter"""
+        return self.is_digest_clean(formatter, self.digest(path))
+
+    def mark_clean(self, formatter, path):
+        """Records that a file is clean for a given formatter"""
+        self.mark_digest_clean(formatter, self.digest(path))
+
+    def is_digest_clean(self, formatter, digest):
+        """Checks if content with a given digest is known to be clean for a given formatter"""
+        key = self.key(formatter, digest)
+        if key in self._clean:
+            self._used.add(key)
+            return True
+        return False
+
+    def mark_digest_clean(self, formatter, digest):
+        """Records that content with a given digest is clean for a given formatter"""
+        key = self.key(formatter, digest)
+        self._used.add(key)
+        if key not in self._clean:
+            self._clean.add(key)
+            self._modified = True
+
+    def filter_unknown(self, formatter, files):
+        """Returns the files that are not known to be clean"""
+        return [f for f in files if not self.is_clean(formatter, f)]
+
+    def save(self):
+        """Writes the cache to disk, dropping entries that weren't used this run if it grew too big"""
+        if not self._modified:
+            return
+        if len(self._clean) > self._max_entries:
+            self._clean = set(self._used)
+        if len(self._stats) > self._max_entries:
+            self._stats = {}
+        try:
+            os.makedirs(os.path.dirname(self._path))
+        except OSError:
+            pass
+        tmp_path = '{}.tmp'.format(self._path)
+        with open(tmp_path, 'w') as f:
+            json.dump({'clean': sorted(self._clean), 'stats': self._stats}, f)
+        zazu.util.replace_file(tmp_path, self._path)
+        self._modified = False
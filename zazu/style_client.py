@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""client for the resident style server, this is run from the pre-commit hook so it only uses the standard library"""
+
+__author__ = "Nicholas Wiles"
+__copyright__ = "Copyright 2016, Lily Robotics"
+
+import json
+import os
+import socket
+import sys
+
+# Environment variables that change what git considers staged, git sets these when running hooks
+forwarded_environment = ['GIT_INDEX_FILE']
+
+
+def socket_path(git_dir):
+    """Gets the path of the style server's socket for a repo"""
+    return os.path.join(git_dir, 'zazu', 'style.sock')
+
+
+def python_path_file(git_dir):
+    """Gets the path of the file where the style server records the python interpreter that can run this client"""
+    return os.path.join(git_dir, 'zazu', 'style.python')
+
+
+def write(stream, text):
+    if not isinstance(text, str):
+        # Python 2 unicode
+        text = text.encode('utf-8')
+    stream.write(text)
+
+
+def request(path, args, out=sys.stdout, err=sys.stderr):
+    """Sends a style request to the server listening on path, streams its output and returns its exit code"""
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    connection.connect(path)
+    try:
+        env = {k: os.path.abspath(os.environ[k]) for k in forwarded_environment if k in os.environ}
+        stream = connection.makefile('rw')
+        stream.write(json.dumps({'args': args, 'env': env}) + '\n')
+        stream.flush()
+        for line in stream:
+            message = json.loads(line)
+            if 'out' in message:
+                write(out, message['out'] + '\n')
+            if 'err' in message:
+                write(err, message['err'] + '\n')
+            if 'exit' in message:
+                return message['exit']
+    finally:
+        connection.close()
+    write(err, 'style server closed the connection unexpectedly\n')
+    return 1
+
+
+def main(argv=None):
+    """Usage: python -m zazu.style_client <socket path> [style options], falls back to running "zazu style" if the
+    server is not reachable"""
+    argv = sys.argv[1:] if argv is None else argv
+    path, args = argv[0], argv[1:]
+    try:
+        code = request(path, args)
+    except socket.error:
+        os.execvp('zazu', ['zazu', 'style'] + args)
+    sys.exit(code)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""resident style server, keeps formatters, compiled pattern matchers and the style cache warm between commits"""
+
+__author__ = "Nicholas Wiles"
+__copyright__ = "Copyright 2016, Lily Robotics"
+
+import click
+import json
+import os
+import signal
+import socket
+import sys
+import traceback
+import zazu.config
+import zazu.style
+import zazu.style_client
+
+
+class _Output(object):
+    """Collects what click prints to stdout while it parses the arguments of a request"""
+
+    def __init__(self):
+        self.text = ''
+
+    def write(self, text):
+        self.text += text
+
+    def flush(self):
+        pass
+
+
+class StyleServer(object):
+    """Serves style requests from zazu.style_client over a unix socket inside the repo's git directory"""
+
+    def __init__(self, config):
+        self._repo_root = config.repo_root
+        self._config = config
+        self._config_mtime = self._project_file_mtime()
+        self._cache = zazu.style.make_cache(config)
+        self.socket_path = zazu.style_client.socket_path(config.repo.git_dir)
+        self._python_path_file = zazu.style_client.python_path_file(config.repo.git_dir)
+        self._socket = None
+        self._running = False
+
+    def _project_file_mtime(self):
+        mtimes = []
+        for name in zazu.config.PROJECT_FILE_NAMES:
+            try:
+                mtimes.append(os.path.getmtime(os.path.join(self._repo_root, name)))
+            except OSError:
+                pass
+        return max(mtimes) if mtimes else None
+
+    def config(self):
+        """Gets the repo config, reloading it if the zazu.yaml file changed"""
+        mtime = self._project_file_mtime()
+        if mtime != self._config_mtime:
+            self._config = zazu.config.Config(self._repo_root)
+            self._config_mtime = mtime
+        return self._config
+
+    def warm_up(self):
+        """Imports the formatters and compiles the file classifier so the first request is as fast as later ones"""
+        style_config = self.config().style_config()
+        if style_config.get('autopep8', None):
+            zazu.style.autopep8_parsed_options(style_config['autopep8'])
+
+    def bind(self):
+        """Creates the server socket, failing if another server is already listening on it"""
+        try:
+            os.makedirs(os.path.dirname(self.socket_path))
+        except OSError:
+            pass
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.socket_path)
+            raise click.ClickException('a style server is already running on {}'.format(self.socket_path))
+        except socket.error:
+            # Not listening, remove any stale socket left by a server that didn't exit cleanly
+            try:
+                os.remove(self.socket_path)
+            except OSError:
+                pass
+        finally:
+            probe.close()
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.bind(self.socket_path)
+        self._socket.listen(5)
+        with open(self._python_path_file, 'w') as f:
+            f.write(sys.executable)
+
+    def serve_forever(self):
+        """Handles requests one at a time until shutdown is called"""
+        self._running = True
+        try:
+            while self._running:
+                connection, _ = self._socket.accept()
+                try:
+                    if self._running:
+                        self.handle(connection)
+                except Exception:
+                    traceback.print_exc()
+                finally:
+                    connection.close()
+        finally:
+            self.close()
+
+    def shutdown(self):
+        """Stops the server after the request in progress, if any"""
+        self._running = False
+        # Wake up the accept call
+        try:
+            wake = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            wake.connect(self.socket_path)
+            wake.close()
+        except socket.error:
+            pass
+
+    def close(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+            for path in [self.socket_path, self._python_path_file]:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        self._cache.save()
+
+    def handle(self, connection):
+        """Runs a single style request and streams its output back to the client"""
+        stream = connection.makefile('rw')
+        request = json.loads(stream.readline())
+
+        def send(message):
+            stream.write(json.dumps(message) + '\n')
+            stream.flush()
+
+        saved_environment = {k: os.environ.get(k) for k in zazu.style_client.forwarded_environment}
+        os.environ.update(request.get('env', {}))
+        output = _Output()
+        try:
+            stdout = sys.stdout
+            sys.stdout = output
+            try:
+                ctx = zazu.style.style.make_context('style', list(request.get('args', [])))
+            finally:
+                sys.stdout = stdout
+            params = ctx.params
+            if params['serve'] or params['watch']:
+                raise click.UsageError('the style server cannot start another server or watch files')
+            cache = None if params['no_cache'] else self._cache
+            violations = zazu.style.run_style(self.config(), params['check'], params['dirty'], params['changed_lines'],
+                                              params['git_index'], cache, echo=lambda text: send({'out': text}),
+                                              output_format=params['output_format'])
+            send({'exit': violations if params['check'] else 0})
+        except click.ClickException as e:
+            send({'err': 'Error: {}'.format(e.format_message()), 'exit': e.exit_code})
+        except SystemExit as e:
+            # click exits once it has printed the help, pass that on to the client rather than stopping the server
+            for line in output.text.splitlines():
+                send({'out': line})
+            send({'exit': e.code if isinstance(e.code, int) else int(e.code is not None)})
+        finally:
+            for k, v in saved_environment.items():
+                if v is None:
+                    os.environ.pop(k, None)
+                else:
+                    os.environ[k] = v
+
+
+def serve(config):
+    """Runs a style server for the repo of config until interrupted"""
+    server = StyleServer(config)
+    server.warm_up()
+    server.bind()
+
+    def stop(signum, frame):
+        sys.exit(0)
+    signal.signal(signal.SIGTERM, stop)
+    click.echo('Serving style requests on {}, press Ctrl+C to stop'.format(server.socket_path))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
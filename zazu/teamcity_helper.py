@@ -255,6 +255,14 @@ def publish_artifacts(artifact_paths):
         for a in artifact_paths:
             messenger.publishArtifacts(a)
 
+
+def publish_statistics(statistics):
+    """Reports a dictionary of statistic names to numeric values to TeamCity, so they can be charted across builds"""
+    if teamcity.is_running_under_teamcity():
+        messenger = teamcity.messages.TeamcityServiceMessages()
+        for k, v in sorted(statistics.items()):
+            messenger.message('buildStatisticValue', key=k, value=str(v))
+
 # Some ideas for more TC interaction:
 # check status of builds associated with this branch
 # add support for tagging builds (releases)
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""times the phases of a build so it is clear where the time goes, the timings can be saved as a trace that the Chrome
+tracing viewer (chrome://tracing or https://ui.perfetto.dev) shows as a timeline"""
+
+__author__ = "Nicholas Wiles"
+__copyright__ = "Copyright 2016, Lily Robotics"
+
+import contextlib
+import json
+import os
+import threading
+import time
+
+
+class Tracer(object):
+    """Records how long named phases take, phases may run concurrently on several threads"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._start = time.time()
+        self._events = []
+        self._threads = {}
+
+    @contextlib.contextmanager
+    def phase(self, name, **args):
+        """Times the body of a with statement as a phase, args describe it further in the trace"""
+        start = time.time()
+        try:
+            yield
+        finally:
+            end = time.time()
+            thread = threading.current_thread()
+            with self._lock:
+                self._threads[thread.ident] = thread.name
+                self._events.append({'name': name, 'ph': 'X', 'pid': os.getpid(), 'tid': thread.ident,
+                                     'ts': int((start - self._start) * 1e6), 'dur': int((end - start) * 1e6),
+                                     'args': args})
+
+    def totals(self):
+        """Gets the total seconds spent in each phase, summed over all threads"""
+        ret = {}
+        with self._lock:
+            for e in self._events:
+                ret[e['name']] = ret.get(e['name'], 0) + e['dur'] / 1e6
+        return ret
+
+    def trace(self):
+        """Gets the phases in the Chrome trace event format"""
+        with self._lock:
+            names = [{'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': ident, 'args': {'name': name}}
+                     for ident, name in self._threads.items()]
+            return {'traceEvents': names + sorted(self._events, key=lambda e: e['ts']), 'displayTimeUnit': 'ms'}
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.trace(), f, indent=1)
+
+
+# The tracer of the command being run, commands that report their phases replace it with a fresh one
+_tracer = Tracer()
+
+
+def start():
+    """Starts timing phases from scratch, returns the tracer that they are recorded by"""
+    global _tracer
+    _tracer = Tracer()
+    return _tracer
+
+
+def phase(name, **args):
+    """Times the body of a with statement as a phase of the current command"""
+    return _tracer.phase(name, **args)
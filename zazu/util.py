@@ -12,10 +12,22 @@ except ImportError:
     except ImportError:
         # Fall back to regular raw_input
         pass
-import inquirer
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        # Fall back to listdir and stat
+        scandir = None
 import click
 import os
 import fnmatch
+import re
+import signal
+import subprocess
+import tempfile
+import threading
 
 
 def prompt(text, default=None, expected_type=str):
@@ -28,6 +40,7 @@ def prompt(text, default=None, expected_type=str):
 
 def pick(choices, message):
     if len(choices) > 1:
+        import inquirer
         click.clear()
         questions = [
             inquirer.List(' ',
@@ -42,22 +55,255 @@ def pick(choices, message):
     return choices[0]
 
 
+def compile_patterns(patterns):
+    """Combines a list of glob patterns into a single compiled regex that matches if any of them match"""
+    if not patterns:
+        return re.compile('(?!)')
+    return re.compile('|'.join('(?:{})'.format(fnmatch.translate(p)) for p in patterns))
+
+
+class FileClassifier(object):
+    """Classifies file paths against several named sets of include glob patterns at once"""
+
+    def __init__(self, include_pattern_sets, exclude_patterns):
+        self._includes = [(name, compile_patterns(patterns)) for name, patterns in sorted(include_pattern_sets.items())]
+        self._any_include = compile_patterns([p for patterns in include_pattern_sets.values() for p in patterns])
+        self._exclude = compile_patterns(exclude_patterns)
+
+    def classify(self, path):
+        """Returns the names of the pattern sets that include path"""
+        if self._any_include.match(path) is None or self._exclude.match(path) is not None:
+            return []
+        return [name for name, include in self._includes if include.match(path) is not None]
+
+    def classify_all(self, paths):
+        """Classifies many paths, returns a dictionary of pattern set names to the list of paths they include"""
+        ret = {name: [] for name, _ in self._includes}
+        for path in paths:
+            for name in self.classify(path):
+                ret[name].append(path)
+        return ret
+
+
+def _list_dir(path):
+    """Lists a directory as (name, is_dir) pairs. Symlinks to directories are left out, they aren't files and following
+    them could loop"""
+    if scandir is not None:
+        for entry in scandir(path):
+            is_dir = entry.is_dir()
+            if not (is_dir and entry.is_symlink()):
+                yield entry.name, is_dir
+    else:
+        for name in os.listdir(path):
+            full_path = os.path.join(path, name)
+            is_dir = os.path.isdir(full_path)
+            if not (is_dir and os.path.islink(full_path)):
+                yield name, is_dir
+
+
+def walk(base_path, exclude_patterns, exclude_hidden=False, rel_dir=''):
+    """Yields (path, is_dir) pairs, with paths relative to base_path, for all files and directories below rel_dir of
+    base_path, skipping directories that are in exclude_patterns (relative to base_path) and optionally hidden files
+    and directories"""
+    exclude_dirs = set([os.path.normpath(e) for e in exclude_patterns])
+    pending = [rel_dir]
+    while pending:
+        rel_dir = pending.pop()
+        try:
+            entries = list(_list_dir(os.path.join(base_path, rel_dir)))
+        except OSError:
+            continue
+        for name, is_dir in entries:
+            if exclude_hidden and name[0] == '.':
+                continue
+            rel_path = os.path.join(rel_dir, name) if rel_dir else name
+            if is_dir:
+                if rel_path not in exclude_dirs:
+                    yield rel_path, True
+                    pending.append(rel_path)
+            else:
+                yield rel_path, False
+
+
+def walk_files(base_path, exclude_patterns, exclude_hidden=False):
+    """Yields paths relative to base_path of all files below it, skipping directories that are in exclude_patterns
+    (relative to base_path) and optionally hidden files and directories"""
+    return (path for path, is_dir in walk(base_path, exclude_patterns, exclude_hidden) if not is_dir)
+
+
+def filter_excluded(paths, exclude_patterns, exclude_hidden=False):
+    """Yields the relative paths that are not within an excluded directory (or hidden, if requested), this applies the
+    same directory exclusion as walk_files to an existing list of paths"""
+    exclude_dirs = set([os.path.normpath(e) for e in exclude_patterns])
+    for path in paths:
+        components = path.split('/')
+        if exclude_hidden and any(c.startswith('.') for c in components):
+            continue
+        if any('/'.join(components[:i]) in exclude_dirs for i in range(1, len(components))):
+            continue
+        yield path
+
+
+def scantree_classified(base_path, classifier, exclude_patterns, exclude_hidden=False):
+    """Walks base_path once and yields (path, names) for each file that matches one or more of the classifier's
+    pattern sets, paths are relative to base_path"""
+    for path in walk_files(base_path, exclude_patterns, exclude_hidden):
+        names = classifier.classify(path)
+        if names:
+            yield path, names
+
+
 def scantree(base_path, include_patterns, exclude_patterns, exclude_hidden=False):
     """List files recursively that match any of the include glob patterns but are not in an excluded pattern."""
-    files = []
-    exclude_dirs = set([os.path.normpath(e) for e in exclude_patterns])
-    for dirName, subdirList, fileList in os.walk(base_path):
-        for i in xrange(len(subdirList) - 1, -1, -1):
-            sub = os.path.relpath(os.path.join(dirName, subdirList[i]))
-            if sub in exclude_dirs:
-                del subdirList[i]
-        for f in fileList:
-            if (not exclude_hidden) or (f[0] != '.'):
-                file = os.path.relpath(os.path.join(dirName, f))
-                if any(fnmatch.fnmatch(file, i) for i in include_patterns):
-                    if all(not fnmatch.fnmatch(file, e) for e in exclude_patterns):
-                        files.append(file)
-    return files
+    classifier = FileClassifier({'include': include_patterns}, exclude_patterns)
+    return [path for path, _ in scantree_classified(base_path, classifier, exclude_patterns, exclude_hidden)]
+
+
+def arg_max():
+    """Gets the number of bytes that may be used for command line arguments of a subprocess"""
+    try:
+        limit = os.sysconf('SC_ARG_MAX')
+    except (AttributeError, ValueError, OSError):
+        # Windows limits the whole command line to 32767 characters
+        limit = 32767
+    # The environment is counted against the same limit, leave some slack for the executable and its options
+    env_size = sum(len(k) + len(v) + 2 for k, v in os.environ.items())
+    return max(limit - env_size - 8192, 4096)
+
+
+def chunk_args(args, weights, max_chunks, max_bytes=None, extra_bytes=0):
+    """Splits args into at most max_chunks lists of roughly equal total weight (e.g. file size), additional chunks are
+    made if needed to keep each chunk under max_bytes of command line. Each arg may take up to extra_bytes more when it
+    is passed (e.g. if it is replaced by a longer path)"""
+    if max_bytes is None:
+        max_bytes = arg_max()
+    target_weight = float(sum(weights)) / max(min(max_chunks, len(args)), 1)
+    chunks = []
+    chunk = []
+    chunk_weight = 0
+    chunk_bytes = 0
+    for arg, weight in zip(args, weights):
+        # Each argument also costs a pointer in the argv array
+        arg_bytes = len(arg) + extra_bytes + 1 + 8
+        if chunk and (chunk_bytes + arg_bytes > max_bytes or chunk_weight >= target_weight):
+            chunks.append(chunk)
+            chunk = []
+            chunk_weight = 0
+            chunk_bytes = 0
+        chunk.append(arg)
+        chunk_weight += weight
+        chunk_bytes += arg_bytes
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+# Command prefix that line buffers a subprocess's output, memoized since finding it searches the path
+_line_buffer_command = None
+
+
+def line_buffer_command():
+    """Gets the command prefix that makes a subprocess flush its output line by line when it writes to a pipe (so its
+    progress can be followed), or an empty list if none is installed"""
+    global _line_buffer_command
+    if _line_buffer_command is None:
+        import distutils.spawn
+        _line_buffer_command = []
+        # GNU coreutils is installed with a g prefix on macOS
+        for name in ['stdbuf', 'gstdbuf']:
+            if distutils.spawn.find_executable(name):
+                _line_buffer_command = [name, '-oL']
+                break
+    return _line_buffer_command
+
+
+# Flag of the Windows MoveFileEx function that lets it replace an existing file
+_MOVEFILE_REPLACE_EXISTING = 0x1
+
+
+def replace_file(src, dst):
+    """Renames src to dst, replacing dst if it exists. os.rename doesn't replace files on Windows and Python 2 has no
+    os.replace"""
+    if hasattr(os, 'replace'):
+        os.replace(src, dst)
+    elif os.name == 'nt':
+        import ctypes
+        if not ctypes.windll.kernel32.MoveFileExW(ctypes.c_wchar_p(src), ctypes.c_wchar_p(dst),
+                                                  _MOVEFILE_REPLACE_EXISTING):
+            raise ctypes.WinError()
+    else:
+        os.rename(src, dst)
+
+
+def write_file_atomically(path, content):
+    """Replaces the content (bytes) of path with a temp file that is renamed over it, so readers never see a partially
+    written file, keeping the file's permissions"""
+    path = os.path.realpath(path)
+    try:
+        mode = os.stat(path).st_mode & 0o7777
+    except OSError:
+        mode = None
+    fd, tmp_path = tempfile.mkstemp(prefix='.{}.'.format(os.path.basename(path)), dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        if mode is not None:
+            os.chmod(tmp_path, mode)
+        replace_file(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+
+# Serializes output lines of concurrent tasks so they don't interleave mid line, prefixed output may be prefixed again
+_output_lock = threading.RLock()
+
+
+def prefixed_echo(prefix, echo=click.echo):
+    """Makes an echo function that prefixes each line it outputs, for telling apart the output of concurrent tasks"""
+    def prefixed(text):
+        with _output_lock:
+            for line in str(text).splitlines() or ['']:
+                echo(prefix + line)
+    return prefixed
+
+
+def _terminate_when_cancelled(p, cancelled):
+    while p.poll() is None:
+        if cancelled.wait(0.1):
+            try:
+                if os.name == 'posix':
+                    # Build tools and shells start processes of their own, stop them too
+                    os.killpg(p.pid, signal.SIGTERM)
+                else:
+                    p.terminate()
+            except OSError:
+                pass
+            return
+
+
+def call_prefixed(args, prefix='', echo=click.echo, cancelled=None, **kwargs):
+    """Runs a subprocess like subprocess.call but echos each line of its output (stdout and stderr combined) with a
+    prefix, so the output of subprocesses running concurrently can be multiplexed onto one stream. If a
+    threading.Event is given as cancelled, the subprocess (and the processes it started) is terminated once it is set,
+    and none is started if it is already set"""
+    output = prefixed_echo(prefix, echo)
+    if cancelled is not None:
+        if cancelled.is_set():
+            return -signal.SIGTERM
+        if os.name == 'posix':
+            kwargs['preexec_fn'] = os.setsid
+    p = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True, **kwargs)
+    if cancelled is not None:
+        watcher = threading.Thread(target=_terminate_when_cancelled, args=(p, cancelled))
+        watcher.daemon = True
+        watcher.start()
+    for line in iter(p.stdout.readline, ''):
+        output(line.rstrip('\n'))
+    ret = p.wait()
+    if cancelled is not None:
+        watcher.join()
+    return ret
 
 
 def pprint_list(data):
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""file system watching functions for zazu"""
+
+__author__ = "Nicholas Wiles"
+__copyright__ = "Copyright 2016, Lily Robotics"
+
+import click
+import errno
+import os
+import select
+import struct
+import sys
+import time
+import zazu.util
+
+# inotify event flags, see inotify(7)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+# struct inotify_event is followed by a null padded name of len bytes
+_event_header = struct.Struct('iIII')
+
+
+def load_inotify():
+    """Gets the C library if it supports inotify, None otherwise"""
+    if not sys.platform.startswith('linux'):
+        return None
+    import ctypes
+    import ctypes.util
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+def _encode_path(path):
+    return path if isinstance(path, bytes) else path.encode(sys.getfilesystemencoding())
+
+
+def _decode_name(name):
+    return name if isinstance(name, str) else name.decode(sys.getfilesystemencoding())
+
+
+class InotifyWatcher(object):
+    """Watches the files below a directory with inotify, reporting files once they are written or moved into place.
+    Paths are relative to the watched directory"""
+
+    def __init__(self, base_path, exclude_patterns, exclude_hidden=False, libc=None):
+        self._libc = libc or load_inotify()
+        self._base_path = base_path
+        self._exclude_patterns = exclude_patterns
+        self._exclude_dirs = set([os.path.normpath(e) for e in exclude_patterns])
+        self._exclude_hidden = exclude_hidden
+        self._dirs = {}
+        self._warned = False
+        self._started = False
+        self._fd = self._libc.inotify_init()
+        if self._fd < 0:
+            import ctypes
+            raise OSError(ctypes.get_errno(), 'unable to initialize inotify')
+        try:
+            self._watch('')
+        except OSError:
+            self.close()
+            raise
+        self._started = True
+
+    def _add_watch(self, rel_dir):
+        """Watches a single directory. Running out of watches while starting raises OSError, so the caller can watch
+        another way, later on a warning is shown once since part of the tree then goes unwatched"""
+        import ctypes
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+        wd = self._libc.inotify_add_watch(self._fd, _encode_path(os.path.join(self._base_path, rel_dir)), mask)
+        if wd >= 0:
+            self._dirs[wd] = rel_dir
+            return
+        error = ctypes.get_errno()
+        if error == errno.ENOENT:
+            # The directory was removed before it could be watched
+            return
+        if error == errno.ENOSPC:
+            message = 'the inotify watch limit was reached, raise it with "sysctl fs.inotify.max_user_watches"'
+            if not self._started:
+                raise OSError(error, message)
+        else:
+            message = 'unable to watch {}: {}'.format(rel_dir or '.', os.strerror(error))
+        if not self._warned:
+            self._warned = True
+            click.echo('Warning: {}, changes to some files will be missed'.format(message), err=True)
+
+    def _watch(self, rel_dir):
+        """Watches rel_dir and the directories below it, returns the files that are already in them"""
+        files = []
+        self._add_watch(rel_dir)
+        for path, is_dir in zazu.util.walk(self._base_path, self._exclude_patterns, self._exclude_hidden, rel_dir):
+            if is_dir:
+                self._add_watch(path)
+            else:
+                files.append(path)
+        return files
+
+    def read_changes(self, timeout=None):
+        """Waits up to timeout seconds (forever if None) for files to change, returns the set of changed files"""
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return set()
+        data = os.read(self._fd, 65536)
+        changes = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _event_header.unpack_from(data, offset)
+            name = _decode_name(data[offset + _event_header.size:offset + _event_header.size + length].rstrip(b'\0'))
+            offset += _event_header.size + length
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost so anything might have changed
+                changes.update(zazu.util.walk_files(self._base_path, self._exclude_patterns, self._exclude_hidden))
+                continue
+            if mask & IN_IGNORED:
+                self._dirs.pop(wd, None)
+                continue
+            rel_dir = self._dirs.get(wd)
+            if rel_dir is None or not name or (self._exclude_hidden and name[0] == '.'):
+                continue
+            rel_path = os.path.join(rel_dir, name) if rel_dir else name
+            if mask & IN_ISDIR:
+                # New directories aren't watched yet, files may have been written to them before they are
+                if rel_path not in self._exclude_dirs:
+                    changes.update(self._watch(rel_path))
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                changes.add(rel_path)
+        return changes
+
+    def close(self):
+        os.close(self._fd)
+
+
+class PollingWatcher(object):
+    """Watches the files below a directory by periodically comparing their sizes and modification times, for platforms
+    without inotify. Paths are relative to the watched directory"""
+
+    def __init__(self, base_path, exclude_patterns, exclude_hidden=False, interval=1.0):
+        self._base_path = base_path
+        self._exclude_patterns = exclude_patterns
+        self._exclude_hidden = exclude_hidden
+        self._interval = interval
+        self._snapshot = self._scan()
+
+    def _scan(self):
+        ret = {}
+        for path in zazu.util.walk_files(self._base_path, self._exclude_patterns, self._exclude_hidden):
+            try:
+                st = os.stat(os.path.join(self._base_path, path))
+            except OSError:
+                continue
+            ret[path] = (st.st_size, st.st_mtime)
+        return ret
+
+    def read_changes(self, timeout=None):
+        """Waits up to timeout seconds (forever if None) for files to change, returns the set of changed files"""
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            snapshot = self._scan()
+            changes = set(path for path, stat in snapshot.items() if self._snapshot.get(path) != stat)
+            self._snapshot = snapshot
+            if changes:
+                return changes
+            if deadline is None:
+                time.sleep(self._interval)
+            else:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return changes
+                time.sleep(min(self._interval, remaining))
+
+    def close(self):
+        pass
+
+
+def make_watcher(base_path, exclude_patterns, exclude_hidden=False):
+    """Makes an inotify watcher where it is supported, a polling watcher otherwise"""
+    libc = load_inotify()
+    if libc is not None:
+        try:
+            return InotifyWatcher(base_path, exclude_patterns, exclude_hidden, libc)
+        except OSError as e:
+            # e.g. the inotify instance or watch limit has been reached
+            click.echo('Warning: {}, polling for changes instead'.format(e.strerror), err=True)
+    return PollingWatcher(base_path, exclude_patterns, exclude_hidden)
+
+
+def debounced_changes(watcher, delay=0.1):
+    """Waits for files to change and returns them once no more changes arrive for delay seconds, so a burst of writes
+    (e.g. an editor saving several files) is handled at once"""
+    changes = watcher.read_changes()
+    while True:
+        more = watcher.read_changes(delay)
+        if not more:
+            return changes
+        changes |= more